@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+#
+# Measures how fast the protocol core chews through a NAMES burst,
+# without any sockets involved.
+
+import sys
+import time
+from pyirc.protocol import Connection
+
+if len(sys.argv) == 2:
+    rounds = int(sys.argv[1])
+else:
+    rounds = 1000
+
+burst = ''.join(':irc.server.com 353 daive = #chan :%s\r\n' % ' '.join(
+    '@nick%d' % n for n in xrange(i * 20, i * 20 + 20)) for i in xrange(50))
+burst += ':irc.server.com 366 daive #chan :End of /NAMES list.\r\n'
+
+c = Connection('daive', 'bleh')
+lines = 0
+start = time.time()
+for _ in xrange(rounds):
+    for event in c.receive_data(burst):
+        event.args
+        lines += 1
+elapsed = time.time() - start
+print '%d lines in %.2fs: %.0f lines/s' % (lines, elapsed, lines / elapsed)
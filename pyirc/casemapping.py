@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# Case-insensitive comparison of nicks and channel names.
+#
+# IRC compares names case-insensitively, with a definition of "case"
+# given by the CASEMAPPING capability. On top of ASCII letters,
+# rfc1459 considers []\^ to be the upper case of {}|~, and
+# strict-rfc1459 does the same minus the ^~ pair. Each mapping is
+# compiled into a str.translate table, so folding a name is a single
+# C call.
+
+import string
+
+_MAPPINGS = {
+    'ascii': (string.ascii_uppercase, string.ascii_lowercase),
+    'rfc1459': (string.ascii_uppercase + '[]\\^',
+                string.ascii_lowercase + '{}|~'),
+    'strict-rfc1459': (string.ascii_uppercase + '[]\\',
+                       string.ascii_lowercase + '{}|'),
+    }
+
+# Number of names key() remembers before starting over.
+DEFAULT_CACHE_SIZE = 65536
+
+
+class Casemapping(object):
+    """Case folding engine for one of the IRC casemappings.
+
+    Names are byte strings, as they come off the wire.
+    """
+    def __init__(self, name, cache_size=DEFAULT_CACHE_SIZE):
+        if name not in _MAPPINGS:
+            raise ValueError('Unknown casemapping %s' % name)
+        self.name = name
+        self.cache_size = cache_size
+        self._table = string.maketrans(*_MAPPINGS[name])
+        self._cache = {}
+
+    def __repr__(self):
+        return 'Casemapping(%r)' % self.name
+
+    def casefold(self, name):
+        """Return the canonical, lower case form of name."""
+        return name.translate(self._table)
+
+    def equal(self, a, b):
+        """Return whether a and b are the same name."""
+        return a.translate(self._table) == b.translate(self._table)
+
+    def key(self, name):
+        """Return the interned canonical form of name.
+
+        Suitable for use as a dict key: keys of equal names are the
+        same object. Recently seen names are cached.
+        """
+        key = self._cache.get(name)
+        if key is None:
+            cache = self._cache
+            if len(cache) >= self.cache_size:
+                cache.clear()
+            key = cache[name] = intern(name.translate(self._table))
+        return key
+
+
+_engines = {}
+
+def get(name):
+    """Return the shared Casemapping engine for the named mapping."""
+    engine = _engines.get(name)
+    if engine is None:
+        engine = _engines[name] = Casemapping(name)
+    return engine
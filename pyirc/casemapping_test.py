@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for casemapping
+
+import unittest
+import casemapping
+
+class TestCasemapping(unittest.TestCase):
+    def testFolding(self):
+        """Case folding of the various mappings"""
+        ascii = casemapping.get('ascii')
+        rfc = casemapping.get('rfc1459')
+        strict = casemapping.get('strict-rfc1459')
+
+        self.assertEquals(ascii.casefold('Foo[]\\^'), 'foo[]\\^')
+        self.assertEquals(rfc.casefold('Foo[]\\^'), 'foo{}|~')
+        self.assertEquals(strict.casefold('Foo[]\\^'), 'foo{}|^')
+        # Non-ASCII bytes are left alone.
+        self.assertEquals(rfc.casefold('\xc3\x89T\xc3\xa9'),
+                          '\xc3\x89t\xc3\xa9')
+
+        self.assert_(rfc.equal('[Dave]', '{dave}'))
+        self.assertFalse(ascii.equal('[Dave]', '{dave}'))
+        self.assert_(ascii.equal('Dave', 'dAVE'))
+
+        self.assertRaises(ValueError, casemapping.Casemapping, 'bleh')
+
+    def testKeys(self):
+        """Interned, cached keys"""
+        c = casemapping.Casemapping('rfc1459', cache_size=2)
+        self.assert_(c.key('Foo[') is c.key('FOO{'))
+        self.assertEquals(c.key('Foo['), 'foo{')
+        # Past the cache size, keys are still canonical.
+        for name in ('A', 'B', 'C'):
+            self.assertEquals(c.key(name), name.lower())
+        self.assert_(c.key('Foo[') is c.key('FOO{'))
+
+    def testSharedEngines(self):
+        """Engines are shared"""
+        self.assert_(casemapping.get('rfc1459') is casemapping.get('rfc1459'))
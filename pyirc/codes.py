@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# Canonical registry of IRC commands.
+#
+# Every command is identified by a code: numeric replies by their
+# value as an int, named commands by an interned, upper-cased
+# string. Codes are cheap to hash and compare, and looking one up
+# from a raw command token is a single dict access.
+
+##
+# Numeric replies
+##
+RPL_WELCOME = 1
+RPL_YOURHOST = 2
+RPL_CREATED = 3
+RPL_MYINFO = 4
+RPL_ISUPPORT = 5
+RPL_AWAY = 301
+RPL_USERHOST = 302
+RPL_WHOISUSER = 311
+RPL_WHOISSERVER = 312
+RPL_WHOISOPERATOR = 313
+RPL_ENDOFWHO = 315
+RPL_WHOISIDLE = 317
+RPL_ENDOFWHOIS = 318
+RPL_WHOISCHANNELS = 319
+RPL_CHANNELMODEIS = 324
+RPL_WHOISACCOUNT = 330
+RPL_WHOREPLY = 352
+RPL_NAMREPLY = 353
+RPL_WHOSPCRPL = 354
+RPL_ENDOFNAMES = 366
+RPL_MOTDSTART = 375
+RPL_MOTD = 372
+RPL_ENDOFMOTD = 376
+RPL_HOSTHIDDEN = 396
+ERR_NOSUCHNICK = 401
+ERR_NOSUCHCHANNEL = 403
+ERR_NOMOTD = 422
+RPL_WHOISSECURE = 671
+
+# Named commands from RFC 1459, RFC 2812 and the common IRCv3
+# extensions.
+_NAMED_COMMANDS = (
+    'ACCOUNT', 'ADMIN', 'AUTHENTICATE', 'AWAY', 'BATCH', 'CAP', 'CHGHOST',
+    'CONNECT', 'DIE', 'ERROR', 'INFO', 'INVITE', 'ISON', 'JOIN', 'KICK',
+    'KILL', 'LINKS', 'LIST', 'LUSERS', 'MODE', 'MOTD', 'NAMES', 'NICK',
+    'NOTICE', 'OPER', 'PART', 'PASS', 'PING', 'PONG', 'PRIVMSG', 'QUIT',
+    'REHASH', 'RESTART', 'SERVICE', 'SERVLIST', 'SETNAME', 'SQUERY',
+    'SQUIT', 'STATS', 'SUMMON', 'TAGMSG', 'TIME', 'TOPIC', 'TRACE', 'USER',
+    'USERHOST', 'USERS', 'VERSION', 'WALLOPS', 'WHO', 'WHOIS', 'WHOWAS')
+
+def _build_tables():
+    codes, names = {}, {}
+    for num in xrange(1000):
+        token = intern('%03d' % num)
+        codes[token] = num
+        names[num] = token
+    for cmd in _NAMED_COMMANDS:
+        cmd = intern(cmd)
+        codes[cmd] = codes[cmd.lower()] = cmd
+        names[cmd] = cmd
+    return codes, names
+
+_CODES, _NAMES = _build_tables()
+
+def command_code(token):
+    """Return the code for the command token, in any case.
+
+    Codes are returned unchanged, so that callers can accept either.
+    """
+    code = _CODES.get(token)
+    if code is None:
+        if not isinstance(token, basestring):
+            return token
+        # Unknown or mixed case command. We don't add it to the table,
+        # so that garbage from the network cannot grow it.
+        token = token.upper()
+        code = _CODES.get(token, token)
+    return code
+
+def command_name(code):
+    """Return the command token for code, as sent on the wire."""
+    return _NAMES.get(code, code)
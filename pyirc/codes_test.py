@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for codes
+
+import unittest
+import codes
+
+class TestCodes(unittest.TestCase):
+    def testCommandCode(self):
+        """Command code lookup"""
+        self.assertEquals(codes.command_code('005'), codes.RPL_ISUPPORT)
+        self.assertEquals(codes.command_code('376'), 376)
+        self.assertEquals(codes.command_code('001'), 1)
+
+        # Named commands are interned, whatever their case.
+        for token in ('PRIVMSG', 'privmsg', 'PrivMsg'):
+            self.assert_(codes.command_code(token) is
+                         codes.command_code('PRIVMSG'))
+            self.assertEquals(codes.command_code(token), 'PRIVMSG')
+
+        # Unknown commands are just upper-cased.
+        self.assertEquals(codes.command_code('foo'), 'FOO')
+
+        # Codes map to themselves.
+        self.assertEquals(codes.command_code(5), 5)
+        self.assertEquals(codes.command_code('JOIN'), 'JOIN')
+
+    def testCommandName(self):
+        """Command name lookup"""
+        self.assertEquals(codes.command_name(5), '005')
+        self.assertEquals(codes.command_name(376), '376')
+        self.assertEquals(codes.command_name('PRIVMSG'), 'PRIVMSG')
+        self.assertEquals(codes.command_name('FOO'), 'FOO')
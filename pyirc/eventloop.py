@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+#
+# A small readiness-based event loop, and a Server transport for it.
+#
+# asyncore is select() based, which falls over well before thousands
+# of connections. This loop uses epoll where available (poll
+# elsewhere), and has timers. LoopConnection drives a Server just
+# like _ConnectionDispatcher does, and plugs into the same
+# _conn_class hook:
+#
+#   loop = eventloop.EventLoop()
+#   s = Server(host, port, nick, user,
+#              _conn_class=functools.partial(eventloop.LoopConnection,
+#                                            loop=loop))
+#   loop.run()
+
+import collections
+import errno
+import fcntl
+import heapq
+import itertools
+import os
+import select
+import socket
+import time
+
+import sendqueue
+import wireproto
+
+EVENT_READ = select.POLLIN
+EVENT_WRITE = select.POLLOUT
+EVENT_ERROR = select.POLLERR | select.POLLHUP
+
+# Errors that mean the peer went away.
+_DISCONNECTED = frozenset((errno.ECONNRESET, errno.ENOTCONN,
+                           errno.ESHUTDOWN, errno.ECONNABORTED,
+                           errno.EPIPE, errno.EBADF))
+
+# Errors that mean a non-blocking operation is in progress.
+_IN_PROGRESS = frozenset((errno.EINPROGRESS, errno.EWOULDBLOCK,
+                          errno.EAGAIN, errno.EALREADY))
+
+
+class _Poller(object):
+    """Common interface over epoll and poll. Timeouts are in seconds."""
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self._poll = select.epoll()
+            self._scale = 1
+        else:
+            self._poll = select.poll()
+            self._scale = 1000
+        self.register = self._poll.register
+        self.modify = self._poll.modify
+        self.unregister = self._poll.unregister
+
+    def poll(self, timeout):
+        if timeout is None:
+            timeout = -1
+        else:
+            timeout *= self._scale
+        try:
+            return self._poll.poll(timeout)
+        except (IOError, select.error), why:
+            if why.args[0] == errno.EINTR:
+                return []
+            raise
+
+
+class Timer(object):
+    """Handle on a callback scheduled by EventLoop.call_later."""
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _Waker(object):
+    """Self-pipe that makes EventLoop.run_once return early."""
+    def __init__(self, loop):
+        self._read, self._write = os.pipe()
+        for fd in (self._read, self._write):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        loop._poller.register(self._read, EVENT_READ)
+
+    def wake(self):
+        try:
+            os.write(self._write, 'x')
+        except OSError, why:
+            # A full pipe will wake the loop all the same.
+            if why.errno not in _IN_PROGRESS:
+                raise
+
+    def handle_event(self, events):
+        try:
+            while os.read(self._read, 4096):
+                pass
+        except OSError, why:
+            if why.errno not in _IN_PROGRESS:
+                raise
+
+
+class EventLoop(object):
+    """Dispatches file descriptor readiness and timer events.
+
+    Objects registered for a file descriptor get their
+    handle_event(events) method called with a mask of EVENT_*
+    flags.
+    """
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._poller = _Poller()
+        self._handlers = {}
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._ready = collections.deque()
+        self._stopped = False
+        self._waker = _Waker(self)
+
+    def __len__(self):
+        """Number of registered file descriptors."""
+        return len(self._handlers)
+
+    def register(self, fd, handler, events):
+        self._handlers[fd] = handler
+        self._poller.register(fd, events)
+
+    def modify(self, fd, events):
+        self._poller.modify(fd, events)
+
+    def unregister(self, fd):
+        del self._handlers[fd]
+        self._poller.unregister(fd)
+
+    def call_soon(self, callback, *args):
+        """Call callback(*args) on the next loop iteration."""
+        self._ready.append((callback, args))
+
+    def call_soon_threadsafe(self, callback, *args):
+        """Like call_soon, but can be called from any thread."""
+        self._ready.append((callback, args))
+        self._waker.wake()
+
+    def call_later(self, delay, callback, *args):
+        """Call callback(*args) in delay seconds. Returns a Timer."""
+        timer = Timer(self.clock() + delay, callback, args)
+        heapq.heappush(self._timers,
+                       (timer.when, self._timer_seq.next(), timer))
+        return timer
+
+    def _run_timers(self):
+        now = self.clock()
+        timers = self._timers
+        while timers and timers[0][0] <= now:
+            timer = heapq.heappop(timers)[2]
+            if not timer.cancelled:
+                timer.callback(*timer.args)
+
+    def run_once(self, timeout=None):
+        """Wait for events for at most timeout seconds, and dispatch them."""
+        if self._ready:
+            timeout = 0
+        elif self._timers:
+            delay = max(0, self._timers[0][0] - self.clock())
+            if timeout is None or delay < timeout:
+                timeout = delay
+
+        for fd, events in self._poller.poll(timeout):
+            if fd == self._waker._read:
+                self._waker.handle_event(events)
+                continue
+            handler = self._handlers.get(fd)
+            # The handler may have been unregistered by an earlier
+            # event in this batch.
+            if handler is not None:
+                handler.handle_event(events)
+
+        self._run_timers()
+        for _ in xrange(len(self._ready)):
+            callback, args = self._ready.popleft()
+            callback(*args)
+
+    def run(self):
+        """Run until stop() is called, or there is nothing left to do."""
+        self._stopped = False
+        while (not self._stopped and
+               (self._handlers or self._timers or self._ready)):
+            self.run_once()
+
+    def stop(self):
+        self._stopped = True
+
+
+class LoopConnection(object):
+    """Server transport driven by an EventLoop.
+
+    Has the same interface and behavior as _ConnectionDispatcher.
+    """
+    # How often the handler gets to flush throttled output when the
+    # connection is otherwise idle.
+    tick_interval = 1.0
+
+    def __init__(self, host, port, ext_handler, loop, ext_sock=None):
+        self.loop = loop
+        self.ext_handler = ext_handler
+        self.send_queue = sendqueue.SendQueue()
+        self.connected = False
+        self._events = EVENT_READ | EVENT_WRITE
+
+        # Traffic accounting.
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+        if ext_sock:
+            self.socket = ext_sock
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setblocking(0)
+        self._fd = self.socket.fileno()
+        if not ext_sock:
+            err = self.socket.connect_ex((host, port))
+            if err and err not in _IN_PROGRESS:
+                raise socket.error(err, errno.errorcode.get(err, err))
+        # Connection completion is signalled by writability.
+        loop.register(self._fd, self, self._events)
+        self._tick_timer = loop.call_later(self.tick_interval, self._tick)
+
+    def output(self, data):
+        self.send_queue.append(data)
+        self._update_events()
+
+    def output_many(self, messages):
+        """Encode and queue many messages, see wireproto.encode_many."""
+        wireproto.encode_many(messages, self.send_queue.tail_buffer())
+        self._update_events()
+
+    def _update_events(self):
+        events = EVENT_READ
+        if not self.connected or len(self.send_queue):
+            events |= EVENT_WRITE
+        if events != self._events and self.socket is not None:
+            self._events = events
+            self.loop.modify(self._fd, events)
+
+    def wakeup(self):
+        """Tick the handler soon. Can be called from any thread."""
+        self.loop.call_soon_threadsafe(self._tick_once)
+
+    def _tick_once(self):
+        if self.socket is not None:
+            self.ext_handler._handle_tick()
+
+    def _tick(self):
+        self.ext_handler._handle_tick()
+        self._tick_timer = self.loop.call_later(self.tick_interval,
+                                                self._tick)
+
+    def close(self):
+        if self.socket is None:
+            return
+        self._tick_timer.cancel()
+        self.loop.unregister(self._fd)
+        self.socket.close()
+        self.socket = None
+        self.connected = False
+        self.ext_handler._handle_close()
+
+    def handle_event(self, events):
+        if not self.connected:
+            err = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                self.close()
+                return
+            if events & (EVENT_READ | EVENT_WRITE):
+                self.connected = True
+                self.ext_handler._handle_connect()
+        if events & EVENT_READ:
+            self.handle_read()
+        elif events & EVENT_ERROR:
+            self.close()
+        if self.socket is not None and len(self.send_queue):
+            self.handle_write()
+        if self.socket is not None:
+            self._update_events()
+
+    def recv_into(self, buf):
+        try:
+            n = self.socket.recv_into(buf)
+            if not n:
+                self.close()
+            self.bytes_received += n
+            return n
+        except socket.error, why:
+            if why.args[0] in _IN_PROGRESS:
+                return 0
+            if why.args[0] in _DISCONNECTED:
+                self.close()
+                return 0
+            raise
+
+    def handle_read(self):
+        self.ext_handler._handle_read(self)
+
+    def handle_write(self):
+        try:
+            sent = self.socket.send(self.send_queue.peek())
+        except socket.error, why:
+            if why.args[0] in _IN_PROGRESS:
+                return
+            if why.args[0] in _DISCONNECTED:
+                self.close()
+                return
+            raise
+        self.send_queue.consume(sent)
+        self.bytes_sent += sent
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for eventloop
+
+import socket
+import unittest
+import eventloop
+import framing
+
+class _Handler(object):
+    """Records what a LoopConnection tells its handler."""
+    def __init__(self, loop):
+        self.loop = loop
+        self.conn = None
+        self.events = []
+        self.framer = framing.LineFramer()
+
+    def _handle_connect(self):
+        self.events.append('connect')
+        self.conn.output('NICK  :foo\r\n')
+
+    def _handle_read(self, conn):
+        self.framer.recv_into(conn)
+        self.events.extend(self.framer.lines())
+
+    def _handle_tick(self):
+        pass
+
+    def _handle_close(self):
+        self.events.append('close')
+        self.loop.stop()
+
+
+class TestEventLoop(unittest.TestCase):
+    def testTimers(self):
+        """Timer and deferred callbacks"""
+        loop = eventloop.EventLoop()
+        calls = []
+        loop.call_later(0.02, calls.append, 'b')
+        loop.call_later(0.01, calls.append, 'a')
+        loop.call_later(0.01, calls.append, 'x').cancel()
+        loop.call_soon(calls.append, 'soon')
+        loop.run()
+        self.assertEquals(calls, ['soon', 'a', 'b'])
+
+    def testConnection(self):
+        """Driving a connection handler"""
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        try:
+            loop = eventloop.EventLoop()
+            handler = _Handler(loop)
+            handler.conn = eventloop.LoopConnection(
+                '127.0.0.1', listener.getsockname()[1], handler, loop)
+            peer, _ = listener.accept()
+            peer.sendall('PING :a\r\nPING :b\r\n')
+            peer.shutdown(socket.SHUT_WR)
+            loop.run()
+            self.assertEquals(handler.events,
+                              ['connect', 'PING :a', 'PING :b', 'close'])
+            self.assertEquals(peer.recv(100), 'NICK  :foo\r\n')
+            self.assertEquals(len(loop), 0)
+            peer.close()
+        finally:
+            listener.close()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Thread pool for command handlers that block.
+#
+# Handlers normally run inline on the loop thread, so one slow handler
+# holds up everything else on the connection. Handlers that do slow
+# things (database writes, HTTP calls...) can instead be run by an
+# OrderedExecutor. Jobs are submitted under a key, and jobs sharing a
+# key run one at a time, in submission order. Anything that has to
+# happen back on the loop thread is queued with call_in_loop(), and
+# run by the loop thread calling run_pending().
+
+import collections
+import threading
+import traceback
+import Queue
+
+class OrderedExecutor(object):
+    """Thread pool running jobs in order per key.
+
+    If given, notify is called from worker threads whenever there is
+    something for run_pending() to do, so that the loop thread can
+    be woken up. An executor shared by several connections wakes
+    them all, see add_notify().
+    """
+    def __init__(self, workers=4, notify=None):
+        self._notify = ()
+        if notify is not None:
+            self._notify = (notify,)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._outstanding = 0
+        # Keys with a job ready to run.
+        self._ready = Queue.Queue()
+        # Queued jobs for each key that has work in progress.
+        self._jobs = {}
+        self._callbacks = collections.deque()
+        self._threads = []
+        for _ in xrange(workers):
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, key, func, *args):
+        """Run func(*args) on a worker thread.
+
+        It won't start before all the jobs previously submitted with
+        the same key are done.
+        """
+        with self._lock:
+            self._outstanding += 1
+            jobs = self._jobs.get(key)
+            if jobs is not None:
+                jobs.append((func, args))
+                return
+            self._jobs[key] = collections.deque([(func, args)])
+        self._ready.put(key)
+
+    def _work(self):
+        while True:
+            key = self._ready.get()
+            if key is None:
+                return
+            with self._lock:
+                func, args = self._jobs[key][0]
+            try:
+                func(*args)
+            except Exception:
+                traceback.print_exc()
+            with self._lock:
+                self._outstanding -= 1
+                if not self._outstanding:
+                    self._idle.notify_all()
+                jobs = self._jobs[key]
+                jobs.popleft()
+                if not jobs:
+                    del self._jobs[key]
+                    continue
+            self._ready.put(key)
+
+    def add_notify(self, notify):
+        """Also call notify when there is something for run_pending()."""
+        self._notify += (notify,)
+
+    def remove_notify(self, notify):
+        """Stop calling a notify callback passed to add_notify()."""
+        callbacks = list(self._notify)
+        callbacks.remove(notify)
+        self._notify = tuple(callbacks)
+
+    def call_in_loop(self, func, *args):
+        """Have func(*args) called by the loop thread."""
+        self._callbacks.append((func, args))
+        for notify in self._notify:
+            notify()
+
+    def run_pending(self):
+        """Run the callbacks queued by call_in_loop()."""
+        callbacks = self._callbacks
+        for _ in xrange(len(callbacks)):
+            func, args = callbacks.popleft()
+            func(*args)
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads.
+
+        If wait is true, wait for all submitted jobs to be done first.
+        """
+        if wait:
+            with self._idle:
+                while self._outstanding:
+                    self._idle.wait()
+        for _ in self._threads:
+            self._ready.put(None)
+        if wait:
+            for t in self._threads:
+                t.join()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for executor
+
+import threading
+import time
+import unittest
+import executor
+
+class TestOrderedExecutor(unittest.TestCase):
+    def testOrdering(self):
+        """Jobs run in order per key"""
+        notified = threading.Event()
+        e = executor.OrderedExecutor(workers=4, notify=notified.set)
+        done = {'a': [], 'b': []}
+        def job(key, n):
+            # Later jobs are faster, so ordering would break if they
+            # ran concurrently.
+            time.sleep((10 - n) * 0.001)
+            done[key].append(n)
+        for n in range(10):
+            e.submit('a', job, 'a', n)
+            e.submit('b', job, 'b', n)
+        e.shutdown()
+        self.assertEquals(done, {'a': range(10), 'b': range(10)})
+        self.assertFalse(notified.is_set())
+
+    def testCallInLoop(self):
+        """Callbacks are marshalled back to the loop thread"""
+        notified = threading.Event()
+        e = executor.OrderedExecutor(workers=2, notify=notified.set)
+        threads = []
+        e.submit('a', e.call_in_loop,
+                 lambda: threads.append(threading.current_thread()))
+        notified.wait(5)
+        self.assertEquals(threads, [])
+        e.run_pending()
+        self.assertEquals(threads, [threading.current_thread()])
+        e.shutdown()
+
+    def testNotify(self):
+        """Shared executors wake every loop"""
+        a, b = threading.Event(), threading.Event()
+        e = executor.OrderedExecutor(workers=1, notify=a.set)
+        e.add_notify(b.set)
+        e.call_in_loop(lambda: None)
+        self.assert_(a.is_set() and b.is_set())
+
+        a.clear()
+        b.clear()
+        e.remove_notify(a.set)
+        e.call_in_loop(lambda: None)
+        self.assertFalse(a.is_set())
+        self.assert_(b.is_set())
+        e.shutdown()
+
+    def testErrors(self):
+        """Failing jobs don't stop the pool"""
+        e = executor.OrderedExecutor(workers=1)
+        done = []
+        e.submit('a', lambda: 1 / 0)
+        e.submit('a', done.append, 1)
+        e.shutdown()
+        self.assertEquals(done, [1])
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# Incremental line framing for the IRC byte stream.
+#
+# Incoming data is received straight into a preallocated bytearray,
+# and complete lines are sliced out of it. Data that has already been
+# scanned for a line terminator is never scanned again, and a partial
+# line is only ever moved when the buffer needs to wrap around.
+
+# RFC 1459 caps lines at 512 bytes, but plenty of servers send more
+# than that (and IRCv3 message tags add up to 8191 more). We are
+# lenient and only drop lines that are unreasonably long.
+DEFAULT_MAX_LINE_LENGTH = 8192 + 512
+
+# Amount of buffer space to offer to each recv_into() call.
+DEFAULT_READ_SIZE = 8192
+
+
+class LineFramer(object):
+    """Splits a byte stream into lines.
+
+    Both '\\r\\n' and bare '\\n' terminate a line, and the terminator
+    is stripped from the returned lines. Lines longer than
+    max_line_length, not counting the terminator, are dropped as a
+    whole, and counted in the dropped attribute.
+    """
+    def __init__(self, max_line_length=DEFAULT_MAX_LINE_LENGTH,
+                 read_size=DEFAULT_READ_SIZE):
+        self.max_line_length = max_line_length
+        self.read_size = read_size
+        self.dropped = 0
+
+        # One more byte for the '\r' of a line right at the limit.
+        self._buf = bytearray(max_line_length + 1 + read_size)
+        self._view = memoryview(self._buf)
+        # _buf[_start:_end] is received data not yet returned as a
+        # line. _buf[_start:_scan] is known not to contain '\n'.
+        self._start = 0
+        self._scan = 0
+        self._end = 0
+        # True while skipping the remainder of an overlong line.
+        self._discarding = False
+
+    def __len__(self):
+        """Number of buffered bytes that are not yet part of a line."""
+        return self._end - self._start
+
+    def _make_room(self):
+        """Ensure at least read_size bytes are free after _end."""
+        if len(self._buf) - self._end >= self.read_size:
+            return
+        pending = self._end - self._start
+        self._buf[:pending] = self._view[self._start:self._end]
+        self._scan -= self._start
+        self._start = 0
+        self._end = pending
+
+    def recv_into(self, sock):
+        """Receive data from sock into the framing buffer.
+
+        sock can be anything with a socket-like recv_into method.
+        Returns the number of bytes received. lines() must be
+        exhausted between two calls, or the buffer may run out of
+        space.
+        """
+        self._make_room()
+        n = sock.recv_into(self._view[self._end:self._end + self.read_size])
+        self._end += n
+        return n
+
+    def feed(self, data):
+        """Append data to the framing buffer, generating complete lines.
+
+        This is the counterpart of recv_into() followed by lines(),
+        for data that did not come straight from a socket.
+        """
+        view = memoryview(data)
+        while len(view):
+            self._make_room()
+            n = min(len(view), self.read_size)
+            self._buf[self._end:self._end + n] = view[:n]
+            self._end += n
+            view = view[n:]
+            for line in self.lines():
+                yield line
+
+    def _trim(self):
+        """Drop a pending partial line that grew too long."""
+        if not self._discarding:
+            self.dropped += 1
+            self._discarding = True
+        self._start = self._scan = self._end = 0
+
+    def __iter__(self):
+        return self.lines()
+
+    def lines(self):
+        """Generate the complete lines currently in the buffer."""
+        buf, view = self._buf, self._view
+        while True:
+            eol = buf.find('\n', self._scan, self._end)
+            if eol == -1:
+                break
+            start = self._start
+            self._start = self._scan = eol + 1
+            if self._discarding:
+                self._discarding = False
+                continue
+            if eol > start and buf[eol - 1] == 13: # '\r'
+                eol -= 1
+            if eol - start > self.max_line_length:
+                self.dropped += 1
+                continue
+            yield view[start:eol].tobytes()
+
+        self._scan = self._end
+        # The partial line may still end with the '\r' of its
+        # terminator.
+        if len(self) > self.max_line_length + 1:
+            self._trim()
+        elif self._start == self._end:
+            # Nothing pending, rewind for free.
+            self._start = self._scan = self._end = 0
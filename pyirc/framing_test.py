@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for framing
+
+import socket
+import unittest
+import framing
+
+class TestLineFramer(unittest.TestCase):
+    def testFeed(self):
+        """Line framing of fed data"""
+        f = framing.LineFramer()
+        self.assertEquals(list(f.feed('a\r\nbc\r\n')), ['a', 'bc'])
+        self.assertEquals(len(f), 0)
+
+        # Partial lines are kept until their terminator shows up,
+        # even if the terminator is split.
+        self.assertEquals(list(f.feed('ab')), [])
+        self.assertEquals(list(f.feed('cd\r')), [])
+        self.assertEquals(len(f), 5)
+        self.assertEquals(list(f.feed('\nef\r\n')), ['abcd', 'ef'])
+
+        # Bare LF terminators, and empty lines.
+        self.assertEquals(list(f.feed('gh\nij\r\n\r\n')), ['gh', 'ij', ''])
+
+    def testTrickle(self):
+        """Line framing of byte-by-byte data"""
+        f = framing.LineFramer(max_line_length=16, read_size=4)
+        lines = []
+        for c in 'PING :foo\r\nPING :bar\r\n' * 10:
+            lines.extend(f.feed(c))
+        self.assertEquals(lines, ['PING :foo', 'PING :bar'] * 10)
+        self.assertEquals(f.dropped, 0)
+
+    def testMaxLineLength(self):
+        """Overlong lines are dropped"""
+        f = framing.LineFramer(max_line_length=8, read_size=4)
+        self.assertEquals(list(f.feed('abcdefghijkl\r\nok\r\n')), ['ok'])
+        self.assertEquals(f.dropped, 1)
+
+        # Same thing, with the overlong line trickling in.
+        for c in 'abcdefghijklmnopqrstuvwxyz':
+            self.assertEquals(list(f.feed(c)), [])
+        self.assertEquals(list(f.feed('\nok2\n')), ['ok2'])
+        self.assertEquals(f.dropped, 2)
+
+        # Lines right at the limit are fine.
+        self.assertEquals(list(f.feed('12345678\n')), ['12345678'])
+        self.assertEquals(f.dropped, 2)
+        self.assertEquals(list(f.feed('12345678\r\n')), ['12345678'])
+        self.assertEquals(f.dropped, 2)
+        self.assertEquals(list(f.feed('123456789\r\n')), [])
+        self.assertEquals(f.dropped, 3)
+
+        # Same thing, with the line trickling in.
+        for c in '12345678\r':
+            self.assertEquals(list(f.feed(c)), [])
+        self.assertEquals(list(f.feed('\n')), ['12345678'])
+        self.assertEquals(f.dropped, 3)
+
+    def testRecvInto(self):
+        """Line framing straight from a socket"""
+        a, b = socket.socketpair()
+        try:
+            f = framing.LineFramer()
+            a.sendall('PING :1\r\nPING')
+            self.assertEquals(f.recv_into(b), 13)
+            self.assertEquals(list(f.lines()), ['PING :1'])
+            a.sendall(' :2\r\n')
+            f.recv_into(b)
+            self.assertEquals(list(f), ['PING :2'])
+        finally:
+            a.close()
+            b.close()
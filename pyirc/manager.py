@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# Runs many Server connections in a single process.
+
+import functools
+
+import eventloop
+import server
+
+class ConnectionManager(object):
+    """Owns a fleet of Servers sharing one EventLoop.
+
+    Connections are started no faster than one every connect_interval
+    seconds, so that adding a thousand of them doesn't hammer the
+    network, or get us throttled by the servers.
+
+    If given, profile_cache is a profile_cache.ProfileCache shared by
+    all the Servers.
+    """
+    def __init__(self, loop=None, connect_interval=0.1,
+                 server_class=server.Server, profile_cache=None):
+        if loop is None:
+            loop = eventloop.EventLoop()
+        self.loop = loop
+        self.connect_interval = connect_interval
+        self.server_class = server_class
+        self.profile_cache = profile_cache
+        self.servers = []
+
+        self._next_connect = 0
+        self._pending = 0
+        self._last_stats = (loop.clock(), {})
+
+    def add_server(self, host, port, nick, user, realname='nobody',
+                   setup=None):
+        """Schedule a connection to host:port.
+
+        The Server is created when the connection is started. If
+        setup is given, it is called with the new Server before any
+        event is delivered to it, which is the time to add handlers.
+        """
+        now = self.loop.clock()
+        start = max(now, self._next_connect)
+        self._next_connect = start + self.connect_interval
+        self._pending += 1
+        self.loop.call_later(start - now, self._start, host, port, nick,
+                             user, realname, setup)
+
+    def _start(self, host, port, nick, user, realname, setup):
+        self._pending -= 1
+        s = self.server_class(
+            host, port, nick, user, realname,
+            profile_cache=self.profile_cache,
+            _conn_class=functools.partial(eventloop.LoopConnection,
+                                          loop=self.loop))
+        self.servers.append(s)
+        if setup is not None:
+            setup(s)
+
+    def run(self):
+        """Run the event loop, see EventLoop.run."""
+        self.loop.run()
+
+    def stats(self):
+        """Return aggregate statistics as a dict.
+
+        Rates are averages since the previous call to stats(), or
+        since the manager was created.
+        """
+        stats = {'pending': self._pending,
+                 'connected': 0,
+                 'bytes_received': 0,
+                 'lines_received': 0,
+                 'bytes_sent': 0}
+        for s in self.servers:
+            conn = s._conn
+            if conn.connected:
+                stats['connected'] += 1
+            stats['bytes_received'] += conn.bytes_received
+            stats['lines_received'] += s.protocol.lines_received
+            stats['bytes_sent'] += conn.bytes_sent
+
+        now = self.loop.clock()
+        last_time, last = self._last_stats
+        elapsed = now - last_time
+        for key in ('bytes_received', 'lines_received', 'bytes_sent'):
+            if elapsed > 0:
+                rate = (stats[key] - last.get(key, 0)) / elapsed
+            else:
+                rate = 0.0
+            stats[key + '_per_second'] = rate
+        self._last_stats = (now, stats)
+        return stats
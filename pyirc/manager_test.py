@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for manager
+
+import socket
+import unittest
+import manager
+
+class TestConnectionManager(unittest.TestCase):
+    def testFleet(self):
+        """Running several connections"""
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(5)
+        port = listener.getsockname()[1]
+        peers = []
+        try:
+            m = manager.ConnectionManager(connect_interval=0.01)
+            started = []
+            for i in range(3):
+                m.add_server('127.0.0.1', port, 'nick%d' % i, 'user',
+                             setup=started.append)
+            self.assertEquals(m.stats()['pending'], 3)
+
+            # Connections start one at a time.
+            m.loop.run_once()
+            self.assertEquals(len(started), 1)
+            while len(started) < 3:
+                m.loop.run_once()
+            self.assertEquals(started, m.servers)
+
+            for i in range(3):
+                peer, _ = listener.accept()
+                peer.sendall('PONG :x\r\nPONG :y\r\n')
+                peers.append(peer)
+            while sum(s.ignored_commands for s in m.servers) < 6:
+                m.loop.run_once()
+
+            stats = m.stats()
+            self.assertEquals(stats['pending'], 0)
+            self.assertEquals(stats['connected'], 3)
+            self.assertEquals(stats['lines_received'], 6)
+            self.assertEquals(stats['bytes_received'], 3 * 18)
+            self.assert_(stats['bytes_sent'] > 0)
+        finally:
+            for peer in peers:
+                peer.close()
+            listener.close()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+#
+# Matching hostmasks against large lists of wildcard masks.
+#
+# Ban, ignore and ACL lists are lists of nick!user@host masks where *
+# and ? are wildcards. Checking a user against each of them in turn
+# gets slow when there are thousands. A MaskIndex files every mask
+# under the most selective part it can find:
+#
+#  - masks with a literal host, in a dict by host,
+#  - masks with a host like *.isp.net, in a trie of host labels read
+#    from the right,
+#  - masks with a wildcard host but a literal nick, in a dict by
+#    nick,
+#  - and the rest in a bucket that is always checked.
+#
+# Looking up a hostmask then only checks the masks that can possibly
+# match, which costs about the length of the hostmask.
+
+import re
+
+import casemapping
+
+def normalize(mask):
+    """Return the full nick!user@host form of a mask.
+
+    Like servers do, 'nick' means 'nick!*@*', 'user@host' means
+    '*!user@host', and 'host.name' means '*!*@host.name'.
+    """
+    if '!' in mask:
+        nick, rest = mask.split('!', 1)
+        if '@' not in rest:
+            rest += '@*'
+        user, host = rest.split('@', 1)
+    elif '@' in mask:
+        nick = '*'
+        user, host = mask.split('@', 1)
+    elif '.' in mask or ':' in mask:
+        nick, user, host = '*', '*', mask
+    else:
+        nick, user, host = mask, '*', '*'
+    return '%s!%s@%s' % (nick or '*', user or '*', host or '*')
+
+def _is_literal(pattern):
+    return '*' not in pattern and '?' not in pattern
+
+def _compile(pattern):
+    """Compile a wildcard pattern.
+
+    Returns None for patterns matching anything, the pattern itself if
+    it has no wildcards, and a regular expression otherwise.
+    """
+    if pattern.strip('*') == '':
+        return None
+    if _is_literal(pattern):
+        return pattern
+    regex = []
+    for c in pattern:
+        if c == '*':
+            if not regex or regex[-1] != '.*':
+                regex.append('.*')
+        elif c == '?':
+            regex.append('.')
+        else:
+            regex.append(re.escape(c))
+    regex.append(r'\Z')
+    return re.compile(''.join(regex), re.DOTALL)
+
+def _part_matches(pattern, value):
+    if pattern is None:
+        return True
+    if pattern.__class__ is str:
+        return pattern == value
+    return pattern.match(value) is not None
+
+
+class _Entry(object):
+    __slots__ = ('mask', 'value', 'nick', 'user', 'host')
+
+    def __init__(self, mask, value, nick, user, host):
+        self.mask = mask
+        self.value = value
+        self.nick = _compile(nick)
+        self.user = _compile(user)
+        self.host = _compile(host)
+
+    def matches(self, nick, user, host):
+        return (_part_matches(self.nick, nick) and
+                _part_matches(self.user, user) and
+                _part_matches(self.host, host))
+
+
+class MaskIndex(object):
+    """Index of wildcard hostmasks, each with a value.
+
+    Names are compared according to casemapper, a
+    casemapping.Casemapping (rfc1459 by default). Hosts are split on
+    dots, so *.isp.net style masks are looked up label by label.
+    """
+    def __init__(self, casemapper=None):
+        if casemapper is None:
+            casemapper = casemapping.get('rfc1459')
+        self.casemapper = casemapper
+        # Casefolded normalized mask -> _Entry
+        self._entries = {}
+        self._by_host = {}
+        # Trie nodes are (children by label, entries) pairs.
+        self._suffixes = ({}, {})
+        self._by_nick = {}
+        self._others = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, mask):
+        return self._key(mask) in self._entries
+
+    def _key(self, mask):
+        return self.casemapper.casefold(normalize(mask))
+
+    def _classify(self, key):
+        """Return where the mask key is filed, as (kind, name)."""
+        nick, rest = key.split('!', 1)
+        host = rest.split('@', 1)[1]
+        if _is_literal(host):
+            return 'host', host
+        if host.startswith('*.') and _is_literal(host[2:]):
+            return 'suffix', host[2:]
+        if _is_literal(nick):
+            return 'nick', nick
+        return 'other', None
+
+    def add(self, mask, value=None):
+        """Add mask, or replace its value if it is already there."""
+        key = self._key(mask)
+        nick, rest = key.split('!', 1)
+        user, host = rest.split('@', 1)
+        entry = self._entries[key] = _Entry(mask, value, nick, user, host)
+
+        kind, name = self._classify(key)
+        if kind == 'host':
+            bucket = self._by_host.setdefault(name, {})
+        elif kind == 'suffix':
+            node = self._suffixes
+            for label in reversed(name.split('.')):
+                node = node[0].setdefault(label, ({}, {}))
+            bucket = node[1]
+        elif kind == 'nick':
+            bucket = self._by_nick.setdefault(name, {})
+        else:
+            bucket = self._others
+        bucket[key] = entry
+
+    def remove(self, mask):
+        """Remove mask. Raises KeyError if it isn't there."""
+        key = self._key(mask)
+        del self._entries[key]
+
+        kind, name = self._classify(key)
+        if kind == 'suffix':
+            labels = list(reversed(name.split('.')))
+            path = [self._suffixes]
+            for label in labels:
+                path.append(path[-1][0][label])
+            del path[-1][1][key]
+            # Prune the nodes left empty.
+            while len(path) > 1 and not (path[-1][0] or path[-1][1]):
+                path.pop()
+                del path[-1][0][labels[len(path) - 1]]
+        elif kind == 'other':
+            del self._others[key]
+        else:
+            buckets = self._by_host if kind == 'host' else self._by_nick
+            bucket = buckets[name]
+            del bucket[key]
+            if not bucket:
+                del buckets[name]
+
+    def set_casemapper(self, casemapper):
+        """Switch to another casemapping, rebuilding the index."""
+        entries = self._entries.values()
+        self.__init__(casemapper)
+        for entry in entries:
+            self.add(entry.mask, entry.value)
+
+    def match(self, nick, user, host):
+        """Return the (mask, value) pairs of the masks matching."""
+        casefold = self.casemapper.casefold
+        nick, user, host = casefold(nick), casefold(user), casefold(host)
+        candidates = [self._others]
+        bucket = self._by_host.get(host)
+        if bucket:
+            candidates.append(bucket)
+        bucket = self._by_nick.get(nick)
+        if bucket:
+            candidates.append(bucket)
+        labels = host.split('.')
+        node = self._suffixes
+        # *.isp.net needs at least one more label in front of isp.net.
+        for i in xrange(len(labels) - 1, 0, -1):
+            node = node[0].get(labels[i])
+            if node is None:
+                break
+            if node[1]:
+                candidates.append(node[1])
+
+        matches = []
+        for bucket in candidates:
+            for entry in bucket.itervalues():
+                if entry.matches(nick, user, host):
+                    matches.append((entry.mask, entry.value))
+        return matches
+
+    def match_hostmask(self, hostmask):
+        """Like match(), for a nick!user@host string."""
+        nick, _, rest = hostmask.partition('!')
+        user, _, host = rest.partition('@')
+        return self.match(nick, user, host)
+
+    def match_message(self, msg):
+        """Like match(), for the sender of a wireproto.Message."""
+        return self.match(msg.nick or '', msg.user or '', msg.host or '')
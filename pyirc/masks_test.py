@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for masks
+
+import unittest
+
+import casemapping
+import masks
+import wireproto
+
+class TestMasks(unittest.TestCase):
+    def testNormalize(self):
+        """Short masks are expanded"""
+        self.assertEquals(masks.normalize('nick'), 'nick!*@*')
+        self.assertEquals(masks.normalize('nick!user'), 'nick!user@*')
+        self.assertEquals(masks.normalize('user@host'), '*!user@host')
+        self.assertEquals(masks.normalize('*.isp.net'), '*!*@*.isp.net')
+        self.assertEquals(masks.normalize('a!@'), 'a!*@*')
+
+    def testMatching(self):
+        """Every kind of mask matches what it should"""
+        index = masks.MaskIndex()
+        index.add('*!*@host.example.com', 'host')
+        index.add('*!*@*.isp.net', 'suffix')
+        index.add('Bad[Nick]', 'nick')
+        index.add('*!~*@*', 'other')
+        index.add('*!user?@10.0.*', 'ip')
+        self.assertEquals(len(index), 5)
+
+        def values(hostmask):
+            return sorted(v for _, v in index.match_hostmask(hostmask))
+        self.assertEquals(values('a!u@HOST.example.com'), ['host'])
+        self.assertEquals(values('a!u@dsl-1.pool.isp.net'), ['suffix'])
+        self.assertEquals(values('a!u@.isp.net'), ['suffix'])
+        self.assertEquals(values('a!u@isp.net'), [])
+        self.assertEquals(values('a!u@notisp.net'), [])
+        self.assertEquals(values('bad{nick}!~u@x.isp.net'),
+                          ['nick', 'other', 'suffix'])
+        self.assertEquals(values('a!user1@10.0.0.1'), ['ip'])
+        self.assertEquals(values('a!user@10.0.0.1'), [])
+        self.assertEquals(
+            index.match_message(wireproto.decode(':a!u@h.isp.net PING x')),
+            [('*!*@*.isp.net', 'suffix')])
+
+    def testAddRemove(self):
+        """Masks come and go"""
+        index = masks.MaskIndex()
+        for mask in ('*!*@*.isp.net', '*!*@*.dsl.isp.net', 'nick',
+                     '*!*@host', '*!*x@*'):
+            index.add(mask)
+        index.add('*!*@*.ISP.net', 'updated')
+        self.assertEquals(len(index), 5)
+        self.assertEquals(sorted(index.match('a', 'u', 'a.dsl.isp.net')),
+                          [('*!*@*.ISP.net', 'updated'),
+                           ('*!*@*.dsl.isp.net', None)])
+        for mask in ('*!*@*.isp.net', '*!*@*.dsl.isp.net', 'NICK',
+                     '*!*@host', '*!*x@*'):
+            self.assert_(mask in index)
+            index.remove(mask)
+        self.assertEquals(len(index), 0)
+        self.assertEquals(index._suffixes, ({}, {}))
+        self.assertEquals(index._by_host, {})
+        self.assertEquals(index._by_nick, {})
+        self.assertRaises(KeyError, index.remove, 'nick')
+
+    def testCasemapping(self):
+        """Masks are compared with the casemapping"""
+        index = masks.MaskIndex(casemapping.get('ascii'))
+        index.add('nick[away]')
+        self.assertEquals(index.match('NICK{away}', 'u', 'h'), [])
+        index.set_casemapper(casemapping.get('rfc1459'))
+        self.assertEquals(index.match('NICK{away}', 'u', 'h'),
+                          [('nick[away]', None)])
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# Parsing of MODE changes.
+#
+# Whether a mode letter consumes a parameter depends on CHANMODES and
+# PREFIX. Rather than checking each letter against those every time,
+# a ModeParser compiles them into a single table mapping each mode
+# letter to everything the parser needs to know about it. The table
+# is only rebuilt when either capability changes, so a burst of MODE
+# lines costs one dict lookup per mode letter.
+
+import server_capabilities as scap
+
+# Mode kind of PREFIX modes, next to the CHANMODE_* kinds.
+MODE_PREFIX = 4
+
+# Table entry of unknown modes: no parameter either way.
+_UNKNOWN = (False, False, scap.CHANMODE_NO_PARAM, None)
+
+
+def compile_table(chanmodes, prefix_modes):
+    """Build the mode table for the given CHANMODES and PREFIX modes.
+
+    The table maps mode letters to (param on add, param on remove,
+    kind, rank) tuples, kind being a CHANMODE_* constant or
+    MODE_PREFIX, and rank the position of PREFIX modes in PREFIX (0
+    is the most powerful), None for other modes.
+    """
+    table = {}
+    if chanmodes:
+        for mode in chanmodes[scap.CHANMODE_LIST]:
+            table[mode] = (True, True, scap.CHANMODE_LIST, None)
+        for mode in chanmodes[scap.CHANMODE_PARAM_ALWAYS]:
+            table[mode] = (True, True, scap.CHANMODE_PARAM_ALWAYS, None)
+        for mode in chanmodes[scap.CHANMODE_PARAM_ADDONLY]:
+            table[mode] = (True, False, scap.CHANMODE_PARAM_ADDONLY, None)
+        for mode in chanmodes[scap.CHANMODE_NO_PARAM]:
+            table[mode] = (False, False, scap.CHANMODE_NO_PARAM, None)
+    for rank, mode in enumerate(prefix_modes):
+        table[mode] = (True, True, MODE_PREFIX, rank)
+    return table
+
+
+_tables = {}
+
+def get_table(chanmodes, prefix_modes):
+    """Return the shared mode table for CHANMODES and PREFIX modes.
+
+    Tables are compiled once and shared by all the connections with
+    the same modes.
+    """
+    if chanmodes:
+        key = (tuple(chanmodes[k] for k in sorted(chanmodes)), prefix_modes)
+    else:
+        key = (None, prefix_modes)
+    table = _tables.get(key)
+    if table is None:
+        table = _tables[key] = compile_table(chanmodes, prefix_modes)
+    return table
+
+
+class ModeParser(object):
+    """Parses channel MODE changes for a connection.
+
+    capabilities is the ServerCapabilities of the connection.
+    """
+    def __init__(self, capabilities):
+        self.capabilities = capabilities
+        self._chanmodes = self._prefix_modes = None
+        self._table = None
+
+    @property
+    def table(self):
+        """The compiled mode table, see compile_table()."""
+        caps = self.capabilities
+        chanmodes, prefix_modes = caps.chanmodes, caps.prefix_modes
+        if (self._table is None or chanmodes is not self._chanmodes or
+            prefix_modes is not self._prefix_modes):
+            self._table = get_table(chanmodes, prefix_modes)
+            self._chanmodes = chanmodes
+            self._prefix_modes = prefix_modes
+        return self._table
+
+    def parse(self, args):
+        """Parse the arguments of a channel MODE after the channel.
+
+        Returns a list of (adding, mode, param) tuples, param being None
+        for modes without one. For example, ['+ov-k', 'a', 'b', 'key']
+        gives [(True, 'o', 'a'), (True, 'v', 'b'), (False, 'k', 'key')].
+        Modes missing their parameter, as in list queries like 'MODE
+        #chan +b', get None.
+        """
+        table = self.table
+        changes = []
+        params = iter(args[1:])
+        adding = True
+        for mode in args[0]:
+            if mode == '+':
+                adding = True
+            elif mode == '-':
+                adding = False
+            else:
+                entry = table.get(mode, _UNKNOWN)
+                if entry[0] if adding else entry[1]:
+                    changes.append((adding, mode, next(params, None)))
+                else:
+                    changes.append((adding, mode, None))
+        return changes
+
+    def parse_message(self, msg):
+        """Parse a MODE message into (target, changes).
+
+        User modes never have parameters. Queries without any mode,
+        like 'MODE #chan', give no changes.
+        """
+        target = msg.args[0]
+        if len(msg.args) < 2:
+            return target, []
+        if self.capabilities.is_channel(target):
+            return target, self.parse(msg.args[1:])
+        changes = []
+        adding = True
+        for mode in msg.args[1]:
+            if mode == '+':
+                adding = True
+            elif mode == '-':
+                adding = False
+            else:
+                changes.append((adding, mode, None))
+        return target, changes
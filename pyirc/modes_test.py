@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for modes
+
+import unittest
+import modes
+import server_capabilities as scap
+import wireproto
+
+class TestModeParser(unittest.TestCase):
+    def setUp(self):
+        self.caps = scap.ServerCapabilities()
+        self.caps.chanmodes = 'beI,k,l,imnt'
+        self.parser = modes.ModeParser(self.caps)
+
+    def testParse(self):
+        """Parameters are taken according to CHANMODES and PREFIX"""
+        self.assertEquals(
+            self.parser.parse(['+ovbl-k', 'a', 'b', '*!*@x', '10', 'key']),
+            [(True, 'o', 'a'), (True, 'v', 'b'), (True, 'b', '*!*@x'),
+             (True, 'l', '10'), (False, 'k', 'key')])
+        # Type C modes only take a parameter when set.
+        self.assertEquals(self.parser.parse(['-l+m-o', 'a']),
+                          [(False, 'l', None), (True, 'm', None),
+                           (False, 'o', 'a')])
+        # List queries and unknown modes.
+        self.assertEquals(self.parser.parse(['b']), [(True, 'b', None)])
+        self.assertEquals(self.parser.parse(['+Xk', 'key']),
+                          [(True, 'X', None), (True, 'k', 'key')])
+
+    def testTable(self):
+        """The table is rebuilt only when capabilities change"""
+        table = self.parser.table
+        self.assertEquals(table['o'], (True, True, modes.MODE_PREFIX, 0))
+        self.assertEquals(table['v'], (True, True, modes.MODE_PREFIX, 1))
+        self.assertEquals(table['l'],
+                          (True, False, scap.CHANMODE_PARAM_ADDONLY, None))
+        self.assert_(self.parser.table is table)
+
+        self.caps.prefix = '(qov)~@+'
+        table = self.parser.table
+        self.assertEquals(table['q'], (True, True, modes.MODE_PREFIX, 0))
+        self.assert_(self.parser.table is table)
+        self.caps.chanmodes = 'beI,k,lL,imnt'
+        self.assert_(self.parser.table is not table)
+
+    def testSharedTables(self):
+        """Parsers with the same modes share a table"""
+        caps = scap.ServerCapabilities()
+        caps.chanmodes = 'beI,k,l,imnt'
+        self.assert_(modes.ModeParser(caps).table is self.parser.table)
+
+    def testParseMessage(self):
+        """Channel and user MODE messages"""
+        msg = wireproto.decode(':me!me@host MODE #chan +o-v a b')
+        self.assertEquals(self.parser.parse_message(msg),
+                          ('#chan', [(True, 'o', 'a'), (False, 'v', 'b')]))
+        msg = wireproto.decode(':me MODE me :+iw-o')
+        self.assertEquals(self.parser.parse_message(msg),
+                          ('me', [(True, 'i', None), (True, 'w', None),
+                                  (False, 'o', None)]))
+        # Mode queries.
+        msg = wireproto.decode('MODE #chan')
+        self.assertEquals(self.parser.parse_message(msg), ('#chan', []))
+        msg = wireproto.decode('MODE me')
+        self.assertEquals(self.parser.parse_message(msg), ('me', []))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# On-disk cache of server capabilities.
+#
+# Until RPL_ISUPPORT arrives, a fresh connection assumes the RFC
+# defaults, and misreads anything the server sends before that which
+# depends on its real capabilities. A ProfileCache remembers the last
+# profile of each server in a small local file, so that connections
+# can start from it. Cached profiles are validated, and their mode
+# tables compiled, when the cache is loaded rather than on every
+# connect.
+
+import marshal
+import os
+
+import modes
+import profiles
+import server_capabilities
+
+def _valid_tokens(tokens):
+    """Whether a cache entry is a list of ISUPPORT tokens."""
+    if not isinstance(tokens, (list, tuple)):
+        return False
+    for token in tokens:
+        if not isinstance(token, str):
+            return False
+    return True
+
+class ProfileCache(object):
+    """Profiles by server name, stored in the file at path.
+
+    A missing or unreadable file gives an empty cache.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._profiles = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                entries = marshal.load(f)
+        except (IOError, EOFError, ValueError, TypeError):
+            return
+        if not isinstance(entries, dict):
+            return
+        for key, tokens in entries.iteritems():
+            # Dropped entries are replaced by the server's next 005.
+            if not _valid_tokens(tokens):
+                continue
+            try:
+                profile = profiles.get(tokens)
+            except (server_capabilities.CapabilityError, TypeError,
+                    AttributeError):
+                continue
+            caps = profile.capabilities
+            modes.get_table(caps.chanmodes, caps.prefix_modes)
+            self._profiles[key] = profile
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def get(self, key):
+        """Return the cached Profile for key, or None."""
+        return self._profiles.get(key)
+
+    def put(self, key, profile):
+        """Remember profile for key, and save the cache if it changed."""
+        if self._profiles.get(key) is profile:
+            return
+        self._profiles[key] = profile
+        self.save()
+
+    def save(self):
+        """Write the cache to its file."""
+        entries = dict((key, sorted(profile.tokens))
+                       for key, profile in self._profiles.iteritems())
+        # Write to the side and rename, so that a crash never leaves a
+        # truncated cache behind.
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            marshal.dump(entries, f)
+        os.rename(tmp, self.path)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for profile_cache
+
+import marshal
+import os
+import shutil
+import tempfile
+import unittest
+
+import modes
+import profile_cache
+import profiles
+
+class TestProfileCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'isupport.cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testRoundTrip(self):
+        """Profiles survive a reload"""
+        cache = profile_cache.ProfileCache(self.path)
+        self.assertEquals(len(cache), 0)
+        self.assertEquals(cache.get('irc.example.net'), None)
+
+        profile = profiles.get(['CASEMAPPING=rfc1459', 'PREFIX=(qov)~@+',
+                                'CHANMODES=beI,k,l,imntZ'])
+        cache.put('irc.example.net', profile)
+
+        cache = profile_cache.ProfileCache(self.path)
+        self.assert_(cache.get('irc.example.net') is profile)
+        self.assertEquals(profile.capabilities.casemapper.name, 'rfc1459')
+        # The mode table is ready.
+        key = (tuple(profile.capabilities.chanmodes[k] for k in range(4)),
+               'qov')
+        self.assert_(key in modes._tables)
+
+    def testBrokenFiles(self):
+        """Unreadable caches and entries are ignored"""
+        with open(self.path, 'wb') as f:
+            f.write('garbage')
+        self.assertEquals(len(profile_cache.ProfileCache(self.path)), 0)
+
+        with open(self.path, 'wb') as f:
+            marshal.dump({'good': ['NICKLEN=30'],
+                          'bad': ['CHANTYPES=#', 'CHANLIMIT=&:5']}, f)
+        cache = profile_cache.ProfileCache(self.path)
+        self.assertEquals(cache.get('good').capabilities.nicklen, 30)
+        self.assertEquals(cache.get('bad'), None)
+
+        # Entries that aren't lists of tokens at all.
+        with open(self.path, 'wb') as f:
+            marshal.dump({'good': ('NICKLEN=30',), 'ints': [1, 2],
+                          'none': [None], 'string': 'NICKLEN=30',
+                          'mixed': ['NICKLEN=30', 5], 'int': 5}, f)
+        cache = profile_cache.ProfileCache(self.path)
+        self.assertEquals(len(cache), 1)
+        self.assertEquals(cache.get('good').capabilities.nicklen, 30)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# Capabilities shared between connections.
+#
+# Connections to the same network get byte for byte the same
+# RPL_ISUPPORT lines, so there is no point in having each of them
+# parse and validate its own ServerCapabilities. A Profile is an
+# immutable set of ISUPPORT tokens with the frozen capabilities they
+# define. Profiles are interned by their tokens: connections that were
+# sent the same tokens share one Profile, which is only built once.
+# Changing a profile gives a different Profile, leaving the original
+# alone for the other connections using it.
+
+import weakref
+
+import server_capabilities
+
+def _token_name(token):
+    return token.split('=', 1)[0]
+
+
+class Profile(object):
+    """Immutable capabilities of a server, see get().
+
+    tokens is the frozenset of ISUPPORT tokens, and capabilities the
+    frozen ServerCapabilities they define.
+    """
+    __slots__ = ('tokens', 'capabilities', '_hash', '__weakref__')
+
+    def __init__(self, tokens, capabilities):
+        object.__setattr__(self, 'tokens', tokens)
+        object.__setattr__(self, 'capabilities', capabilities)
+        object.__setattr__(self, '_hash', hash(tokens))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Profiles are immutable')
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, Profile):
+            return NotImplemented
+        return self.tokens == other.tokens
+
+    def __ne__(self, other):
+        if not isinstance(other, Profile):
+            return NotImplemented
+        return self.tokens != other.tokens
+
+    def __repr__(self):
+        return 'Profile(%r)' % sorted(self.tokens)
+
+    def update(self, tokens):
+        """Return the Profile for these tokens applied on top of ours.
+
+        As in RPL_ISUPPORT, a token replaces the previous token of the
+        same name, and -NAME removes it. Returns self if nothing
+        changes.
+        """
+        current = dict((_token_name(t), t) for t in self.tokens)
+        for token in tokens:
+            name = _token_name(token)
+            if name.startswith('-'):
+                current.pop(name[1:], None)
+            else:
+                current[name] = token
+        new = frozenset(current.itervalues())
+        if new == self.tokens:
+            return self
+        return _intern(new)
+
+
+_profiles = weakref.WeakValueDictionary()
+
+def _intern(tokens):
+    profile = _profiles.get(tokens)
+    if profile is None:
+        caps = server_capabilities.ServerCapabilities()
+        caps.apply_isupport(sorted(tokens))
+        caps.freeze()
+        profile = _profiles[tokens] = Profile(tokens, caps)
+    return profile
+
+# Profile of servers that sent no ISUPPORT. Also keeps it interned.
+EMPTY = _intern(frozenset())
+
+def get(tokens=()):
+    """Return the shared Profile for the given ISUPPORT tokens.
+
+    Raises a CapabilityError if the tokens don't make sense.
+    """
+    return EMPTY.update(tokens)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for profiles
+
+import unittest
+import profiles
+import server_capabilities as scap
+
+class TestProfiles(unittest.TestCase):
+    def testInterning(self):
+        """Equal token sets share one Profile"""
+        a = profiles.get(['NICKLEN=16', 'CHANTYPES=#', 'WHOX'])
+        b = profiles.get(['WHOX', 'CHANTYPES=#']).update(['NICKLEN=16'])
+        self.assert_(a is b)
+        self.assertEquals(hash(a), hash(b))
+        self.assertEquals(a.capabilities.nicklen, 16)
+        self.assertEquals(a.capabilities.chantypes, frozenset(['#']))
+        self.assertEquals(a.capabilities.unknown, {'WHOX': None})
+        self.assert_(profiles.get() is profiles.EMPTY)
+
+    def testUpdate(self):
+        """Updates give new profiles, leaving the old ones alone"""
+        a = profiles.get(['NICKLEN=16', 'TOPICLEN=300'])
+        self.assert_(a.update(['NICKLEN=16']) is a)
+        b = a.update(['NICKLEN=30', '-TOPICLEN'])
+        self.assertEquals(b.tokens, frozenset(['NICKLEN=30']))
+        self.assertEquals(b.capabilities.nicklen, 30)
+        self.assertEquals(b.capabilities.topiclen, None)
+        self.assertEquals(a.capabilities.nicklen, 16)
+        self.assertEquals(a.capabilities.topiclen, 300)
+        # Switching profiles changes the version of the capabilities.
+        versions = set(p.capabilities.version
+                       for p in (profiles.EMPTY, a, b))
+        self.assertEquals(len(versions), 3)
+
+    def testImmutable(self):
+        """Profiles and their capabilities are read-only"""
+        p = profiles.get(['NICKLEN=16'])
+        self.assertRaises(AttributeError, setattr, p, 'tokens', frozenset())
+        self.assertRaises(AttributeError, setattr, p.capabilities,
+                          'nicklen', 5)
+
+    def testInvalid(self):
+        """Broken token sets are refused"""
+        self.assertRaises(scap.CapabilityLogicError, profiles.get,
+                          ['CHANTYPES=#', 'CHANLIMIT=&:5'])
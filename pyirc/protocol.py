@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#
+# Sans-IO IRC client protocol.
+#
+# Connection holds the protocol state of a client connection, but
+# does no I/O at all: bytes received from the server are handed to
+# receive_data(), and the bytes it wants sent are collected with
+# data_to_send(). Anything that can move bytes around can drive it,
+# be it a socket loop, a test or a benchmark.
+
+import codes
+import framing
+import profiles
+import server_capabilities
+import wireproto
+
+# Commands the protocol acts on itself, which are always decoded.
+_PROTOCOL_COMMANDS = frozenset((
+    'PING', 'ERROR', codes.RPL_WELCOME, codes.RPL_ISUPPORT,
+    codes.RPL_ENDOFMOTD, codes.ERR_NOMOTD, codes.RPL_HOSTHIDDEN))
+# Commands the protocol acts on when they come from us. Those are
+# only decoded if they do, or if they are wanted.
+_OWN_COMMANDS = frozenset(('JOIN', 'NICK'))
+
+
+class Connection(object):
+    """Protocol state machine of a client connection.
+
+    Takes care of framing, decoding, registration, answering PINGs
+    and tracking the server's capabilities. Everything else is
+    returned to the caller as events, which are the received
+    wireproto.Message objects.
+
+    profile is the profiles.Profile to assume until the server sends
+    its ISUPPORT tokens, by default the RFC defaults. If given, wants
+    is called with the code of every other command received, and the
+    lines it returns false for are counted in ignored and dropped
+    without being decoded.
+    """
+    def __init__(self, nick, user, realname='nobody', profile=None,
+                 wants=None):
+        self.nick = nick
+        self.user = user
+        self.realname = realname
+        # The user@host part of our hostmask, once we have seen it.
+        self._userhost = None
+        if profile is None:
+            profile = profiles.EMPTY
+        self.profile = profile
+        # ISUPPORT tokens received on this connection.
+        self.isupport = []
+        self._isupport_done = False
+
+        self.registered = False
+        self.closed = False
+        self.lines_received = 0
+        self.ignored = 0
+
+        self._wants = wants
+        self._framer = framing.LineFramer()
+        self._outgoing = bytearray()
+
+    @property
+    def capabilities(self):
+        """The frozen ServerCapabilities of the server."""
+        return self.profile.capabilities
+
+    @property
+    def hostmask(self):
+        """Our nick!user@host as others see it, or None if unknown."""
+        if self._userhost is None:
+            return None
+        return '%s!%s' % (self.nick, self._userhost)
+
+    def hostmask_length(self):
+        """Length of our hostmask, or a bound of it until it is known.
+
+        The server relays our messages with our hostmask in front,
+        which counts against the line length.
+        """
+        if self._userhost is not None:
+            return len(self.nick) + 1 + len(self._userhost)
+        return self.capabilities.max_hostmask_length(self.nick)
+
+    def connection_made(self):
+        """Start registration, once the transport is connected."""
+        self.send('NICK', self.nick)
+        self.send('USER', self.user, '0', '*', self.realname)
+
+    def send(self, command, *args):
+        """Queue a message for sending."""
+        wireproto.encode_into(self._outgoing, command, *args)
+
+    def data_to_send(self):
+        """Return and forget all the bytes that are waiting to be sent."""
+        data = str(self._outgoing)
+        del self._outgoing[:]
+        return data
+
+    def receive_data(self, data):
+        """Process bytes received from the server.
+
+        Returns the list of messages that were received.
+        """
+        return list(self._receive(self._framer.feed(data)))
+
+    def recv_into(self, sock):
+        """Receive bytes from sock straight into the framing buffer.
+
+        sock is anything with a socket-like recv_into method. The
+        messages received are then generated by events(). Returns the
+        number of bytes received.
+        """
+        return self._framer.recv_into(sock)
+
+    def events(self):
+        """Generate the messages received by recv_into().
+
+        Must be exhausted before the next call to recv_into().
+        """
+        return self._receive(self._framer.lines())
+
+    def _receive(self, lines):
+        wants = self._wants
+        for line in lines:
+            self.lines_received += 1
+            code = wireproto.sniff_command(line)
+            if code in _PROTOCOL_COMMANDS:
+                msg = wireproto.decode(line)
+                self._handle(msg)
+            elif code in _OWN_COMMANDS and self._is_own(line):
+                msg = wireproto.decode(line)
+                self._handle_own_change(msg)
+            elif wants is None or wants(code):
+                msg = wireproto.decode(line)
+            else:
+                self.ignored += 1
+                continue
+            yield msg
+
+    def _handle(self, msg):
+        code = msg.code
+        if code == 'PING':
+            self.send('PONG', *msg.args)
+        elif code == codes.RPL_WELCOME:
+            self.registered = True
+            # The server tells us what our nick actually is.
+            self.nick = msg.args[0]
+        elif code == codes.RPL_HOSTHIDDEN:
+            self._handle_hosthidden(msg)
+        elif code == codes.RPL_ISUPPORT:
+            self._handle_isupport(msg)
+        elif code in (codes.RPL_ENDOFMOTD, codes.ERR_NOMOTD):
+            self._handle_isupport_done()
+        elif code == 'ERROR':
+            self.closed = True
+
+    def _is_own(self, line):
+        # Whether line comes from us, going by the nick of its prefix.
+        # Much cheaper than decoding everybody's JOINs and NICKs.
+        if not line.startswith(':'):
+            return False
+        end = line.find(' ')
+        if end == -1:
+            return False
+        bang = line.find('!', 1, end)
+        if bang != -1:
+            end = bang
+        nick = line[1:end]
+        return (len(nick) == len(self.nick) and
+                self.capabilities.casemapper.equal(nick, self.nick))
+
+    def _handle_own_change(self, msg):
+        # Our JOINs show our hostmask, and our NICKs change it.
+        if not msg.args:
+            return
+        if msg.code == 'NICK':
+            self.nick = msg.args[0]
+        if msg.user is not None and msg.host is not None:
+            self._userhost = '%s@%s' % (msg.user, msg.host)
+
+    def _handle_hosthidden(self, msg):
+        # ':server 396 nick host :is now your displayed host', and
+        # some servers give user@host.
+        if len(msg.args) < 2:
+            return
+        host = msg.args[1]
+        if '@' in host:
+            self._userhost = host
+        elif self._userhost is not None:
+            self._userhost = '%s@%s' % (self._userhost.split('@', 1)[0], host)
+
+    def _handle_isupport(self, msg):
+        # Servers spread their tokens over several lines, which only
+        # make sense together, so they are kept until registration is
+        # over. Lines sent after that are applied at once.
+        tokens = msg.args[1:-1]
+        self.isupport.extend(tokens)
+        if self._isupport_done:
+            self._set_profile(self.profile.update, tokens)
+
+    def _handle_isupport_done(self):
+        # Registration is over, so we have all the ISUPPORT tokens.
+        # Drop whatever we started with that the server didn't send.
+        if self._isupport_done:
+            return
+        self._isupport_done = True
+        if self.isupport:
+            self._set_profile(profiles.get, self.isupport)
+
+    def _set_profile(self, make_profile, tokens):
+        try:
+            self.profile = make_profile(tokens)
+        except server_capabilities.CapabilityError, e:
+            print 'ISUPPORT error: %s' % e
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for protocol
+
+import unittest
+import profiles
+import protocol
+
+class _Sock(object):
+    """Hands out the given chunks of data to recv_into()."""
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+
+    def recv_into(self, buf):
+        data = self.chunks.pop(0)
+        buf[:len(data)] = data
+        return len(data)
+
+
+class TestConnection(unittest.TestCase):
+    def testRegistration(self):
+        """Connection registration sequence"""
+        c = protocol.Connection('nick', 'user', 'foo')
+        self.assertEquals(c.data_to_send(), '')
+        c.connection_made()
+        self.assertEquals(c.data_to_send(),
+                          'NICK  :nick\r\nUSER user 0 * :foo\r\n')
+        self.assertEquals(c.data_to_send(), '')
+
+        events = c.receive_data(':irc.server.com 001 nick_ :Welcome\r\n:irc')
+        self.assertEquals([e.command for e in events], ['001'])
+        self.assert_(c.registered)
+        self.assertEquals(c.nick, 'nick_')
+
+        events = c.receive_data('.server.com 005 nick_ NICKLEN=30 :are '
+                                'supported\r\n'
+                                ':irc.server.com 422 nick_ :No MOTD\r\n')
+        self.assertEquals([e.command for e in events], ['005', '422'])
+        self.assertEquals(c.capabilities.nicklen, 30)
+
+    def testPing(self):
+        """PINGs are answered"""
+        c = protocol.Connection('nick', 'user')
+        events = c.receive_data('PING :irc.server.com\r\n'
+                                ':a!b@c PRIVMSG #foo :hi\r\n')
+        self.assertEquals([e.command for e in events], ['PING', 'PRIVMSG'])
+        self.assertEquals(c.data_to_send(), 'PONG  :irc.server.com\r\n')
+
+    def testError(self):
+        """Server errors close the connection"""
+        c = protocol.Connection('nick', 'user')
+        c.receive_data('ERROR :Closing link\r\n')
+        self.assert_(c.closed)
+
+    def testRecvInto(self):
+        """Data received straight into the framing buffer"""
+        c = protocol.Connection('nick', 'user')
+        sock = _Sock(':a!b@c PRIVMSG #foo :h', 'i\r\nPING :x\n')
+        self.assertEquals(c.recv_into(sock), 22)
+        self.assertEquals(list(c.events()), [])
+        c.recv_into(sock)
+        events = list(c.events())
+        self.assertEquals([e.command for e in events], ['PRIVMSG', 'PING'])
+        self.assertEquals(events[0].args, ['#foo', 'hi'])
+        self.assertEquals(c.lines_received, 2)
+        self.assertEquals(c.data_to_send(), 'PONG  :x\r\n')
+
+    def testWants(self):
+        """Unwanted commands are dropped"""
+        c = protocol.Connection('nick', 'user',
+                                wants=lambda code: code == 'NOTICE')
+        events = c.receive_data(':a PRIVMSG #foo :hi\r\n'
+                                ':a NOTICE #foo :hi\r\n'
+                                'PING :x\r\n')
+        self.assertEquals([e.command for e in events], ['NOTICE', 'PING'])
+        self.assertEquals(c.ignored, 1)
+        self.assertEquals(c.lines_received, 3)
+
+    def testOwnCommands(self):
+        """Only our own JOINs and NICKs are always decoded"""
+        c = protocol.Connection('nick', 'user', wants=lambda code: False)
+        events = c.receive_data(':other!o@h JOIN #a\r\n'
+                                ':nicky!n@h JOIN #a\r\n'
+                                ':other!o@h NICK :bob\r\n'
+                                ':NICK!~user@host JOIN #a\r\n')
+        self.assertEquals([e.nick for e in events], ['NICK'])
+        self.assertEquals(c.ignored, 3)
+        self.assertEquals(c.hostmask, 'nick!~user@host')
+
+    def testProfile(self):
+        """The capabilities are replaced once registration is over"""
+        start = profiles.get(['NICKLEN=16', 'TOPICLEN=300'])
+        c = protocol.Connection('nick', 'user', profile=start)
+        self.assert_(c.capabilities is start.capabilities)
+
+        # Tokens only make sense together, so nothing changes before
+        # the end of the burst.
+        c.receive_data(':irc 005 nick STATUSMSG=~@ NICKLEN=30 :are '
+                       'supported\r\n'
+                       ':irc 005 nick PREFIX=(qov)~@+ :are supported\r\n')
+        self.assertEquals(c.isupport,
+                          ['STATUSMSG=~@', 'NICKLEN=30', 'PREFIX=(qov)~@+'])
+        self.assert_(c.profile is start)
+        c.receive_data(':irc 376 nick :End of MOTD\r\n')
+        self.assert_(c.profile is profiles.get(c.isupport))
+        self.assertEquals(c.capabilities.nicklen, 30)
+        self.assertEquals(c.capabilities.prefix_modes, 'qov')
+        self.assertEquals(c.capabilities.topiclen, None)
+
+        # Later changes are applied at once.
+        c.receive_data(':irc 005 nick NICKLEN=16 :are supported\r\n')
+        self.assertEquals(c.capabilities.nicklen, 16)
+        self.assertEquals(c.capabilities.prefix_modes, 'qov')
+
+    def testHostmask(self):
+        """Our hostmask is tracked"""
+        c = protocol.Connection('nick', 'user')
+        c.receive_data(':irc 005 nick NICKLEN=30 USERLEN=10 HOSTLEN=64 '
+                       ':are supported\r\n:irc 376 nick :End of MOTD\r\n')
+        # Until we see it, we only know how long it can be.
+        self.assertEquals(c.hostmask, None)
+        self.assertEquals(c.hostmask_length(), 4 + 1 + 11 + 1 + 64)
+
+        c.receive_data(':Nick!~user@192.0.2.1 JOIN #a\r\n'
+                       ':other!o@h JOIN #a\r\n')
+        self.assertEquals(c.hostmask, 'nick!~user@192.0.2.1')
+        c.receive_data(':irc 396 nick cloak.example :is now your host\r\n')
+        self.assertEquals(c.hostmask, 'nick!~user@cloak.example')
+        c.receive_data(':nick!~user@cloak.example NICK :' + 'n' * 30 +
+                       '\r\n:other!o@h NICK :bob\r\n')
+        self.assertEquals(c.nick, 'n' * 30)
+        self.assertEquals(c.hostmask, 'n' * 30 + '!~user@cloak.example')
+        self.assertEquals(c.hostmask_length(), len(c.hostmask))
+        c.receive_data(':irc 396 %s u@h :is now your host\r\n' % c.nick)
+        self.assertEquals(c.hostmask, 'n' * 30 + '!u@h')
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+#
+# Matching query replies back to the queries.
+#
+# Servers answer WHOIS, WHO, USERHOST, NAMES and MODE queries with a
+# stream of numerics ending with a terminating one, and they answer
+# queries in the order they were sent. A QueryPipeline keeps several
+# queries in flight, and hands each reply to the oldest pending query
+# that expects it, checking the target named in the reply where there
+# is one. Once its terminating numeric arrives, the query's Future is
+# resolved with all the replies.
+#
+# IRCv3 labeled-response would make the matching exact, but needs
+# message tags and CAP negotiation, which we don't do. Matching on
+# order and target is what every client does without it.
+
+import collections
+import threading
+import time
+
+import codes
+import wireproto
+
+class QueryError(Exception):
+    """A query got no proper answer."""
+
+class QueryTimeout(QueryError):
+    """A query wasn't answered in time."""
+
+
+class Future(object):
+    """The result of a query, to come.
+
+    Callbacks are run by whoever completes the future, usually the
+    loop thread. result() can be used to wait for the result from
+    other threads.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """Return the result, waiting at most timeout seconds for it.
+
+        Raises the query's exception if it failed, and QueryTimeout
+        if the result isn't there in time.
+        """
+        if not self._event.wait(timeout):
+            raise QueryTimeout('No result yet')
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self):
+        return self._exception
+
+    def add_done_callback(self, callback):
+        """Call callback(future) once done, or now if already done."""
+        if self.done():
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._finish()
+
+    def _finish(self):
+        self._event.set()
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+# What to expect in answer to each query command: the numerics that
+# are part of the answer, and those that end it, each with the index
+# of the argument naming the query target (None if there isn't one).
+_QUERIES = {
+    'WHOIS': (
+        {codes.RPL_AWAY: 1, codes.RPL_WHOISUSER: 1,
+         codes.RPL_WHOISSERVER: 1, codes.RPL_WHOISOPERATOR: 1,
+         codes.RPL_WHOISIDLE: 1, codes.RPL_WHOISCHANNELS: 1,
+         codes.RPL_WHOISACCOUNT: 1, codes.RPL_WHOISSECURE: 1,
+         codes.ERR_NOSUCHNICK: 1},
+        {codes.RPL_ENDOFWHOIS: 1}),
+    'WHO': (
+        {codes.RPL_WHOREPLY: None, codes.RPL_WHOSPCRPL: None},
+        {codes.RPL_ENDOFWHO: 1}),
+    'USERHOST': (
+        {},
+        {codes.RPL_USERHOST: None}),
+    'NAMES': (
+        {codes.RPL_NAMREPLY: -2},
+        {codes.RPL_ENDOFNAMES: 1}),
+    'MODE': (
+        {},
+        {codes.RPL_CHANNELMODEIS: 1, codes.ERR_NOSUCHCHANNEL: 1}),
+    }
+
+# Replies that also answer other commands: ERR_NOSUCHNICK is what we
+# get for a PRIVMSG to a nick that isn't there. They are only taken
+# as the first reply of a query, which is where the query's own comes.
+_SHARED_REPLIES = frozenset((codes.ERR_NOSUCHNICK,))
+
+
+class _Pending(object):
+    __slots__ = ('command', 'target', 'key', 'future', 'replies',
+                 'sent_at')
+
+    def __init__(self, command, target, future):
+        self.command = command
+        self.target = target
+        self.key = None
+        self.future = future
+        self.replies = []
+        self.sent_at = None
+
+
+class QueryPipeline(object):
+    """Sends queries to a Server, and collects their answers.
+
+    At most max_in_flight queries are sent without their answer, the
+    others wait their turn. Queries not answered within timeout
+    seconds fail with QueryTimeout, and the ones still pending when
+    the connection closes with QueryError.
+
+    Must be used from the loop thread. Blocking handlers can send
+    queries with server.executor.call_in_loop(), and wait on the
+    Future's result().
+    """
+    def __init__(self, server, max_in_flight=4, timeout=30.0,
+                 clock=time.time):
+        self.server = server
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.clock = clock
+        self._in_flight = collections.deque()
+        self._waiting = collections.deque()
+
+        reply_codes = set()
+        for replies, ends in _QUERIES.itervalues():
+            reply_codes.update(replies)
+            reply_codes.update(ends)
+        for code in reply_codes:
+            server.add_handler(code, self._handle_reply)
+        server.add_tick_handler(self.expire)
+        server.add_close_handler(self._handle_close)
+
+    def __len__(self):
+        """Number of queries not answered yet."""
+        return len(self._in_flight) + len(self._waiting)
+
+    def query(self, command, target):
+        """Send a query, returning a Future for the list of replies.
+
+        command is one of WHOIS, WHO, USERHOST, NAMES and MODE (for
+        the modes of a channel). The replies are the received
+        Messages, the terminating one included.
+        """
+        command = codes.command_code(command)
+        if command not in _QUERIES:
+            raise ValueError('Cannot match replies to %s' % command)
+        future = Future()
+        self._waiting.append(_Pending(command, target, future))
+        self._send_waiting()
+        return future
+
+    def whois(self, nick):
+        return self.query('WHOIS', nick)
+
+    def who(self, mask):
+        return self.query('WHO', mask)
+
+    def userhost(self, nick):
+        return self.query('USERHOST', nick)
+
+    def names(self, channel):
+        return self.query('NAMES', channel)
+
+    def mode(self, channel):
+        return self.query('MODE', channel)
+
+    def _send_waiting(self):
+        while self._waiting and len(self._in_flight) < self.max_in_flight:
+            pending = self._waiting.popleft()
+            pending.key = self.server.capabilities.casemapper.casefold(
+                pending.target)
+            self._in_flight.append(pending)
+            # Flood control may hold the query back for a while, which
+            # doesn't count against its timeout.
+            self.server.output(
+                wireproto.encode(pending.command, pending.target),
+                on_sent=lambda pending=pending: self._sent(pending))
+
+    def _sent(self, pending):
+        pending.sent_at = self.clock()
+
+    def _handle_reply(self, msg):
+        code = msg.code
+        casefold = self.server.capabilities.casemapper.casefold
+        for i, pending in enumerate(self._in_flight):
+            replies, ends = _QUERIES[pending.command]
+            if code in replies:
+                index = replies[code]
+            elif code in ends:
+                index = ends[code]
+            else:
+                continue
+            if index is not None:
+                try:
+                    if casefold(msg.args[index]) != pending.key:
+                        continue
+                except IndexError:
+                    continue
+            if code in _SHARED_REPLIES and pending.replies:
+                continue
+            pending.replies.append(msg)
+            if code in ends:
+                self._complete(i)
+            return
+
+    def _complete(self, i):
+        # Queries are answered in order, so the ones sent before this
+        # one won't ever be.
+        for _ in xrange(i):
+            pending = self._in_flight.popleft()
+            pending.future.set_exception(
+                QueryError('No answer to %s %s' % (pending.command,
+                                                    pending.target)))
+        pending = self._in_flight.popleft()
+        pending.future.set_result(pending.replies)
+        self._send_waiting()
+
+    def expire(self):
+        """Fail the queries that have waited too long for their answer."""
+        deadline = self.clock() - self.timeout
+        expired = False
+        # Queries are sent in order, so the first one not sent yet is
+        # followed by more of the same.
+        while (self._in_flight and self._in_flight[0].sent_at is not None
+               and self._in_flight[0].sent_at <= deadline):
+            pending = self._in_flight.popleft()
+            pending.future.set_exception(
+                QueryTimeout('No answer to %s %s' % (pending.command,
+                                                     pending.target)))
+            expired = True
+        if expired:
+            self._send_waiting()
+
+    def _handle_close(self):
+        # Nothing will ever answer, nor expire, the pending queries,
+        # and their futures may have blocking handlers waiting on them.
+        lost = list(self._in_flight) + list(self._waiting)
+        self._in_flight.clear()
+        self._waiting.clear()
+        for pending in lost:
+            pending.future.set_exception(
+                QueryError('Connection closed before %s %s was answered'
+                           % (pending.command, pending.target)))
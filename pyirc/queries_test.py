@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for queries
+
+import unittest
+
+import queries
+import server_capabilities
+import wireproto
+
+class FakeServer(object):
+    def __init__(self):
+        self.capabilities = server_capabilities.ServerCapabilities()
+        self.handlers = {}
+        self.tick_handlers = []
+        self.close_handlers = []
+        self.sent = []
+        # While throttled, sent lines are held back by flood control.
+        self.throttled = False
+        self.unsent = []
+
+    def add_handler(self, code, handler):
+        self.handlers.setdefault(code, []).append(handler)
+
+    def add_tick_handler(self, handler):
+        self.tick_handlers.append(handler)
+
+    def add_close_handler(self, handler):
+        self.close_handlers.append(handler)
+
+    def output(self, line, on_sent=None):
+        self.sent.append(line)
+        if on_sent is not None:
+            self.unsent.append(on_sent)
+        if not self.throttled:
+            self.release()
+
+    def release(self):
+        unsent, self.unsent = self.unsent, []
+        for on_sent in unsent:
+            on_sent()
+
+    def close(self):
+        for handler in self.close_handlers:
+            handler()
+
+    def feed(self, *lines):
+        for line in lines:
+            msg = wireproto.decode(line)
+            for handler in self.handlers.get(msg.code, ()):
+                handler(msg)
+
+
+class TestQueryPipeline(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.server = FakeServer()
+        self.p = queries.QueryPipeline(self.server, max_in_flight=2,
+                                       timeout=10, clock=lambda: self.now)
+
+    def testPipelining(self):
+        """Replies are matched to their queries"""
+        whois = self.p.whois('Alice')
+        names = self.p.names('#chan')
+        who = self.p.who('#chan')
+        self.assertEquals(self.server.sent,
+                          [wireproto.encode('WHOIS', 'Alice'),
+                           wireproto.encode('NAMES', '#chan')])
+        self.assertEquals(len(self.p), 3)
+
+        self.server.feed(':irc 311 me alice a host * :Alice',
+                         # Unrelated NAMES, from a JOIN.
+                         ':irc 353 me = #other :bob',
+                         ':irc 318 me ALICE :End of WHOIS')
+        self.assertEquals([m.code for m in whois.result()], [311, 318])
+        self.failIf(names.done())
+        self.assertEquals(self.server.sent[-1],
+                          wireproto.encode('WHO', '#chan'))
+
+        self.server.feed(':irc 353 me = #chan :@me bob',
+                         ':irc 366 me #chan :End of NAMES',
+                         ':irc 352 me #chan a host irc bob H :0 Bob',
+                         ':irc 315 me #chan :End of WHO')
+        self.assertEquals([m.args[-1] for m in names.result()],
+                          ['@me bob', 'End of NAMES'])
+        self.assertEquals(len(who.result()), 2)
+        self.assertEquals(len(self.p), 0)
+
+    def testCallbacks(self):
+        """Futures run their callbacks when done"""
+        results = []
+        f = self.p.mode('#chan')
+        f.add_done_callback(lambda f: results.append(f.result()))
+        self.server.feed(':irc 324 me #chan +nt')
+        self.assertEquals(len(results[0]), 1)
+        f.add_done_callback(lambda f: results.append(f.result()))
+        self.assertEquals(len(results), 2)
+
+    def testLostAnswers(self):
+        """Unanswered queries fail"""
+        lost = self.p.whois('alice')
+        answered = self.p.whois('bob')
+        self.server.feed(':irc 318 me bob :End of WHOIS')
+        self.assertRaises(queries.QueryError, lost.result)
+        self.assertEquals(len(answered.result()), 1)
+
+        late = self.p.names('#chan')
+        self.now += 11
+        for tick in self.server.tick_handlers:
+            tick()
+        self.assertRaises(queries.QueryTimeout, late.result)
+        self.assertRaises(ValueError, self.p.query, 'PRIVMSG', '#chan')
+
+    def testNoSuchNick(self):
+        """ERR_NOSUCHNICK replies to other commands are told apart"""
+        # The first 401 is for a PRIVMSG, which looks just the same.
+        bob = self.p.whois('bob')
+        self.server.feed(':irc 401 me bob :No such nick/channel',
+                         ':irc 401 me bob :No such nick/channel',
+                         ':irc 318 me bob :End of WHOIS')
+        self.assertEquals([m.code for m in bob.result()], [401, 318])
+
+        alice = self.p.whois('alice')
+        self.server.feed(':irc 311 me alice a host * :Alice',
+                         ':irc 401 me alice :No such nick/channel',
+                         ':irc 318 me alice :End of WHOIS')
+        self.assertEquals([m.code for m in alice.result()], [311, 318])
+
+    def testFloodControl(self):
+        """Queries held back by flood control don't time out"""
+        self.server.throttled = True
+        f = self.p.whois('alice')
+        self.now += 11
+        self.p.expire()
+        self.failIf(f.done())
+
+        self.server.release()
+        self.now += 9
+        self.p.expire()
+        self.failIf(f.done())
+        self.now += 2
+        self.p.expire()
+        self.assertRaises(queries.QueryTimeout, f.result)
+
+    def testClose(self):
+        """Pending queries fail when the connection closes"""
+        in_flight = [self.p.whois('alice'), self.p.whois('bob')]
+        waiting = self.p.names('#chan')
+        self.assertEquals(len(self.server.sent), 2)
+        self.server.close()
+        self.assertEquals(len(self.p), 0)
+        for f in in_flight + [waiting]:
+            self.assertRaises(queries.QueryError, f.result)
+            self.failIf(isinstance(f.exception(), queries.QueryTimeout))
+        self.assertEquals(len(self.server.sent), 2)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Cache of WHO, WHOIS and USERHOST answers.
+#
+# Plugins tend to ask about the same users over and over. A QueryCache
+# sits in front of a QueryPipeline and answers repeated queries from
+# the previous answer, without sending anything. Answers are kept for
+# ttl seconds at most, the least recently used ones are evicted when
+# the cache is full, and they are dropped as soon as we see the user
+# they are about change (NICK, QUIT, JOIN...).
+
+import collections
+
+import codes
+
+# Queries worth caching.
+_CACHEABLE = frozenset(('WHOIS', 'WHO', 'USERHOST'))
+
+
+class QueryCache(object):
+    """Caching front end to a queries.QueryPipeline.
+
+    Holds at most size answers, for at most ttl seconds. Queries
+    that are in flight are shared too: asking again before the answer
+    arrives returns the same Future.
+    """
+    def __init__(self, pipeline, size=1024, ttl=300.0):
+        self.pipeline = pipeline
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # (command, casefolded target) -> [future, expiry time, keys
+        # of the nicks in the answer], least recently used first. The
+        # expiry time is None while the query is in flight.
+        self._entries = collections.OrderedDict()
+        # Casefolded nick -> keys of the WHO entries listing it.
+        self._members = {}
+
+        server = pipeline.server
+        for command in ('NICK', 'QUIT', 'JOIN', 'PART', 'KICK'):
+            server.add_handler(command, self._handle_change)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _casefold(self, name):
+        return self.pipeline.server.capabilities.casemapper.casefold(name)
+
+    def query(self, command, target):
+        """Return a Future for the answer to a query, see QueryPipeline.
+
+        command is one of WHOIS, WHO and USERHOST. Cached answers
+        come as Futures that are already done.
+        """
+        command = codes.command_code(command)
+        if command not in _CACHEABLE:
+            raise ValueError('Cannot cache %s queries' % command)
+        key = (command, self._casefold(target))
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            expires = entry[1]
+            if expires is None or expires > self.pipeline.clock():
+                # Back in as the most recently used.
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[0]
+            self._forget_members(key, entry)
+
+        self.misses += 1
+        future = self.pipeline.query(command, target)
+        entry = [future, None, ()]
+        self._entries[key] = entry
+        if len(self._entries) > self.size:
+            self._remove(next(iter(self._entries)))
+        future.add_done_callback(lambda f: self._answered(key, entry))
+        return future
+
+    def whois(self, nick):
+        return self.query('WHOIS', nick)
+
+    def who(self, mask):
+        return self.query('WHO', mask)
+
+    def userhost(self, nick):
+        return self.query('USERHOST', nick)
+
+    def _answered(self, key, entry):
+        if self._entries.get(key) is not entry:
+            # Invalidated while in flight.
+            return
+        future = entry[0]
+        if future.exception() is not None:
+            del self._entries[key]
+            return
+        entry[1] = self.pipeline.clock() + self.ttl
+        if key[0] == 'WHO':
+            nicks = set(self._casefold(msg.args[5])
+                        for msg in future.result()
+                        if msg.code == codes.RPL_WHOREPLY
+                        and len(msg.args) > 5)
+            entry[2] = nicks
+            for nick in nicks:
+                self._members.setdefault(nick, set()).add(key)
+
+    def _forget_members(self, key, entry):
+        for nick in entry[2]:
+            keys = self._members.get(nick)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._members[nick]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._forget_members(key, entry)
+
+    def invalidate(self, name):
+        """Forget the answers about a nick or channel."""
+        name = self._casefold(name)
+        for command in _CACHEABLE:
+            self._remove((command, name))
+        for key in list(self._members.get(name, ())):
+            self._remove(key)
+
+    def _handle_change(self, msg):
+        code = msg.code
+        if msg.nick:
+            self.invalidate(msg.nick)
+        if code == 'NICK' and msg.args:
+            self.invalidate(msg.args[0])
+        elif code in ('JOIN', 'PART', 'KICK') and msg.args:
+            # The channel's WHO changes, and so does the kicked
+            # user's WHOIS.
+            self.invalidate(msg.args[0])
+            if code == 'KICK' and len(msg.args) > 1:
+                self.invalidate(msg.args[1])
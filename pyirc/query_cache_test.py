@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for query_cache
+
+import unittest
+
+import queries
+import queries_test
+import query_cache
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.server = queries_test.FakeServer()
+        self.pipeline = queries.QueryPipeline(self.server,
+                                              clock=lambda: self.now)
+        self.cache = query_cache.QueryCache(self.pipeline, size=2, ttl=60)
+
+    def whois(self, nick):
+        f = self.cache.whois(nick)
+        self.server.feed(':irc 311 me %s u h * :Real' % nick,
+                         ':irc 318 me %s :End of WHOIS' % nick)
+        return f
+
+    def testHitsAndMisses(self):
+        """Answers are reused until they expire"""
+        f = self.whois('alice')
+        self.assertEquals(len(self.server.sent), 1)
+        self.assert_(self.cache.whois('ALICE') is f)
+        self.assertEquals(len(self.server.sent), 1)
+        self.assertEquals((self.cache.hits, self.cache.misses), (1, 1))
+
+        # In flight queries are shared too.
+        userhost = self.cache.userhost('bob')
+        self.assert_(self.cache.userhost('bob') is userhost)
+
+        self.now += 61
+        self.failIf(self.cache.whois('alice') is f)
+        self.assertEquals(self.cache.misses, 3)
+
+    def testEviction(self):
+        """The least recently used answers go first"""
+        a = self.whois('a')
+        b = self.whois('b')
+        self.cache.whois('a')
+        self.whois('c')
+        self.assertEquals(len(self.cache), 2)
+        self.assert_(self.cache.whois('a') is a)
+        self.failIf(self.cache.whois('b') is b)
+
+    def testInvalidation(self):
+        """Changes to users drop their answers"""
+        f = self.whois('alice')
+        self.server.feed(':alice!u@h JOIN #chan')
+        self.failIf(self.cache.whois('alice') is f)
+
+        f = self.whois('bob')
+        self.server.feed(':bob!u@h NICK robert')
+        self.failIf(self.cache.whois('bob') is f)
+
+        # Channel WHOs go away when their members change.
+        who = self.cache.who('#chan')
+        self.server.feed(':irc 352 me #chan u h irc carol H :0 Carol',
+                         ':irc 315 me #chan :End of WHO')
+        self.assert_(self.cache.who('#chan') is who)
+        self.server.feed(':carol!u@h QUIT :bye')
+        self.failIf(self.cache.who('#chan') is who)
+        self.assertEquals(self.cache._members, {})
+
+        self.assertRaises(ValueError, self.cache.query, 'NAMES', '#chan')
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# Rate limited, prioritized scheduling of outgoing lines.
+#
+# IRC servers throttle clients that send too fast. The usual scheme,
+# inherited from the original ircd, is a per-client message timer:
+# every line pushes it forward by a penalty of a couple of seconds
+# (more for long lines), it catches up with real time as time
+# passes, and a client whose timer gets more than about 10 seconds
+# ahead is not read from anymore, or disconnected for flooding. We
+# keep our own copy of that timer and only release lines that keep
+# it within bounds.
+
+import collections
+import time
+
+import codes
+import wireproto
+
+# Priority classes, most urgent first.
+PRIORITY_URGENT = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_BULK = 2
+
+# Commands that keep the connection alive or get it registered. They
+# are sent ahead of anything else, flood control or not.
+_URGENT_COMMANDS = frozenset(codes.command_code(c) for c in (
+    'PONG', 'PASS', 'NICK', 'USER', 'CAP', 'AUTHENTICATE', 'QUIT'))
+
+
+class OutputScheduler(object):
+    """Queue of outgoing lines with flood control.
+
+    Lines are given to output, a callable taking a string, as fast as
+    the flood control allows. All lines released at once are
+    coalesced into a single call.
+
+    Each line costs line_penalty seconds, plus one second per
+    penalty_bytes bytes. Lines are released as long as the penalty
+    timer stays less than burst seconds ahead of the clock. Urgent
+    lines are always released immediately, but still count against
+    the timer.
+    """
+    def __init__(self, output, burst=10.0, line_penalty=2.0,
+                 penalty_bytes=120, clock=time.time):
+        self._output = output
+        self.burst = burst
+        self.line_penalty = line_penalty
+        self.penalty_bytes = penalty_bytes
+        self._clock = clock
+
+        # One queue of (line, penalty, on_sent) per priority class.
+        self._queues = (collections.deque(), collections.deque(),
+                        collections.deque())
+        self._queued_penalty = 0.0
+        self._timer = 0.0
+
+    def __len__(self):
+        """Number of queued lines."""
+        return sum(len(q) for q in self._queues)
+
+    def queue_depth(self, priority):
+        """Number of queued lines of the given priority."""
+        return len(self._queues[priority])
+
+    def penalty(self, line):
+        """Flood penalty for line, in seconds."""
+        return self.line_penalty + len(line) / float(self.penalty_bytes)
+
+    def classify(self, line):
+        """Default priority for line."""
+        if wireproto.sniff_command(line) in _URGENT_COMMANDS:
+            return PRIORITY_URGENT
+        return PRIORITY_INTERACTIVE
+
+    def send(self, line, priority=None, on_sent=None):
+        """Queue an encoded line, and flush what can be sent.
+
+        If priority is None, it is picked by classify(). If given,
+        on_sent() is called once the line is actually released.
+        """
+        if priority is None:
+            priority = self.classify(line)
+        penalty = self.penalty(line)
+        self._queues[priority].append((line, penalty, on_sent))
+        self._queued_penalty += penalty
+        self.flush()
+
+    def delay(self):
+        """Seconds until the next queued line can be sent, or None."""
+        for queue in self._queues:
+            if queue:
+                penalty = queue[0][1]
+                break
+        else:
+            return None
+        now = self._clock()
+        if self._timer <= now:
+            return 0.0
+        return max(0.0, self._timer + penalty - self.burst - now)
+
+    def drain_time(self):
+        """Estimated seconds until all queued lines are sent."""
+        now = self._clock()
+        timer = max(self._timer, now)
+        return max(0.0, timer + self._queued_penalty - self.burst - now)
+
+    def flush(self):
+        """Release all the lines that flood control allows."""
+        now = self._clock()
+        timer = max(self._timer, now)
+        limit = now + self.burst
+        lines = []
+        callbacks = []
+        for priority, queue in enumerate(self._queues):
+            while queue:
+                line, penalty, on_sent = queue[0]
+                # A line is held back if it would throttle us, unless
+                # it is urgent, or nothing was sent in a while (in
+                # which case it just has a really large penalty).
+                if (priority != PRIORITY_URGENT and
+                    timer > now and timer + penalty > limit):
+                    break
+                queue.popleft()
+                lines.append(line)
+                if on_sent is not None:
+                    callbacks.append(on_sent)
+                timer += penalty
+                self._queued_penalty -= penalty
+            if queue:
+                # Lower priority lines wait for this one.
+                break
+        self._timer = timer
+
+        if len(lines) == 1:
+            self._output(lines[0])
+        elif lines:
+            self._output(''.join(lines))
+        for on_sent in callbacks:
+            on_sent()
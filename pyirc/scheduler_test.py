@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for scheduler
+
+import unittest
+import scheduler
+
+class TestOutputScheduler(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.output = []
+        # 10 bytes lines cost 3 seconds, so 3 of them fit in a burst.
+        self.s = scheduler.OutputScheduler(
+            self.output.append, burst=10.0, line_penalty=2.0,
+            penalty_bytes=10, clock=lambda: self.now)
+
+    def testFloodControl(self):
+        """Lines are released at the allowed rate"""
+        for i in range(5):
+            self.s.send('PRIVMSG%d\r\n' % i)
+        self.assertEquals(self.output,
+                          ['PRIVMSG0\r\n', 'PRIVMSG1\r\n', 'PRIVMSG2\r\n'])
+        self.assertEquals(len(self.s), 2)
+        self.assertEquals(self.s.delay(), 2.0)
+        self.assertEquals(self.s.drain_time(), 5.0)
+
+        # Nothing happens until enough time passes.
+        self.now += 1
+        self.s.flush()
+        self.assertEquals(len(self.output), 3)
+
+        # Lines released together are coalesced.
+        self.now += 5
+        self.s.flush()
+        self.assertEquals(self.output[3:], ['PRIVMSG3\r\nPRIVMSG4\r\n'])
+        self.assertEquals(len(self.s), 0)
+        self.assertEquals(self.s.delay(), None)
+        self.assertEquals(self.s.drain_time(), 0.0)
+
+    def testPriorities(self):
+        """Urgent lines skip the queue"""
+        for i in range(3):
+            self.s.send('PRIVMSG%d\r\n' % i)
+        self.s.send('BULK00\r\n', scheduler.PRIORITY_BULK)
+        self.s.send('NOTICE00\r\n')
+        self.assertEquals(self.s.queue_depth(scheduler.PRIORITY_BULK), 1)
+        self.assertEquals(
+            self.s.queue_depth(scheduler.PRIORITY_INTERACTIVE), 1)
+
+        # PONG goes out right away, even though we're throttled.
+        self.s.send('PONG :foo\r\n')
+        self.assertEquals(self.output[-1], 'PONG :foo\r\n')
+        self.assertEquals(self.s.queue_depth(scheduler.PRIORITY_URGENT), 0)
+
+        # Interactive lines go before bulk ones.
+        self.now += 6
+        self.s.flush()
+        self.assertEquals(self.output[-1], 'NOTICE00\r\n')
+        self.now += 3
+        self.s.flush()
+        self.assertEquals(self.output[-1], 'BULK00\r\n')
+
+    def testClassify(self):
+        """Default priority classes"""
+        self.assertEquals(self.s.classify('PONG :foo\r\n'),
+                          scheduler.PRIORITY_URGENT)
+        self.assertEquals(self.s.classify('nick  :foo\r\n'),
+                          scheduler.PRIORITY_URGENT)
+        self.assertEquals(self.s.classify('PRIVMSG #a :foo\r\n'),
+                          scheduler.PRIORITY_INTERACTIVE)
+
+    def testOnSent(self):
+        """Senders are told when their lines are released"""
+        sent = []
+        for i in range(4):
+            self.s.send('PRIVMSG%d\r\n' % i,
+                        on_sent=lambda i=i: sent.append(i))
+        self.assertEquals(sent, [0, 1, 2])
+        self.now += 6
+        self.s.flush()
+        self.assertEquals(sent, [0, 1, 2, 3])
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# Queue of outgoing data for a connection.
+#
+# Data is kept as a deque of chunks, and the queue remembers how much
+# of the first chunk has already been sent. Partial sends therefore
+# never copy the queued data around. Small writes are coalesced into
+# bytearray chunks, so that each send() gets a decent amount of data.
+
+import collections
+
+# Writes smaller than this are coalesced into a shared chunk.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class SendQueue(object):
+    """FIFO of bytes waiting to be sent.
+
+    len() of the queue is the number of bytes waiting.
+    """
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._chunks = collections.deque()
+        # Bytes of the first chunk that have already been sent.
+        self._offset = 0
+        # Last chunk of the queue, if it is still open for appending.
+        self._tail = None
+        # Total size of the chunks other than _tail.
+        self._sealed = 0
+
+    def __len__(self):
+        queued = self._sealed - self._offset
+        if self._tail is not None:
+            queued += len(self._tail)
+        return queued
+
+    def _seal(self):
+        if self._tail is not None:
+            self._sealed += len(self._tail)
+            self._tail = None
+
+    def tail_buffer(self):
+        """Return a bytearray at the end of the queue.
+
+        Anything appended to the returned buffer is queued for
+        sending, which allows encoding data straight into the
+        queue. The buffer must not be kept around after more data
+        has been queued.
+        """
+        tail = self._tail
+        if tail is None or len(tail) >= self.chunk_size:
+            self._seal()
+            tail = self._tail = bytearray()
+            self._chunks.append(tail)
+        return tail
+
+    def append(self, data):
+        """Queue data for sending.
+
+        Large strings are queued as-is rather than copied, so they
+        must not be mutated afterwards.
+        """
+        if len(data) >= self.chunk_size:
+            self._seal()
+            self._chunks.append(data)
+            self._sealed += len(data)
+        else:
+            self.tail_buffer().extend(data)
+
+    def peek(self):
+        """Return a memoryview of the next bytes to send.
+
+        The view must be released before queuing more data.
+        """
+        if not self._chunks:
+            return memoryview('')
+        return memoryview(self._chunks[0])[self._offset:]
+
+    def consume(self, n):
+        """Drop the first n bytes of the queue, once they're sent."""
+        chunks = self._chunks
+        offset = self._offset + n
+        while chunks:
+            head = chunks[0]
+            if offset < len(head):
+                break
+            offset -= len(head)
+            chunks.popleft()
+            if head is self._tail:
+                self._tail = None
+            else:
+                self._sealed -= len(head)
+        self._offset = offset
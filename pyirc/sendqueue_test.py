@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for sendqueue
+
+import socket
+import unittest
+import sendqueue
+
+class TestSendQueue(unittest.TestCase):
+    def drain(self, q, amount):
+        data = q.peek()[:amount].tobytes()
+        q.consume(len(data))
+        return data
+
+    def testQueueing(self):
+        """Data queueing and partial sends"""
+        q = sendqueue.SendQueue(chunk_size=8)
+        self.assertEquals(len(q), 0)
+        self.assertEquals(q.peek().tobytes(), '')
+
+        # Small writes are coalesced.
+        q.append('ab')
+        q.append('cd')
+        self.assertEquals(len(q), 4)
+        self.assertEquals(q.peek().tobytes(), 'abcd')
+
+        # Partial sends leave the rest queued.
+        self.assertEquals(self.drain(q, 1), 'a')
+        self.assertEquals(len(q), 3)
+        q.append('ef')
+        self.assertEquals(q.peek().tobytes(), 'bcdef')
+
+        # Large writes get their own chunk.
+        big = 'x' * 10
+        q.append(big)
+        q.append('gh')
+        self.assertEquals(len(q), 17)
+        self.assertEquals(self.drain(q, 100), 'bcdef')
+        self.assertEquals(self.drain(q, 4), 'xxxx')
+        self.assertEquals(self.drain(q, 100), 'xxxxxx')
+        self.assertEquals(self.drain(q, 100), 'gh')
+        self.assertEquals(len(q), 0)
+
+    def testTailBuffer(self):
+        """Writing straight into the queue"""
+        q = sendqueue.SendQueue(chunk_size=8)
+        q.tail_buffer().extend('abc')
+        q.tail_buffer().extend('defghi')
+        self.assertEquals(len(q), 9)
+        # The tail is full, so further data goes to a new chunk.
+        q.tail_buffer().extend('jk')
+        self.assertEquals(len(q), 11)
+        self.assertEquals(self.drain(q, 100), 'abcdefghi')
+        self.assertEquals(self.drain(q, 100), 'jk')
+        self.assertEquals(len(q), 0)
+
+    def testSocketSend(self):
+        """Sending from the queue over a socket"""
+        a, b = socket.socketpair()
+        try:
+            q = sendqueue.SendQueue()
+            q.append('PING :1\r\n')
+            q.append('PING :2\r\n' * 1000)
+            while len(q):
+                q.consume(a.send(q.peek()))
+                b.recv(65536)
+        finally:
+            a.close()
+            b.close()
@@ -4,9 +4,14 @@
 
 import socket
 import asyncore
+import threading
 
+import codes
+import executor
+import protocol
+import scheduler
+import sendqueue
 import wireproto
-import server_capabilities
 
 class _ConnectionDispatcher(asyncore.dispatcher):
     """Thin wrapper around asyncore.dispatcher.
@@ -18,15 +23,18 @@ class _ConnectionDispatcher(asyncore.dispatcher):
     """
     def __init__(self, host, port, ext_handler, ext_sock=None):
         asyncore.dispatcher.__init__(self, sock=ext_sock)
-        self.send_buffer = []
-        self.recv_buffer = []
+        self.send_queue = sendqueue.SendQueue()
         self.ext_handler = ext_handler
         if not ext_sock:
             self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
             self.connect((host, port))
 
     def output(self, data):
-        self.send_buffer.append(data)
+        self.send_queue.append(data)
+
+    def output_many(self, messages):
+        """Encode and queue many messages, see wireproto.encode_many."""
+        wireproto.encode_many(messages, self.send_queue.tail_buffer())
 
     def handle_connect(self):
         self.ext_handler._handle_connect()
@@ -35,68 +43,253 @@ class _ConnectionDispatcher(asyncore.dispatcher):
         self.close()
         self.ext_handler._handle_close()
 
-    def handle_read(self):
-        data = self.recv(8192)
-
-        # Corner case: the line delimiter may have been split across
-        # packet boundaries. If so, we fuse all received data before
-        # attempting a split.
-        if len(self.recv_buffer) > 1 and data.startswith('\n'):
-            self.recv_buffer.append(data)
-            data = ''.join(self.recv_buffer)
-            self.recv_buffer = []
-
-        # Try to split the incoming data. If it worked, we have at
-        # least one full packet.
-        lines = data.split('\r\n')
-        if len(lines) == 1:
-            self.recv_buffer.append(data)
-            return
+    def recv_into(self, buf):
+        # Same as asyncore.dispatcher.recv, but receiving into the
+        # caller's buffer.
+        try:
+            n = self.socket.recv_into(buf)
+            if not n:
+                self.handle_close()
+            return n
+        except socket.error, why:
+            if why.args[0] in asyncore._DISCONNECTED:
+                self.handle_close()
+                return 0
+            raise
 
-        self.recv_buffer.append(lines[0])
-        self.ext_handler._handle_command(''.join(self.recv_buffer))
-        for line in lines[1:-1]:
-            self.ext_handler._handle_command(line)
-        self.recv_buffer = [lines[-1]]
+    def handle_read(self):
+        self.ext_handler._handle_read(self)
 
     def writable(self):
-        return (len(self.send_buffer) > 0)
+        # Called on every loop iteration, which gives the handler a
+        # chance to release output held back by flood control.
+        self.ext_handler._handle_tick()
+        return (len(self.send_queue) > 0)
 
     def handle_write(self):
-        data = ''.join(self.send_buffer)
-        sent = self.send(data)
-        data = data[sent:]
-        if data:
-            self.send_buffer = [data]
-        else:
-            self.send_buffer = []
+        sent = self.send(self.send_queue.peek())
+        self.send_queue.consume(sent)
 
 
 class Server(object):
     def __init__(self, host, port, nick, user, realname='nobody',
+                 profile_cache=None, executor=None,
                  _conn_class=_ConnectionDispatcher):
         self._conn = _conn_class(host, port, self)
-        self.nick = nick
-        self.user = user
-        self.realname = realname
+        self._wakeup = getattr(self._conn, 'wakeup', None)
+        self.host = host
 
-        self.capabilities = server_capabilities.ServerCapabilities()
+        # Capabilities are shared with the other connections to the
+        # same network, see the profiles module. With a
+        # profile_cache, we start from what the server told us last
+        # time.
+        self.profile_cache = profile_cache
+        profile = None
+        if profile_cache is not None:
+            profile = profile_cache.get(host)
+        # The protocol state of the connection, which the transport
+        # feeds with what it receives.
+        self.protocol = protocol.Connection(nick, user, realname,
+                                            profile=profile,
+                                            wants=self._wants)
+        self._profile = self.protocol.profile
+        self._profile_handlers = ()
+        self.output_scheduler = scheduler.OutputScheduler(self._conn.output)
 
-        self._command_handlers = {'005': self.capabilities.handle_isupport}
+        self._command_handlers = {}
+        self._catchall_handlers = ()
+        self._tick_handlers = ()
+        self._close_handlers = ()
+        # Executor running blocking handlers, created on demand
+        # unless one is given to share between servers.
+        self.executor = None
+        if executor is not None:
+            self._use_executor(executor)
+        self._blocking_handlers = {}
+        self._loop_thread = threading.current_thread()
 
-    def _handle_connect(self):
-        self._conn.output(wireproto.encode('NICK', self.nick))
-        self._conn.output(wireproto.encode(
-            'USER', self.user, '0', '*', self.realname))
-
-    def _handle_command(self, command):
-        cmd = wireproto.decode(command)
-        if cmd.command in self._command_handlers:
-            self._command_handlers[cmd.command](cmd)
+        self.add_handler(codes.RPL_ENDOFMOTD, self._handle_isupport_done)
+        self.add_handler(codes.ERR_NOMOTD, self._handle_isupport_done)
+        self.add_handler(codes.RPL_ENDOFMOTD, self._handle_endofmotd)
+
+    @property
+    def nick(self):
+        """Our current nick."""
+        return self.protocol.nick
+
+    @property
+    def profile(self):
+        """The profiles.Profile of the server."""
+        return self.protocol.profile
+
+    @property
+    def ignored_commands(self):
+        """Count of received messages nobody was interested in."""
+        return self.protocol.ignored
+
+    @property
+    def capabilities(self):
+        """The frozen ServerCapabilities of the server."""
+        return self.profile.capabilities
+
+    def add_handler(self, command, handler, blocking=False):
+        """Call handler with every received message for command.
+
+        command is a command token or code, see the codes
+        module. If command is None, handler receives all messages.
+
+        If blocking is true, handler is run by a thread pool
+        instead of the loop thread. Messages about the same channel,
+        or from the same user, are still handled one at a time and in
+        order. The handler can call output(), but nothing else on
+        the Server.
+        """
+        if command is not None:
+            command = codes.command_code(command)
+        if blocking:
+            if self.executor is None:
+                self._use_executor(executor.OrderedExecutor())
+            def run_blocking(msg, handler=handler):
+                self.executor.submit(self._ordering_key(msg), handler, msg)
+            self._blocking_handlers[(command, handler)] = run_blocking
+            handler = run_blocking
+        if command is None:
+            self._catchall_handlers += (handler,)
+        else:
+            self._command_handlers[command] = (
+                self._command_handlers.get(command, ()) + (handler,))
+
+    def _use_executor(self, executor):
+        self.executor = executor
+        if self._wakeup is not None:
+            executor.add_notify(self._wakeup)
+
+    def add_profile_handler(self, handler):
+        """Call handler(profile) whenever the server's profile changes.
+
+        This is the time to drop whatever was derived from the old
+        capabilities.
+        """
+        self._profile_handlers += (handler,)
+
+    def add_tick_handler(self, handler):
+        """Call handler() from the loop thread, at least once a second."""
+        self._tick_handlers += (handler,)
+
+    def add_close_handler(self, handler):
+        """Call handler() from the loop thread once the connection closes."""
+        self._close_handlers += (handler,)
+
+    def remove_handler(self, command, handler):
+        """Unregister a handler previously passed to add_handler."""
+        if command is not None:
+            command = codes.command_code(command)
+        handler = self._blocking_handlers.pop((command, handler), handler)
+        if command is None:
+            handlers = list(self._catchall_handlers)
+            handlers.remove(handler)
+            self._catchall_handlers = tuple(handlers)
         else:
-            print 'Ignored %s' % cmd.command
-        if cmd.command == '376':
-            self._conn.output(wireproto.encode('QUIT'))
+            handlers = list(self._command_handlers[command])
+            handlers.remove(handler)
+            if handlers:
+                self._command_handlers[command] = tuple(handlers)
+            else:
+                del self._command_handlers[command]
+
+    def output(self, line, priority=None, on_sent=None):
+        """Send an encoded line, subject to flood control.
+
+        priority is one of the scheduler.PRIORITY_* classes, and
+        defaults to one picked from the line's command. If given,
+        on_sent() is called from the loop thread once flood control
+        lets the line go.
+        """
+        if (self.executor is not None and
+            threading.current_thread() is not self._loop_thread):
+            self.executor.call_in_loop(self.output, line, priority, on_sent)
+            return
+        self.output_scheduler.send(line, priority, on_sent)
+
+    def fanout(self, command, targets, text, priority=None):
+        """Send the same PRIVMSG or NOTICE text to many targets.
+
+        Targets are grouped into as few lines as the server's TARGMAX
+        and the line length allow, and duplicate targets are dropped.
+        Long texts are split so that they fit once the server puts our
+        hostmask in front.
+        """
+        caps = self.capabilities
+        key = caps.casemapper.key
+        seen = set()
+        unique = []
+        for target in targets:
+            target = wireproto._utf8ize(target)
+            k = key(target)
+            if k not in seen:
+                seen.add(k)
+                unique.append(target)
+        for line in wireproto.encode_fanout(
+            command, unique, text, caps.max_targets(command) or 1,
+            self.protocol.hostmask_length()):
+            self.output(line, priority)
+
+    def _ordering_key(self, msg):
+        # Messages to a channel are ordered by channel, anything else
+        # by sender.
+        caps = self.capabilities
+        args = msg.args
+        if args and caps.is_channel(args[0]):
+            return caps.casemapper.key(args[0])
+        return caps.casemapper.key(msg.nick or msg.hostmask or '')
+
+    def _wants(self, code):
+        # Most traffic is of no interest to anyone, so the protocol
+        # asks before paying for a full decode.
+        return code in self._command_handlers or bool(self._catchall_handlers)
+
+    def _send_protocol_output(self):
+        data = self.protocol.data_to_send()
+        if data:
+            for line in data.splitlines(True):
+                self.output(line)
+
+    def _handle_connect(self):
+        self.protocol.connection_made()
+        self._send_protocol_output()
+
+    def _handle_read(self, conn):
+        protocol = self.protocol
+        protocol.recv_into(conn)
+        for msg in protocol.events():
+            if protocol.profile is not self._profile:
+                self._profile = protocol.profile
+                for handler in self._profile_handlers:
+                    handler(self._profile)
+            for handler in self._catchall_handlers:
+                handler(msg)
+            for handler in self._command_handlers.get(msg.code, ()):
+                handler(msg)
+        self._send_protocol_output()
+
+    def _handle_isupport_done(self, cmd):
+        if self.profile_cache is not None and self.protocol.isupport:
+            self.profile_cache.put(self.host, self.profile)
+
+    def _handle_endofmotd(self, cmd):
+        self.output(wireproto.encode('QUIT'))
+
+    def _handle_tick(self):
+        if self.executor is not None:
+            self.executor.run_pending()
+        for handler in self._tick_handlers:
+            handler()
+        self.output_scheduler.flush()
 
     def _handle_close(self):
+        if self.executor is not None and self._wakeup is not None:
+            self.executor.remove_notify(self._wakeup)
+            self._wakeup = None
+        for handler in self._close_handlers:
+            handler()
         print "Done!"
@@ -3,6 +3,14 @@
 # Class defining the capabilities of an IRC server, as given by the
 # RPL_ISUPPORT message, numeric 005.
 
+import itertools
+
+import casemapping
+
+# Source of ServerCapabilities versions. They are drawn from a single
+# counter, so that different instances never share a version.
+_versions = itertools.count(1)
+
 def _mkproperty(capname, withdel=False):
     """Decorator function to register a property.
 
@@ -52,20 +60,59 @@ CHANMODE_NO_PARAM = 3
 
 
 class ServerCapabilities(object):
-    _casemapping = 'ascii' # TODO(dave): Should be rfc1459, see below.
+    # Set while apply_isupport() runs, to leave the checks between
+    # capabilities to the end of the transaction.
+    _deferred = False
+
+    # ISUPPORT tokens we know nothing about, name -> raw value (None
+    # for tokens without a value).
+    unknown = {}
+
+    # Set by freeze().
+    _frozen = False
+
+    # Renewed on every change, so that whatever is derived from the
+    # capabilities knows when to recompute. Versions increase
+    # monotonically, across instances too, so switching to other
+    # capabilities is a change as well. A transaction counts as a
+    # single change.
+    version = 0
+    # (version, tables) of the tables built by _derived_tables().
+    _derived = (-1, None)
+
+    def __setattr__(self, name, value):
+        if self._frozen:
+            raise AttributeError('Capabilities are frozen')
+        object.__setattr__(self, name, value)
+        if not self._deferred:
+            object.__setattr__(self, 'version', next(_versions))
+
+    def __delattr__(self, name):
+        if self._frozen:
+            raise AttributeError('Capabilities are frozen')
+        object.__delattr__(self, name)
+        if not self._deferred:
+            object.__setattr__(self, 'version', next(_versions))
+
+    def freeze(self):
+        """Make the capabilities read-only, so they can be shared."""
+        object.__setattr__(self, '_frozen', True)
+
+    # RFC 1459 says nicks and channels are compared this way, so it
+    # is the default.
+    _casemapping = 'rfc1459'
+    # The casemapping.Casemapping engine for CASEMAPPING.
+    casemapper = casemapping.get(_casemapping)
     @_mkproperty('CASEMAPPING')
     def casemapping():
         def fset(self, v):
             if v not in ('ascii', 'rfc1459', 'strict-rfc1459'):
                 raise CapabilityValueError('CASEMAPPING', v)
-            # TODO(dave): Support other casemappings, if they are
-            # still around in the wild.
-            if v != 'ascii':
-                raise NotImplementedError(
-                    'Only CASEMAPPING=ascii is supported')
             self._casemapping = v
+            self.casemapper = casemapping.get(v)
         def fdel(self):
             del self._casemapping
+            del self.casemapper
         return locals()
 
     _chanlimit = None
@@ -82,14 +129,15 @@ class ServerCapabilities(object):
             except ValueError:
                 raise CapabilityValueError('CHANLIMIT', v)
 
-            # All specified prefixes have to have been defined by
-            # CHANTYPES
-            chantypes = self.chantypes
-            for prefixes in limits.keys():
-                if not prefixes.issubset(chantypes):
-                    raise CapabilityLogicError(
-                        'Channel prefix(es) %s used in CHANLIMIT, but not '
-                        'defined in CHANTYPES %s' % (prefixes, chantypes))
+            if not self._deferred:
+                # All specified prefixes have to have been defined by
+                # CHANTYPES
+                chantypes = self.chantypes
+                for prefixes in limits.keys():
+                    if not prefixes.issubset(chantypes):
+                        raise CapabilityLogicError(
+                            'Channel prefix(es) %s used in CHANLIMIT, but not '
+                            'defined in CHANTYPES %s' % (prefixes, chantypes))
 
             self._chanlimit = limits
         return locals()
@@ -107,25 +155,27 @@ class ServerCapabilities(object):
             oldmodes = self._chanmodes
             self._chanmodes = dict(enumerate(frozenset(iter(x)) for x in v))
 
-            # Check for broken dependent capabilities
-            try:
-                if self.excepts:
-                    self.excepts = self.excepts
-                if self.invex:
-                    self.invex = self.invex
-                if self.maxlist:
-                    self.maxlist = ','.join('%s:%d' % (''.join(k), v)
-                                            for k,v in self.maxlist.iteritems())
-                if self.prefix:
-                    prefix_modes = set(self.prefix.keys())
-                    for modes in self._chanmodes.values():
-                        if prefix_modes.intersection(modes):
-                            raise CapabilityLogicError(
-                                'New CHANMODES definition overlaps modes '
-                                'defined by PREFIX')
-            except CapabilityLogicError:
-                self._chanmodes = oldmodes
-                raise
+            if not self._deferred:
+                # Check for broken dependent capabilities
+                try:
+                    if self.excepts:
+                        self.excepts = self.excepts
+                    if self.invex:
+                        self.invex = self.invex
+                    if self.maxlist:
+                        self.maxlist = ','.join(
+                            '%s:%d' % (''.join(k), v)
+                            for k,v in self.maxlist.iteritems())
+                    if self.prefix:
+                        prefix_modes = set(self.prefix.keys())
+                        for modes in self._chanmodes.values():
+                            if prefix_modes.intersection(modes):
+                                raise CapabilityLogicError(
+                                    'New CHANMODES definition overlaps modes '
+                                    'defined by PREFIX')
+                except CapabilityLogicError:
+                    self._chanmodes = oldmodes
+                    raise
 
         return locals()
 
@@ -149,16 +199,17 @@ class ServerCapabilities(object):
             v = v or ''
             types = frozenset(iter(v))
 
-            # CHANTYPES validates the content of CHANLIMIT, so we need
-            # to check that the values still make sense.
-            chanlimit = self.chanlimit
-            if chanlimit:
-                for prefixes in chanlimit.keys():
-                    if not prefixes.issubset(types):
-                        raise CapabilityLogicError(
-                            'Channel types redefined to "%s", but CHANLIMIT '
-                            'specifies limits for prefix(es) "%s"' % (types,
-                                                                      prefixes))
+            if not self._deferred:
+                # CHANTYPES validates the content of CHANLIMIT, so we need
+                # to check that the values still make sense.
+                chanlimit = self.chanlimit
+                if chanlimit:
+                    for prefixes in chanlimit.keys():
+                        if not prefixes.issubset(types):
+                            raise CapabilityLogicError(
+                                'Channel types redefined to "%s", but '
+                                'CHANLIMIT specifies limits for prefix(es) '
+                                '"%s"' % (types, prefixes))
             self._chantypes = types
         return locals()
 
@@ -170,18 +221,33 @@ class ServerCapabilities(object):
             if len(v) != 1:
                 raise CapabilityValueError('EXCEPTS', v)
 
-            # The except flag must be defined as an A type chanmode.
-            chanmodes = self.chanmodes
-            if chanmodes and v not in chanmodes[CHANMODE_LIST]:
-                raise CapabilityLogicError(
-                    'Channel flag "%s" defined for EXCEPTS, but not an A type '
-                    'channel flag according to CHANMODES' % v)
+            if not self._deferred:
+                # The except flag must be defined as an A type chanmode.
+                chanmodes = self.chanmodes
+                if chanmodes and v not in chanmodes[CHANMODE_LIST]:
+                    raise CapabilityLogicError(
+                        'Channel flag "%s" defined for EXCEPTS, but not an A '
+                        'type channel flag according to CHANMODES' % v)
             self._excepts = v
         return locals()
 
     # TODO(dave): Possibly implement IDCHAN, if anyone comes across an
     # ircd that actually supports !chans.
 
+    # RFC 1123 caps host names at 63 characters.
+    _hostlen = 63
+    @_mkproperty('HOSTLEN', withdel=True)
+    def hostlen():
+        def fset(self, v):
+            try:
+                if not v:
+                    raise ValueError
+                v = int(v)
+            except ValueError:
+                raise CapabilityValueError('HOSTLEN', v)
+            self._hostlen = v
+        return locals()
+
     _invex = None
     @_mkproperty('INVEX', withdel=True)
     def invex():
@@ -190,12 +256,13 @@ class ServerCapabilities(object):
             if len(v) != 1:
                 raise CapabilityValueError('INVEX', v)
 
-            # The invex flag must be defined as an A type chanmode.
-            chanmodes = self.chanmodes
-            if chanmodes and v not in chanmodes[CHANMODE_LIST]:
-                raise CapabilityLogicError(
-                    'Channel flag "%s" defined for INVEX, but not an A type '
-                    'channel flag according to CHANMODES' % v)
+            if not self._deferred:
+                # The invex flag must be defined as an A type chanmode.
+                chanmodes = self.chanmodes
+                if chanmodes and v not in chanmodes[CHANMODE_LIST]:
+                    raise CapabilityLogicError(
+                        'Channel flag "%s" defined for INVEX, but not an A '
+                        'type channel flag according to CHANMODES' % v)
             self._invex = v
         return locals()
 
@@ -224,18 +291,19 @@ class ServerCapabilities(object):
             except ValueError:
                 raise CapabilityValueError('MAXLIST', v)
 
-            # If chanmodes has been set, verify that all A type flags
-            # are covered here.
-            chanmodes = self.chanmodes
-            if chanmodes:
-                max = set()
-                for flags in v.keys():
-                    max.update(flags)
-                if max != chanmodes[CHANMODE_LIST]:
-                    raise CapabilityLogicError(
-                        'MAXLIST set for flags "%s", but CHANMODES says '
-                        'there should be the following A type flags: "%s"' % (
-                        flags, chanmodes[CHANMODE_LIST]))
+            if not self._deferred:
+                # If chanmodes has been set, verify that all A type flags
+                # are covered here.
+                chanmodes = self.chanmodes
+                if chanmodes:
+                    max = set()
+                    for flags in v.keys():
+                        max.update(flags)
+                    if max != chanmodes[CHANMODE_LIST]:
+                        raise CapabilityLogicError(
+                            'MAXLIST set for flags "%s", but CHANMODES says '
+                            'there should be the following A type flags: '
+                            '"%s"' % (flags, chanmodes[CHANMODE_LIST]))
 
             self._maxlist = v
         return locals()
@@ -276,38 +344,47 @@ class ServerCapabilities(object):
         return locals()
 
     _prefix = {'o': '@', 'v': '+'}
-    @_mkproperty('PREFIX', withdel=True)
+    # The PREFIX modes, most powerful first.
+    prefix_modes = 'ov'
+    @_mkproperty('PREFIX')
     def prefix():
         def fset(self, v):
             v = v or {}
+            ranked = ''
             if v:
                 mapping = v[1:].split(')')
                 if (v[0] != '(' or
                     len(mapping) != 2 or
                     len(mapping[0]) != len(mapping[1])):
                     raise CapabilityValueError('PREFIX', v)
+                ranked = mapping[0]
                 v = dict(zip(iter(mapping[0]), iter(mapping[1])))
 
-            # Modes defined in PREFIX should not be also defined in
-            # CHANMODES.
-            chanmodes = self.chanmodes
-            if chanmodes:
-                prefix_modes = set(v.keys())
-                for modes in chanmodes.values():
-                    if modes.intersection(prefix_modes):
-                        raise CapabilityLogicError(
-                            'User modes "%s" defined in PREFIX '
-                            'are also defined as CHANMODES' % prefix_modes)
+            if not self._deferred:
+                # Modes defined in PREFIX should not be also defined in
+                # CHANMODES.
+                chanmodes = self.chanmodes
+                if chanmodes:
+                    prefix_modes = set(v.keys())
+                    for modes in chanmodes.values():
+                        if modes.intersection(prefix_modes):
+                            raise CapabilityLogicError(
+                                'User modes "%s" defined in PREFIX '
+                                'are also defined as CHANMODES' % prefix_modes)
 
-            # Prefixes defined in STATUSMSG have to be present.
-            statusmsg = self.statusmsg
-            if not statusmsg.issubset(set(v.values())):
-                raise CapabilityLogicError(
-                    'User prefixes "%s" defined in STATUSMSG '
-                    'are not in the new PREFIX prefixes "%s"' % (
-                    ''.join(sorted(statusmsg)), ''.join(sorted(v))))
+                # Prefixes defined in STATUSMSG have to be present.
+                statusmsg = self.statusmsg
+                if not statusmsg.issubset(set(v.values())):
+                    raise CapabilityLogicError(
+                        'User prefixes "%s" defined in STATUSMSG '
+                        'are not in the new PREFIX prefixes "%s"' % (
+                        ''.join(sorted(statusmsg)), ''.join(sorted(v))))
 
             self._prefix = v
+            self.prefix_modes = ranked
+        def fdel(self):
+            del self._prefix
+            del self.prefix_modes
         return locals()
 
     _safelist = False
@@ -326,26 +403,27 @@ class ServerCapabilities(object):
         def fset(self, v):
             v = frozenset(iter(v))
 
-            # STATUSMSG modes must match those in prefix
-            prefixes = self.prefix
-            if not prefixes:
-                raise CapabilityLogicError(
-                    'STATUSMSG correctness depends on definition of PREFIX, '
-                    'but PREFIX not defined')
-            prefixes = set(prefixes.values())
-            for prefix in v:
-                if prefix not in prefixes:
+            if not self._deferred:
+                # STATUSMSG modes must match those in prefix
+                prefixes = self.prefix
+                if not prefixes:
                     raise CapabilityLogicError(
-                        'STATUSMSG prefix "%s" is not in PREFIX: "%s"' %(
-                        sorted(v), sorted(prefixes)))
+                        'STATUSMSG correctness depends on definition of '
+                        'PREFIX, but PREFIX not defined')
+                prefixes = set(prefixes.values())
+                for prefix in v:
+                    if prefix not in prefixes:
+                        raise CapabilityLogicError(
+                            'STATUSMSG prefix "%s" is not in PREFIX: "%s"' %(
+                            sorted(v), sorted(prefixes)))
 
-            # STATUSMSG prefixes cannot be the same as CHANTYPES prefixes.
-            chantypes = self.chantypes
-            if chantypes:
-                if chantypes.intersection(v):
-                    raise CapabilityLogicError(
-                        'STATUSMSG prefixes "%s" intersect with '
-                        'some prefixes defined by CHANTYPES.' % sorted(v))
+                # STATUSMSG prefixes cannot be the same as CHANTYPES prefixes.
+                chantypes = self.chantypes
+                if chantypes:
+                    if chantypes.intersection(v):
+                        raise CapabilityLogicError(
+                            'STATUSMSG prefixes "%s" intersect with '
+                            'some prefixes defined by CHANTYPES.' % sorted(v))
 
             self._statusmsg = v
         return locals()
@@ -384,6 +462,20 @@ class ServerCapabilities(object):
             self._topiclen = v
         return locals()
 
+    # The usual ident length, on servers that don't say.
+    _userlen = 10
+    @_mkproperty('USERLEN', withdel=True)
+    def userlen():
+        def fset(self, v):
+            try:
+                if not v:
+                    raise ValueError
+                v = int(v)
+            except ValueError:
+                raise CapabilityValueError('USERLEN', v)
+            self._userlen = v
+        return locals()
+
     #
     # Helpers to set capabilities from an RPL_ISUPPORT formatted
     # string
@@ -398,13 +490,177 @@ class ServerCapabilities(object):
             cap.append(None)
         setattr(self, cap[0].lower(), cap[1])
 
-    def handle_isupport(self, cmd):
-        print 'CAPS: %s' % ' '.join(cmd.args)
-        for cap in cmd.args[1:-1]:
-            try:
-                self.setCapability(cap)
-                print 'Set %s' % cap
-            except CapabilityValueError:
-                print 'Value error: %s' % cap
-            except CapabilityLogicError:
-                print 'Logic error: %s' % cap
+    def setCapabilities(self, caps_str):
+        """Set space separated capabilities, one after the other.
+
+        Example: TOPICLEN=5 INVEX
+        """
+        for cap in caps_str.split():
+            self.setCapability(cap)
+
+    def apply_isupport(self, tokens):
+        """Apply a set of ISUPPORT tokens as a single transaction.
+
+        All the tokens are parsed first, then the capabilities are
+        checked against each other once. If anything is wrong, the
+        error is raised and the capabilities are left untouched, so
+        the order of the tokens doesn't matter. Tokens of the form
+        -NAME reset NAME to its default, and unknown tokens are kept
+        as is in unknown.
+        """
+        saved = self.__dict__.copy()
+        unknown = None
+        self._deferred = True
+        try:
+            for token in tokens:
+                cap = token.split('=', 1)
+                if len(cap) == 1:
+                    cap.append(None)
+                name, value = cap
+                negate = name.startswith('-')
+                if negate:
+                    name = name[1:]
+                attr = name.lower()
+                if isinstance(getattr(ServerCapabilities, attr, None),
+                              property):
+                    if not negate:
+                        setattr(self, attr, value)
+                    else:
+                        try:
+                            delattr(self, attr)
+                        except AttributeError:
+                            # Not deletable, go back to the class value.
+                            self.__dict__.pop('_' + attr, None)
+                    continue
+                if unknown is None:
+                    unknown = dict(self.unknown)
+                if negate:
+                    unknown.pop(name, None)
+                else:
+                    unknown[name] = value
+            if unknown is not None:
+                self.unknown = unknown
+            del self._deferred
+            self._validate()
+        except:
+            self.__dict__.clear()
+            self.__dict__.update(saved)
+            raise
+
+    def _validate(self):
+        """Check that the capabilities make sense together."""
+        chantypes = self.chantypes
+        if self.chanlimit:
+            for prefixes in self.chanlimit:
+                if not prefixes.issubset(chantypes):
+                    raise CapabilityLogicError(
+                        'Channel prefix(es) %s used in CHANLIMIT, but not '
+                        'defined in CHANTYPES %s' % (prefixes, chantypes))
+
+        chanmodes = self.chanmodes
+        if chanmodes:
+            listmodes = chanmodes[CHANMODE_LIST]
+            for cap in ('EXCEPTS', 'INVEX'):
+                flag = getattr(self, cap.lower())
+                if flag and flag not in listmodes:
+                    raise CapabilityLogicError(
+                        'Channel flag "%s" defined for %s, but not an A '
+                        'type channel flag according to CHANMODES' % (flag,
+                                                                      cap))
+            if self.maxlist:
+                flags = set()
+                for f in self.maxlist:
+                    flags.update(f)
+                if flags != listmodes:
+                    raise CapabilityLogicError(
+                        'MAXLIST set for flags "%s", but CHANMODES says '
+                        'there should be the following A type flags: '
+                        '"%s"' % (''.join(flags), ''.join(listmodes)))
+            prefix_modes = set(self.prefix)
+            for modes in chanmodes.values():
+                if modes.intersection(prefix_modes):
+                    raise CapabilityLogicError(
+                        'User modes "%s" defined in PREFIX '
+                        'are also defined as CHANMODES' % prefix_modes)
+
+        statusmsg = self.statusmsg
+        if statusmsg:
+            prefixes = set(self.prefix.values())
+            if not statusmsg.issubset(prefixes):
+                raise CapabilityLogicError(
+                    'STATUSMSG prefix "%s" is not in PREFIX: "%s"' % (
+                    sorted(statusmsg), sorted(prefixes)))
+            if chantypes.intersection(statusmsg):
+                raise CapabilityLogicError(
+                    'STATUSMSG prefixes "%s" intersect with '
+                    'some prefixes defined by CHANTYPES.' % sorted(statusmsg))
+
+    #
+    # Lookups derived from the capabilities
+    #
+    def _derived_tables(self):
+        """Return the derived tables, rebuilt if anything changed.
+
+        They are (prefix order, prefix ranks, targmax by command).
+        """
+        version, tables = self._derived
+        if version != self.version:
+            prefix = self.prefix
+            order = ''.join(prefix[m] for m in self.prefix_modes)
+            ranks = dict((p, rank) for rank, p in enumerate(order))
+            targmax = dict((command.upper(), n)
+                           for command, n in self.targmax.iteritems())
+            tables = (order, ranks, targmax)
+            # Not a change of the capabilities, and fine when frozen.
+            object.__setattr__(self, '_derived', (self.version, tables))
+        return tables
+
+    def is_channel(self, target):
+        """Return whether target is a channel name."""
+        return target[:1] in self.chantypes
+
+    @property
+    def prefix_order(self):
+        """The PREFIX prefixes, most powerful first (e.g. '@%+')."""
+        return self._derived_tables()[0]
+
+    def prefix_rank(self, prefix):
+        """Rank of a PREFIX prefix, 0 being the most powerful.
+
+        Returns None for characters that aren't prefixes.
+        """
+        return self._derived_tables()[1].get(prefix)
+
+    def split_statusmsg(self, target):
+        """Split a message target into (STATUSMSG prefixes, target).
+
+        '@#chan' gives ('@', '#chan'), targets without STATUSMSG
+        prefixes give ('', target).
+        """
+        statusmsg = self.statusmsg
+        i = 0
+        while i < len(target) and target[i] in statusmsg:
+            i += 1
+        if i and self.is_channel(target[i:]):
+            return target[:i], target[i:]
+        return '', target
+
+    def max_hostmask_length(self, nick=None):
+        """Upper bound of the length of a nick!user@host hostmask.
+
+        If given, nick is the nick of the hostmask, otherwise it is
+        assumed to be NICKLEN long. Servers prefix the user with a ~
+        when ident fails, which USERLEN doesn't always count.
+        """
+        if nick is None:
+            nicklen = self.nicklen
+        else:
+            nicklen = len(nick)
+        return nicklen + 1 + 1 + self.userlen + 1 + self.hostlen
+
+    def max_targets(self, command):
+        """Maximum number of targets of command, per TARGMAX.
+
+        Returns None if TARGMAX sets no limit for command.
+        """
+        return self._derived_tables()[2].get(command.upper())
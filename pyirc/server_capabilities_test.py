@@ -2,6 +2,7 @@
 #
 # Unit tests for ServerCapabilities
 
+import itertools
 import unittest
 import server_capabilities as scap
 
@@ -10,19 +11,17 @@ class TestServerCapabilities(unittest.TestCase):
         """CASEMAPPING capability semantics"""
         c = scap.ServerCapabilities()
 
-        # Default value
-        self.assertEquals(c.casemapping, 'ascii')
+        # Default value, as per RFC 1459.
+        self.assertEquals(c.casemapping, 'rfc1459')
+        self.assertEquals(c.casemapper.name, 'rfc1459')
 
-        # Explicitely setting 'ascii'
+        # Setting other valid values swaps the casemapping engine.
         c.casemapping = 'ascii'
         self.assertEquals(c.casemapping, 'ascii')
-
-        # Setting other valid values. We don't support them, so check
-        # that we do raise the appropriate exception.
-        self.assertRaises(
-            NotImplementedError, setattr, c, 'casemapping', 'rfc1459')
-        self.assertRaises(
-            NotImplementedError, setattr, c, 'casemapping', 'strict-rfc1459')
+        self.assertEquals(c.casemapper.name, 'ascii')
+        c.casemapping = 'strict-rfc1459'
+        self.assertEquals(c.casemapping, 'strict-rfc1459')
+        self.assertEquals(c.casemapper.name, 'strict-rfc1459')
 
         # Setting invalid values raises a value error.
         self.assertRaises(
@@ -34,7 +33,8 @@ class TestServerCapabilities(unittest.TestCase):
 
         # Deleting resets to the default.
         del c.casemapping
-        self.assertEquals(c.casemapping, 'ascii')
+        self.assertEquals(c.casemapping, 'rfc1459')
+        self.assertEquals(c.casemapper.name, 'rfc1459')
 
     def testChanlimit(self):
         """CHANLIMIT capability semantics"""
@@ -223,6 +223,26 @@ class TestServerCapabilities(unittest.TestCase):
         c.excepts = 'a'
         self.assertEquals(c.excepts, 'a')
 
+    def testHostlen(self):
+        """HOSTLEN capability semantics"""
+        c = scap.ServerCapabilities()
+
+        # Default value
+        self.assertEquals(c.hostlen, 63)
+
+        # Setting no value or garbage fails
+        self.assertRaises(
+            scap.CapabilityValueError, setattr, c, 'hostlen', '')
+        self.assertRaises(
+            scap.CapabilityValueError, setattr, c, 'hostlen', 'bleh')
+
+        c.hostlen = 32
+        self.assertEquals(c.hostlen, 32)
+
+        # Deletion resets default
+        del c.hostlen
+        self.assertEquals(c.hostlen, 63)
+
     def testInvex(self):
         """INVEX capability semantics"""
         c = scap.ServerCapabilities()
@@ -393,6 +413,7 @@ class TestServerCapabilities(unittest.TestCase):
 
         # Default value
         self.assertEquals(c.prefix, {'o': '@', 'v': '+'})
+        self.assertEquals(c.prefix_modes, 'ov')
 
         # Setting no values clear all prefixes
         c.prefix = None
@@ -402,12 +423,14 @@ class TestServerCapabilities(unittest.TestCase):
         # Somewhat anal case, but possible in theory.
         c.prefix = '()'
         self.assertEquals(c.prefix, {})
+        self.assertEquals(c.prefix_modes, '')
 
         # Setting values according to the syntax is cool
         c.prefix = '(ab)$%'
         self.assertEquals(c.prefix, {'a': '$', 'b': '%'})
         c.prefix = '(ohv)@%+'
         self.assertEquals(c.prefix, {'o': '@', 'h': '%', 'v': '+'})
+        self.assertEquals(c.prefix_modes, 'ohv')
 
         # Syntax errors are not cool.
         self.assertRaises(
@@ -421,6 +444,11 @@ class TestServerCapabilities(unittest.TestCase):
         self.assertRaises(
             scap.CapabilityValueError, setattr, c, 'prefix', '(bl)eeh')
 
+        # Deletion resets the default.
+        del c.prefix
+        self.assertEquals(c.prefix, {'o': '@', 'v': '+'})
+        self.assertEquals(c.prefix_modes, 'ov')
+
         # If chanmodes is defined, our modes are restricted.
         c.chanmodes = 'ab,cd,ef,gi'
         self.assertRaises(
@@ -549,6 +577,26 @@ class TestServerCapabilities(unittest.TestCase):
         del c.topiclen
         self.assertEquals(c.topiclen, None)
 
+    def testUserlen(self):
+        """USERLEN capability semantics"""
+        c = scap.ServerCapabilities()
+
+        # Default value
+        self.assertEquals(c.userlen, 10)
+
+        # Setting no value or garbage fails
+        self.assertRaises(
+            scap.CapabilityValueError, setattr, c, 'userlen', '')
+        self.assertRaises(
+            scap.CapabilityValueError, setattr, c, 'userlen', 'bleh')
+
+        c.userlen = 32
+        self.assertEquals(c.userlen, 32)
+
+        # Deletion resets default
+        del c.userlen
+        self.assertEquals(c.userlen, 10)
+
     def testCapabilitySetting(self):
         """Capability setting helpers"""
         c = scap.ServerCapabilities()
@@ -578,3 +626,114 @@ class TestServerCapabilities(unittest.TestCase):
         self.assertRaises(scap.CapabilityLogicError,
                           c.setCapabilities,
                           'CHANLIMIT=@%:42,&:5 CHANTYPES=@%&')
+
+    def testApplyIsupport(self):
+        """Transactional ISUPPORT application"""
+        c = scap.ServerCapabilities()
+
+        # Order doesn't matter, everything is checked at the end.
+        c.apply_isupport(['CHANLIMIT=#%:42,&:5', 'MAXLIST=beI:100',
+                          'STATUSMSG=~@', 'CHANTYPES=#%&',
+                          'CHANMODES=beI,k,l,imnt', 'PREFIX=(qov)~@+',
+                          'EXCEPTS', 'WHOX', 'CHARSET=ascii'])
+        self.assertEquals(c.chantypes, frozenset(['#', '%', '&']))
+        self.assertEquals(c.chanlimit, {frozenset(['#','%']): 42,
+                                        frozenset(['&']): 5})
+        self.assertEquals(c.statusmsg, frozenset(['~', '@']))
+        self.assertEquals(c.excepts, 'e')
+        self.assertEquals(c.unknown, {'WHOX': None, 'CHARSET': 'ascii'})
+
+        # A broken combination leaves everything untouched.
+        self.assertRaises(scap.CapabilityLogicError, c.apply_isupport,
+                          ['TOPICLEN=42', 'CHANTYPES=#', 'FOO=bar'])
+        self.assertEquals(c.topiclen, None)
+        self.assertEquals(c.chantypes, frozenset(['#', '%', '&']))
+        self.assertEquals(c.unknown, {'WHOX': None, 'CHARSET': 'ascii'})
+        self.assertRaises(scap.CapabilityValueError, c.apply_isupport,
+                          ['TOPICLEN=42', 'NICKLEN=bleh'])
+        self.assertEquals(c.topiclen, None)
+        self.assertRaises(scap.CapabilityLogicError, c.apply_isupport,
+                          ['PREFIX=(v)+'])
+        self.assertEquals(c.prefix_modes, 'qov')
+
+        # Negated tokens go back to the defaults.
+        c.apply_isupport(['-STATUSMSG', '-CHANLIMIT', '-CHANTYPES', '-WHOX'])
+        self.assertEquals(c.statusmsg, frozenset())
+        self.assertEquals(c.chanlimit, None)
+        self.assertEquals(c.chantypes, frozenset(['#', '&']))
+        self.assertEquals(c.unknown, {'CHARSET': 'ascii'})
+
+    def testFreeze(self):
+        """Frozen capabilities cannot be changed"""
+        c = scap.ServerCapabilities()
+        c.topiclen = 42
+        c.freeze()
+        self.assertRaises(AttributeError, setattr, c, 'topiclen', 5)
+        self.assertRaises(AttributeError, delattr, c, 'topiclen')
+        self.assertRaises(AttributeError, c.apply_isupport, ['NICKLEN=5'])
+        self.assertEquals(c.topiclen, 42)
+        self.assertEquals(c.nicklen, 9)
+
+    def testVersion(self):
+        """The version changes with the capabilities"""
+        c = scap.ServerCapabilities()
+        version = c.version
+        c.topiclen = 42
+        self.assert_(c.version > version)
+
+        # Transactions are a single change, and failed ones none.
+        versions = scap._versions
+        scap._versions = itertools.count(100)
+        try:
+            c.apply_isupport(['TOPICLEN=5', 'NICKLEN=30'])
+            self.assertEquals(c.version, 100)
+            c.apply_isupport(['TOPICLEN=6', 'FOO=bar', '-NICKLEN'])
+            self.assertEquals(c.version, 101)
+            self.assertEquals(c.unknown, {'FOO': 'bar'})
+            self.assertRaises(scap.CapabilityValueError, c.apply_isupport,
+                              ['TOPICLEN=7', 'BAR', 'NICKLEN=bleh'])
+            self.assertEquals(c.version, 101)
+            self.assertEquals(c.unknown, {'FOO': 'bar'})
+        finally:
+            scap._versions = versions
+
+        # Other capabilities never share a version with these.
+        d = scap.ServerCapabilities()
+        d.apply_isupport(['TOPICLEN=6', 'FOO=bar'])
+        self.assert_(d.version > c.version)
+
+    def testDerivedLookups(self):
+        """Lookups derived from the capabilities"""
+        c = scap.ServerCapabilities()
+        c.apply_isupport(['CHANTYPES=#&', 'PREFIX=(qohv)~@%+',
+                          'STATUSMSG=@+', 'TARGMAX=PRIVMSG:4,kick:1,NOTICE:'])
+        self.assert_(c.is_channel('#chan'))
+        self.failIf(c.is_channel('nick'))
+        self.failIf(c.is_channel(''))
+
+        self.assertEquals(c.prefix_order, '~@%+')
+        self.assertEquals(c.prefix_rank('~'), 0)
+        self.assertEquals(c.prefix_rank('+'), 3)
+        self.assertEquals(c.prefix_rank('#'), None)
+
+        self.assertEquals(c.split_statusmsg('@+#chan'), ('@+', '#chan'))
+        self.assertEquals(c.split_statusmsg('#chan'), ('', '#chan'))
+        self.assertEquals(c.split_statusmsg('+nick'), ('', '+nick'))
+
+        self.assertEquals(c.max_targets('privmsg'), 4)
+        self.assertEquals(c.max_targets('KICK'), 1)
+        self.assertEquals(c.max_targets('NOTICE'), 1000)
+        self.assertEquals(c.max_targets('JOIN'), None)
+
+        # Tables follow changes, even on frozen capabilities.
+        c.prefix = '(ov)@+'
+        self.assertEquals(c.prefix_order, '@+')
+        c.freeze()
+        self.assertEquals(c.prefix_rank('+'), 1)
+
+    def testMaxHostmaskLength(self):
+        """Hostmask length bounds"""
+        c = scap.ServerCapabilities()
+        c.apply_isupport(['NICKLEN=30', 'USERLEN=10', 'HOSTLEN=64'])
+        self.assertEquals(c.max_hostmask_length(), 30 + 1 + 11 + 1 + 64)
+        self.assertEquals(c.max_hostmask_length('me'), 2 + 1 + 11 + 1 + 64)
@@ -5,7 +5,36 @@
 import unittest
 from pmock import *
 
+import executor
+import profiles
 import server
+import state
+
+class _RecvIntoStub(object):
+    """pmock stub that fills the buffer given to recv_into()."""
+    def __init__(self, data):
+        self.data = data
+
+    def invoke(self, invocation):
+        buf = invocation.args[0]
+        buf[:len(self.data)] = self.data
+        return len(self.data)
+
+    def __str__(self):
+        return 'fill buffer with %r' % self.data
+
+
+class _ProfileCache(object):
+    """Stands in for a profile_cache.ProfileCache, without the file."""
+    def __init__(self, profiles):
+        self.profiles = profiles
+
+    def get(self, key):
+        return self.profiles.get(key)
+
+    def put(self, key, profile):
+        self.profiles[key] = profile
+
 
 # Test cases.
 class TestServer(unittest.TestCase):
@@ -14,6 +43,7 @@ class TestServer(unittest.TestCase):
         self.d = Mock()
 
         # Inject a fresh mock to replace the wireproto module
+        self.wireproto = server.wireproto
         server.wireproto = self.w
 
         def dispatcher_ctor(host, port, ext):
@@ -25,23 +55,151 @@ class TestServer(unittest.TestCase):
                                   'foo', _conn_class=dispatcher_ctor)
 
     def tearDown(self):
+        server.wireproto = self.wireproto
         self.w.verify()
         self.d.verify()
 
+    def _receive(self, data, conn=None):
+        # The dispatcher hands itself over for the protocol to read
+        # from.
+        self.d.expects(once()).recv_into(
+            functor(lambda buf: len(buf) >= len(data))).will(
+            _RecvIntoStub(data))
+        (conn or self.conn)._handle_read(self.d)
+
     def testServerSequence(self):
         """Server connection sequence"""
-        self.w.expects(once()).encode(eq('NICK'), eq('nick')).will(
-            return_value(1))
-        self.w.expects(once()).encode(
-            eq('USER'), eq('user'), eq('0'), eq('*'), eq('foo')).will(
-            return_value(2))
-
-        self.d.expects(once()).output(eq(1))
-        self.d.expects(once()).output(eq(2))
+        self.d.expects(once()).output(eq('NICK  :nick\r\n'))
+        self.d.expects(once()).output(eq('USER user 0 * :foo\r\n'))
 
         # We simulate the server event from the dispatcher ourselves.
         self.conn._handle_connect()
 
+        self.d.expects(once()).output(eq('PONG  :irc\r\n'))
+        self._receive(':irc 001 nick_ :Welcome\r\nPING :irc\r\n')
+        self.assertEquals(self.conn.nick, 'nick_')
+        self.assert_(self.conn.protocol.registered)
+
+    def testUnhandledCommandsAreNotDecoded(self):
+        """Unhandled commands are skipped before decoding"""
+        self._receive('PRIVMSG #a :hi\r\n')
+        self.assertEquals(self.conn.ignored_commands, 1)
+
+    def testCommandDispatch(self):
+        """Command handler dispatch"""
+        privmsgs, everything = [], []
+        self.conn.add_handler('privmsg', privmsgs.append)
+        self.conn.add_handler(None, everything.append)
+
+        self._receive(':a!b@c PRIVMSG #a :a\r\n')
+        self.conn.remove_handler('PRIVMSG', privmsgs.append)
+        self._receive(':a!b@c PRIVMSG #a :b\r\n')
+
+        self.assertEquals([m.args[1] for m in privmsgs], ['a'])
+        self.assertEquals([m.args[1] for m in everything], ['a', 'b'])
+        self.assertEquals(self.conn.ignored_commands, 0)
+
+    def testProfiles(self):
+        """Cached profiles are used until registration is over"""
+        cached = profiles.get(['CASEMAPPING=ascii', 'NICKLEN=30'])
+        cache = _ProfileCache({'host': cached})
+        s = server.Server('host', 1234, 'nick', 'user', profile_cache=cache,
+                          _conn_class=lambda host, port, ext: self.d)
+        self.assert_(s.profile is cached)
+        st = state.State(s.capabilities, 'nick')
+        st.attach(s)
+        changes = []
+        s.add_profile_handler(changes.append)
+
+        self._receive(':irc 005 nick CASEMAPPING=rfc1459 :are supported\r\n'
+                      ':nick!u@h JOIN #a[1]\r\n', s)
+        self.assert_(s.profile is cached)
+        self.assertEquals(st.get_channel('#a{1}'), None)
+
+        # The server's own tokens replace the cached ones at the end
+        # of the MOTD, and everyone follows.
+        self.w.expects(once()).encode(eq('QUIT')).will(
+            return_value('QUIT\r\n'))
+        self.d.expects(once()).output(eq('QUIT\r\n'))
+        self._receive(':irc 376 nick :End of MOTD\r\n', s)
+        new = profiles.get(['CASEMAPPING=rfc1459'])
+        self.assert_(s.profile is new)
+        self.assertEquals(changes, [new])
+        self.assert_(st.capabilities is s.capabilities)
+        self.assert_(st.modes.capabilities is s.capabilities)
+        self.assertEquals(st.get_channel('#a{1}').name, '#a[1]')
+        self.assert_(cache.get('host') is new)
+
+    def testFanout(self):
+        """Messages to many targets are coalesced per TARGMAX"""
+        self.conn.protocol.profile = profiles.get(['TARGMAX=PRIVMSG:4'])
+        for target in ('#a', '#b', '#A'):
+            self.w.expects(once())._utf8ize(eq(target)).will(
+                return_value(target))
+        self.w.expects(once()).encode_fanout(
+            eq('PRIVMSG'), eq(['#a', '#b']), eq('hi'), eq(4),
+            eq(self.conn.capabilities.max_hostmask_length('nick'))).will(
+            return_value(['PRIVMSG #a,#b :hi\r\n']))
+        self.d.expects(once()).output(eq('PRIVMSG #a,#b :hi\r\n'))
+        self.conn.fanout('PRIVMSG', ['#a', '#b', '#A'], 'hi')
+
+        # Unicode targets are encoded before being compared.
+        server.wireproto = self.wireproto
+        self.d.expects(once()).output(
+            eq('PRIVMSG #caf\xc3\xa9 :h\xc3\xa9\r\n'))
+        self.conn.fanout('PRIVMSG', [u'#caf\xe9', u'#CAF\xe9'], u'h\xe9')
+
+    def testFanoutHostmask(self):
+        """Fanout leaves room for our hostmask, however long"""
+        nick = 'n' * 30
+        hostmask = nick + '!~user@' + 'c' * 50
+        self._receive(':irc 001 %s :Welcome\r\n:%s JOIN #a\r\n' %
+                      (nick, hostmask))
+        self.assertEquals(self.conn.protocol.hostmask, hostmask)
+        self.w.expects(once())._utf8ize(eq('#a')).will(return_value('#a'))
+        self.w.expects(once()).encode_fanout(
+            eq('PRIVMSG'), eq(['#a']), eq('hi'), eq(1), eq(87)).will(
+            return_value(['PRIVMSG #a :hi\r\n']))
+        self.d.expects(once()).output(eq('PRIVMSG #a :hi\r\n'))
+        self.conn.fanout('PRIVMSG', ['#a'], 'hi')
+
+    def testOrderingKey(self):
+        """Blocking handlers are ordered by casemapped name"""
+        self.conn.protocol.profile = profiles.get(['CASEMAPPING=rfc1459'])
+        decode = self.wireproto.decode
+        self.assertEquals(
+            self.conn._ordering_key(decode(':a!b@c PRIVMSG #Foo[] :hi')),
+            self.conn._ordering_key(decode(':x!y@z PRIVMSG #fOO{} :hi')))
+        self.assertEquals(
+            self.conn._ordering_key(decode(':Dave[m]!b@c PRIVMSG me :hi')),
+            self.conn._ordering_key(decode(':dave{M}!y@z NOTICE me :hi')))
+
+    def testCloseHandlers(self):
+        """Close handlers run once the connection closes"""
+        closed = []
+        self.conn.add_close_handler(lambda: closed.append(True))
+        self.conn._handle_close()
+        self.assertEquals(closed, [True])
+
+    def testSharedExecutor(self):
+        """Servers sharing an executor are all woken up"""
+        e = executor.OrderedExecutor(workers=1)
+        d2 = Mock()
+        s2 = server.Server('host', 1234, 'nick', 'user', executor=e,
+                           _conn_class=lambda host, port, ext: d2)
+        self.conn._use_executor(e)
+        self.assert_(s2.executor is e)
+
+        self.d.expects(once()).wakeup()
+        d2.expects(once()).wakeup()
+        e.call_in_loop(lambda: None)
+        d2.verify()
+
+        s2._handle_close()
+        self.d.expects(once()).wakeup()
+        e.call_in_loop(lambda: None)
+        e.shutdown()
+
 
 class Test_ConnectionDispatcher(unittest.TestCase):
     def setUp(self):
@@ -56,6 +214,7 @@ class Test_ConnectionDispatcher(unittest.TestCase):
 
         self.handler = Mock()
         self.handler.expects(once())._handle_connect()
+        self.handler.stubs()._handle_tick()
         self.dispatcher = server._ConnectionDispatcher(
             '', 0, self.handler, ext_sock=self.sock)
         # Asyncore would call this handler on a real connect, but we
@@ -67,35 +226,24 @@ class Test_ConnectionDispatcher(unittest.TestCase):
         self.handler.verify()
 
     def _sock_read(self, data):
-        self.sock.expects(once()).recv(eq(8192)).will(return_value(data))
+        self.sock.expects(once()).recv_into(
+            functor(lambda buf: len(buf) >= len(data))).will(
+            _RecvIntoStub(data))
 
     def _sock_write(self, expected_data, amount_written):
         self.sock.expects(once()).send(eq(expected_data)).will(
             return_value(amount_written))
 
-    def _handle_command(self, cmd):
-        self.handler.expects(once())._handle_command(eq(cmd))
-
-    def testDispatcherReadsMessages(self):
-        """Dispatcher message reading"""
-        self._sock_read('a\r\n')
-        self._handle_command('a')
+    def testDispatcherReads(self):
+        """Dispatcher hands reads over to the handler"""
+        self.handler.expects(once())._handle_read(same(self.dispatcher))
         self.dispatcher.handle_read()
 
-        self._sock_read('bc\r\n')
-        self._handle_command('bc')
-        self.dispatcher.handle_read()
-
-        # Fragmented packet. Confusingly, pmock requires us to set
-        # expectations in reverse order for them to be found correctly.
-        self._sock_read('\nef\r\n')
-        self._sock_read('cd\r')
-        self._sock_read('ab')
-        self._handle_command('ef')
-        self._handle_command('abcd')
-        self.dispatcher.handle_read()
-        self.dispatcher.handle_read()
-        self.dispatcher.handle_read()
+        # An empty read means the server closed the connection.
+        self._sock_read('')
+        self.sock.expects(once()).close()
+        self.handler.expects(once())._handle_close()
+        self.assertEquals(self.dispatcher.recv_into(bytearray(10)), 0)
 
     def testDispatcherWritesOutput(self):
         """Dispatcher message writing"""
@@ -110,3 +258,13 @@ class Test_ConnectionDispatcher(unittest.TestCase):
         self.dispatcher.handle_write()
         self.dispatcher.handle_write()
         self.dispatcher.handle_write()
+        self.assert_(not self.dispatcher.writable())
+
+    def testDispatcherWritesBatches(self):
+        """Dispatcher batch message writing"""
+        self._sock_write('PONG  :a\r\n', 10)
+        self._sock_write('QUIT\r\nPONG  :a\r\n', 6)
+        self.dispatcher.output_many([('quit',), ('pong', 'a')])
+        self.dispatcher.handle_write()
+        self.dispatcher.handle_write()
+        self.assert_(not self.dispatcher.writable())
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+#
+# Tracks the channels we are on, and who is on them.
+#
+# Channels and users are indexed by their casemapped names, which are
+# interned so that a user on many channels shares a single key
+# string. Every user knows its channels, so that NICK and QUIT only
+# touch the channels of the user concerned.
+
+import codes
+import modes
+
+class Channel(object):
+    """A channel we are on."""
+    __slots__ = ('name', 'members', 'synced')
+
+    def __init__(self, name):
+        self.name = name
+        # Casemapped nick -> prefix characters of the member, most
+        # powerful first (e.g. '@+').
+        self.members = {}
+        # Whether the initial NAMES list has been received.
+        self.synced = False
+
+
+class User(object):
+    """A user sharing at least one channel with us."""
+    __slots__ = ('nick', 'user', 'host', 'channels')
+
+    def __init__(self, nick, user=None, host=None):
+        self.nick = nick
+        self.user = user
+        self.host = host
+        # Casemapped names of the user's channels.
+        self.channels = set()
+
+
+class State(object):
+    """Channel and membership state of a connection.
+
+    Feed it messages with handle_message(), or let attach() hook it up
+    to a Server. capabilities is the ServerCapabilities of the
+    connection, and nick our own nick. Names are compared according
+    to the capabilities' casemapping.
+    """
+    def __init__(self, capabilities, nick):
+        self.capabilities = capabilities
+        self.nick = nick
+        self._set_casemapper(capabilities.casemapper)
+        self.modes = modes.ModeParser(capabilities)
+        self.channels = {}
+        self.users = {}
+
+        self._handlers = {
+            codes.RPL_WELCOME: self._handle_welcome,
+            'JOIN': self._handle_join,
+            'PART': self._handle_part,
+            'KICK': self._handle_kick,
+            'QUIT': self._handle_quit,
+            'NICK': self._handle_nick,
+            'MODE': self._handle_mode,
+            codes.RPL_NAMREPLY: self._handle_namreply,
+            codes.RPL_ENDOFNAMES: self._handle_endofnames,
+            }
+
+    def attach(self, server):
+        """Register with server for the messages we track.
+
+        The server's capabilities are followed when it replaces them.
+        """
+        for code in self._handlers:
+            server.add_handler(code, self.handle_message)
+        server.add_profile_handler(self._handle_profile)
+        self.set_capabilities(server.capabilities)
+
+    def handle_message(self, msg):
+        handler = self._handlers.get(msg.code)
+        if handler is not None:
+            handler(msg)
+
+    def set_capabilities(self, capabilities):
+        """Switch to other ServerCapabilities.
+
+        Names are re-keyed if the casemapping changes.
+        """
+        self.capabilities = capabilities
+        self.modes.capabilities = capabilities
+        self._update_casemapper()
+
+    def _set_casemapper(self, casemapper):
+        self.casemapper = casemapper
+        self.casefold = casemapper.casefold
+        self._key = casemapper.key
+
+    #
+    # Queries
+    #
+    def get_channel(self, name):
+        """Return the Channel called name, or None."""
+        return self.channels.get(self.casefold(name))
+
+    def get_user(self, nick):
+        """Return the User called nick, or None."""
+        return self.users.get(self.casefold(nick))
+
+    def member_prefixes(self, channel, nick):
+        """Return the prefixes of nick on channel, or None if not there."""
+        chan = self.get_channel(channel)
+        if chan is None:
+            return None
+        return chan.members.get(self.casefold(nick))
+
+    def is_us(self, nick):
+        return self.casefold(nick) == self.casefold(self.nick)
+
+    #
+    # State changes
+    #
+    def _add_member(self, chankey, nick, prefixes='', user=None, host=None):
+        key = self._key(nick)
+        u = self.users.get(key)
+        if u is None:
+            u = self.users[key] = User(nick, user, host)
+        elif host is not None:
+            u.user, u.host = user, host
+        u.channels.add(chankey)
+        self.channels[chankey].members[key] = intern(prefixes)
+
+    def _remove_member(self, chankey, nickkey):
+        chan = self.channels.get(chankey)
+        if chan is None:
+            return
+        chan.members.pop(nickkey, None)
+        u = self.users.get(nickkey)
+        if u is not None:
+            u.channels.discard(chankey)
+            if not u.channels:
+                del self.users[nickkey]
+
+    def _forget_channel(self, chankey):
+        chan = self.channels.pop(chankey, None)
+        if chan is None:
+            return
+        for nickkey in chan.members:
+            u = self.users.get(nickkey)
+            if u is not None:
+                u.channels.discard(chankey)
+                if not u.channels:
+                    del self.users[nickkey]
+
+    def _handle_welcome(self, msg):
+        self.nick = msg.args[0]
+
+    def _handle_profile(self, profile):
+        self.set_capabilities(profile.capabilities)
+
+    def _update_casemapper(self):
+        casemapper = self.capabilities.casemapper
+        if casemapper is self.casemapper:
+            return
+        # The casemapping changed, so everything has to be re-keyed.
+        self._set_casemapper(casemapper)
+        key = self._key
+        users = dict((key(u.nick), u) for u in self.users.itervalues())
+        channels, chankeys = {}, {}
+        for oldkey, chan in self.channels.iteritems():
+            newkey = chankeys[oldkey] = key(chan.name)
+            chan.members = dict((key(self.users[n].nick), prefixes)
+                                for n, prefixes in chan.members.iteritems())
+            channels[newkey] = chan
+        for u in users.itervalues():
+            u.channels = set(chankeys[c] for c in u.channels)
+        self.users, self.channels = users, channels
+
+    def _handle_join(self, msg):
+        key = self._key(msg.args[0])
+        if key not in self.channels:
+            if not self.is_us(msg.nick):
+                return
+            self.channels[key] = Channel(msg.args[0])
+        self._add_member(key, msg.nick, user=msg.user, host=msg.host)
+
+    def _handle_part(self, msg):
+        key = self._key(msg.args[0])
+        if self.is_us(msg.nick):
+            self._forget_channel(key)
+        else:
+            self._remove_member(key, self._key(msg.nick))
+
+    def _handle_kick(self, msg):
+        key = self._key(msg.args[0])
+        if self.is_us(msg.args[1]):
+            self._forget_channel(key)
+        else:
+            self._remove_member(key, self._key(msg.args[1]))
+
+    def _handle_quit(self, msg):
+        nickkey = self._key(msg.nick)
+        u = self.users.pop(nickkey, None)
+        if u is None:
+            return
+        for chankey in u.channels:
+            self.channels[chankey].members.pop(nickkey, None)
+
+    def _handle_nick(self, msg):
+        old, new = self._key(msg.nick), self._key(msg.args[0])
+        if self.is_us(msg.nick):
+            self.nick = msg.args[0]
+        u = self.users.pop(old, None)
+        if u is None:
+            return
+        u.nick = msg.args[0]
+        self.users[new] = u
+        for chankey in u.channels:
+            members = self.channels[chankey].members
+            members[new] = members.pop(old)
+
+    def _handle_mode(self, msg):
+        chan = self.channels.get(self._key(msg.args[0]))
+        if chan is None:
+            return
+        caps = self.capabilities
+        for adding, mode, param in self.modes.parse(msg.args[1:]):
+            if param is None or mode not in caps.prefix:
+                continue
+            key = self._key(param)
+            prefixes = chan.members.get(key)
+            if prefixes is None:
+                continue
+            prefix = caps.prefix[mode]
+            if adding:
+                if prefix in prefixes:
+                    continue
+                prefixes += prefix
+            else:
+                prefixes = prefixes.replace(prefix, '')
+            # Keep the most powerful prefix first.
+            chan.members[key] = intern(
+                ''.join(p for p in caps.prefix_order if p in prefixes))
+
+    def _handle_namreply(self, msg):
+        # The channel type symbol is missing on RFC 1459 servers.
+        key = self._key(msg.args[-2])
+        if key not in self.channels:
+            return
+        prefixes = self.capabilities.prefix_order
+        for name in msg.args[-1].split():
+            # Servers supporting multi-prefix may send several.
+            i = 0
+            while i < len(name) and name[i] in prefixes:
+                i += 1
+            self._add_member(key, name[i:], name[:i])
+
+    def _handle_endofnames(self, msg):
+        chan = self.channels.get(self._key(msg.args[1]))
+        if chan is not None:
+            chan.synced = True
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for state
+
+import unittest
+import profiles
+import server_capabilities
+import state
+import wireproto
+
+class TestState(unittest.TestCase):
+    def setUp(self):
+        self.caps = server_capabilities.ServerCapabilities()
+        self.s = state.State(self.caps, 'me')
+
+    def feed(self, *lines):
+        for line in lines:
+            msg = wireproto.decode(line)
+            if msg.code == 5:
+                for cap in msg.args[1:-1]:
+                    self.caps.setCapability(cap)
+                self.s.set_capabilities(self.caps)
+            self.s.handle_message(msg)
+
+    def members(self, channel):
+        return self.s.get_channel(channel).members
+
+    def testJoinAndNames(self):
+        """Joining channels and receiving NAMES"""
+        self.feed(':irc 001 Me :Welcome',
+                  ':Me!me@host JOIN #Foo',
+                  ':irc 353 Me = #foo :@Me +Alice @+Bob carol',
+                  ':irc 366 Me #foo :End of /NAMES list.')
+        chan = self.s.get_channel('#FOO')
+        self.assertEquals(chan.name, '#Foo')
+        self.assert_(chan.synced)
+        self.assertEquals(chan.members, {'me': '@', 'alice': '+',
+                                         'bob': '@+', 'carol': ''})
+        self.assertEquals(self.s.member_prefixes('#foo', 'BOB'), '@+')
+        self.assertEquals(self.s.member_prefixes('#foo', 'dave'), None)
+        self.assertEquals(self.s.member_prefixes('#bar', 'bob'), None)
+
+        # Other users joining.
+        self.feed(':Dave!dave@example.com JOIN #foo')
+        self.assertEquals(self.members('#foo')['dave'], '')
+        dave = self.s.get_user('dave')
+        self.assertEquals((dave.nick, dave.user, dave.host),
+                          ('Dave', 'dave', 'example.com'))
+
+        # Joins to channels we're not on are ignored.
+        self.feed(':Dave!dave@example.com JOIN #bar')
+        self.assertEquals(self.s.get_channel('#bar'), None)
+
+    def testDepartures(self):
+        """Users leaving channels"""
+        self.feed(':me!me@host JOIN #a',
+                  ':me!me@host JOIN #b',
+                  ':irc 353 me = #a :me alice bob carol',
+                  ':irc 353 me = #b :me alice bob')
+        self.assertEquals(self.s.get_user('alice').channels,
+                          set(['#a', '#b']))
+
+        self.feed(':alice!a@h PART #a :bye')
+        self.assert_('alice' not in self.members('#a'))
+        self.assertEquals(self.s.get_user('alice').channels, set(['#b']))
+
+        self.feed(':bob!b@h KICK #b carol :out')
+        self.feed(':bob!b@h KICK #a carol :out')
+        self.assertEquals(self.s.get_user('carol'), None)
+
+        self.feed(':bob!b@h QUIT :gone')
+        self.assertEquals(self.s.get_user('bob'), None)
+        self.assertEquals(sorted(self.members('#a')), ['me'])
+        self.assertEquals(sorted(self.members('#b')), ['alice', 'me'])
+
+        # When we leave, the channel is forgotten, along with the
+        # users we don't see anymore.
+        self.feed(':me!me@host PART #b')
+        self.assertEquals(self.s.get_channel('#b'), None)
+        self.assertEquals(self.s.get_user('alice'), None)
+        self.feed(':op!op@h KICK #a me :bye')
+        self.assertEquals(self.s.channels, {})
+        self.assertEquals(self.s.users, {})
+
+    def testNickChange(self):
+        """Nick changes"""
+        self.feed(':me!me@host JOIN #a',
+                  ':me!me@host JOIN #b',
+                  ':irc 353 me = #a :me @alice',
+                  ':irc 353 me = #b :me +alice')
+        self.feed(':alice!a@h NICK :Alicia')
+        self.assertEquals(self.s.get_user('alice'), None)
+        self.assertEquals(self.s.get_user('alicia').nick, 'Alicia')
+        self.assertEquals(self.members('#a')['alicia'], '@')
+        self.assertEquals(self.members('#b')['alicia'], '+')
+
+        self.feed(':me!me@host NICK :myself')
+        self.assertEquals(self.s.nick, 'myself')
+        self.assertEquals(sorted(self.members('#a')), ['alicia', 'myself'])
+
+    def testInterning(self):
+        """Member keys are shared between indexes"""
+        self.feed(':me!me@host JOIN #a',
+                  ':me!me@host JOIN #b',
+                  ':irc 353 me = #a :Alice',
+                  ':irc 353 me = #b :ALICE')
+        keys = [k for k in self.members('#a') if k == 'alice']
+        keys += [k for k in self.members('#b') if k == 'alice']
+        keys += [k for k in self.s.users if k == 'alice']
+        self.assert_(keys[0] is keys[1] is keys[2])
+
+    def testCasemapping(self):
+        """Names are compared with the server's casemapping"""
+        self.feed(':me!me@host JOIN #a[1]',
+                  ':irc 353 me = #a[1] :[Alice] {Bob}')
+        # RFC 1459 casemapping by default.
+        self.assertEquals(self.s.get_channel('#a{1}').name, '#a[1]')
+        self.assertEquals(self.s.get_user('{alice}').channels, set(['#a{1}']))
+
+        self.feed(':irc 005 me CASEMAPPING=ascii :are supported')
+        self.assertEquals(self.s.get_channel('#a{1}'), None)
+        self.assertEquals(self.s.get_channel('#A[1]').name, '#a[1]')
+        self.assertEquals(self.members('#A[1]'),
+                          {'[alice]': '', '{bob}': '', 'me': ''})
+        self.feed(':[alice]!a@h PART #a[1]')
+        self.assertEquals(self.members('#A[1]'), {'{bob}': '', 'me': ''})
+
+    def testModes(self):
+        """Prefix changes through MODE"""
+        self.feed(':irc 005 me PREFIX=(qohv)~@%+ CHANMODES=beI,k,l,imnt :ok',
+                  ':me!me@host JOIN #a',
+                  ':irc 353 me = #a :@me +alice bob')
+        self.feed(':me!me@host MODE #a +ovbl-k+h alice bob *!*@x 10 key bob')
+        self.assertEquals(self.members('#a'),
+                          {'me': '@', 'alice': '@+', 'bob': '%+'})
+        self.feed(':me!me@host MODE #a -v+q-o alice alice alice')
+        self.assertEquals(self.members('#a')['alice'], '~')
+
+    def testAttach(self):
+        """Attached states follow the server's capabilities"""
+        class FakeServer(object):
+            capabilities = self.caps
+            def add_handler(self, command, handler):
+                pass
+            def add_profile_handler(self, handler):
+                self.profile_handler = handler
+        server = FakeServer()
+        self.s.attach(server)
+        self.feed(':me!me@host JOIN #a[1]')
+
+        profile = profiles.get(['CASEMAPPING=ascii'])
+        server.profile_handler(profile)
+        self.assert_(self.s.capabilities is profile.capabilities)
+        self.assert_(self.s.modes.capabilities is profile.capabilities)
+        self.assertEquals(self.s.get_channel('#A[1]').name, '#a[1]')
+        self.assertEquals(self.s.get_channel('#a{1}'), None)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Spreads Server connections over several worker processes.
+#
+# Decoding and dispatch are CPU bound, so a single process tops out
+# at one core. The Supervisor shards connections over worker
+# processes, each running a ConnectionManager, and restarts workers
+# that crash. Workers forward the messages they receive to the
+# supervisor as compact marshalled tuples over a pipe.
+
+import marshal
+import multiprocessing
+import select
+import time
+import zlib
+
+import manager
+
+def _worker_main(specs, pipe, commands):
+    """Entry point of worker processes."""
+    m = manager.ConnectionManager()
+
+    def make_setup(conn_id):
+        def forward(msg):
+            pipe.send_bytes(marshal.dumps(
+                (conn_id, msg.code, msg.hostmask, msg.args)))
+        def setup(s):
+            for command in commands:
+                s.add_handler(command, forward)
+        return setup
+
+    for conn_id, host, port, nick, user, realname in specs:
+        m.add_server(host, port, nick, user, realname,
+                     setup=make_setup(conn_id))
+    m.run()
+
+
+class Supervisor(object):
+    """Runs connections in a pool of worker processes.
+
+    on_event is called in the supervisor process as
+    on_event(conn_id, code, hostmask, args) for every message
+    received by a worker connection, where code is the command code
+    (see the codes module). Only the given commands are forwarded,
+    and passing None forwards everything.
+
+    Workers that exit with an error are restarted after
+    restart_delay seconds, with all their connections.
+    """
+    def __init__(self, workers, on_event, commands=(None,),
+                 restart_delay=1.0):
+        self.num_workers = workers
+        self.on_event = on_event
+        self.commands = tuple(commands)
+        self.restart_delay = restart_delay
+        self.restarts = 0
+
+        self._specs = [[] for _ in xrange(workers)]
+        self._num_specs = 0
+        # (process, pipe) for each running worker, by shard.
+        self._workers = {}
+        # Time at which to restart crashed workers, by shard.
+        self._restart_at = {}
+
+    def shard(self, key):
+        """Return the worker shard for a connection's shard key."""
+        return (zlib.crc32(key) & 0xffffffff) % self.num_workers
+
+    def add_server(self, host, port, nick, user, realname='nobody',
+                   shard_key=None):
+        """Add a connection, before calling start().
+
+        Connections with the same shard_key, which defaults to the
+        host, run in the same worker. Returns the connection id
+        given to on_event.
+        """
+        conn_id = self._num_specs
+        self._num_specs += 1
+        if shard_key is None:
+            shard_key = host
+        self._specs[self.shard(shard_key)].append(
+            (conn_id, host, port, nick, user, realname))
+        return conn_id
+
+    def pid(self, shard):
+        """Process id of the worker running shard, or None."""
+        if shard not in self._workers:
+            return None
+        return self._workers[shard][0].pid
+
+    def start(self):
+        """Start a worker for each shard that has connections."""
+        for shard, specs in enumerate(self._specs):
+            if specs:
+                self._spawn(shard)
+
+    def _spawn(self, shard):
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+            target=_worker_main,
+            args=(self._specs[shard], writer, self.commands))
+        process.daemon = True
+        process.start()
+        writer.close()
+        self._workers[shard] = (process, reader)
+
+    def _reap(self, shard):
+        process, pipe = self._workers.pop(shard)
+        pipe.close()
+        process.join()
+        if process.exitcode != 0:
+            self._restart_at[shard] = time.time() + self.restart_delay
+
+    def run_once(self, timeout=None):
+        """Wait at most timeout seconds for events, and dispatch them."""
+        now = time.time()
+        for shard, when in self._restart_at.items():
+            if when <= now:
+                del self._restart_at[shard]
+                self.restarts += 1
+                self._spawn(shard)
+            else:
+                delay = when - now
+                if timeout is None or delay < timeout:
+                    timeout = delay
+
+        pipes = dict((pipe.fileno(), shard)
+                     for shard, (_, pipe) in self._workers.iteritems())
+        try:
+            readable = select.select(pipes.keys(), [], [], timeout)[0]
+        except select.error:
+            return
+        for fd in readable:
+            shard = pipes[fd]
+            pipe = self._workers[shard][1]
+            try:
+                while pipe.poll():
+                    self.on_event(*marshal.loads(pipe.recv_bytes()))
+            except EOFError:
+                self._reap(shard)
+
+    def run(self):
+        """Run until all workers have exited cleanly."""
+        while self._workers or self._restart_at:
+            self.run_once()
+
+    def stop(self):
+        """Terminate all workers."""
+        self._restart_at.clear()
+        for shard in self._workers.keys():
+            process, pipe = self._workers.pop(shard)
+            process.terminate()
+            process.join()
+            pipe.close()
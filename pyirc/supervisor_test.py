@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# Unit tests for supervisor
+
+import os
+import signal
+import socket
+import time
+import unittest
+import supervisor
+
+class TestSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.listener.settimeout(5)
+        self.port = self.listener.getsockname()[1]
+        self.peers = []
+        self.events = []
+        self.s = supervisor.Supervisor(2, self.on_event,
+                                       commands=('PRIVMSG',),
+                                       restart_delay=0.01)
+
+    def tearDown(self):
+        self.s.stop()
+        for peer in self.peers:
+            peer.close()
+        self.listener.close()
+
+    def on_event(self, *event):
+        self.events.append(event)
+
+    def accept(self, line):
+        peer, _ = self.listener.accept()
+        peer.sendall(line)
+        self.peers.append(peer)
+
+    def waitEvents(self, count):
+        deadline = time.time() + 5
+        while len(self.events) < count and time.time() < deadline:
+            self.s.run_once(0.1)
+        self.assertEquals(len(self.events), count)
+
+    def testSharding(self):
+        """Connections are spread over workers"""
+        a = self.s.add_server('127.0.0.1', self.port, 'a', 'user',
+                              shard_key='freenode')
+        b = self.s.add_server('127.0.0.1', self.port, 'b', 'user',
+                              shard_key='net1')
+        self.assertNotEquals(self.s.shard('freenode'), self.s.shard('net1'))
+        self.s.start()
+        self.assertNotEquals(self.s.pid(0), self.s.pid(1))
+
+        self.accept(':x!y@z PRIVMSG #a :hello\r\nPING :foo\r\n')
+        self.accept(':x!y@z PRIVMSG #a :hello\r\nPING :foo\r\n')
+        self.waitEvents(2)
+        self.assertEquals(sorted(self.events),
+                          [(a, 'PRIVMSG', 'x!y@z', ['#a', 'hello']),
+                           (b, 'PRIVMSG', 'x!y@z', ['#a', 'hello'])])
+
+    def testRestart(self):
+        """Crashed workers are restarted"""
+        self.s.add_server('127.0.0.1', self.port, 'a', 'user')
+        self.s.start()
+        shard = self.s.shard('127.0.0.1')
+        self.accept(':x!y@z PRIVMSG #a :one\r\n')
+        self.waitEvents(1)
+
+        os.kill(self.s.pid(shard), signal.SIGKILL)
+        deadline = time.time() + 5
+        while not self.s.restarts and time.time() < deadline:
+            self.s.run_once(0.1)
+        self.assertEquals(self.s.restarts, 1)
+        self.accept(':x!y@z PRIVMSG #a :two\r\n')
+        self.waitEvents(2)
@@ -3,6 +3,8 @@
 # Handles both encoding and decoding of messages in the IRC line-based
 # format.
 
+import codes
+
 class EncodeArgumentError(Exception):
     """Given arguments cannot be encoded as an IRC message."""
 
@@ -12,47 +14,301 @@ def _utf8ize(data):
     else:
         return data
 
+def _command_token(command):
+    # Known commands come out of the codes table already upper-cased
+    # and interned.
+    return codes.command_name(codes.command_code(command))
+
+def _encode_args(args):
+    args = [_utf8ize(x) for x in args]
+    for arg in args[:-1]:
+        if ' ' in arg:
+            raise EncodeArgumentError
+    return args
+
 def encode(command, *args):
-    command = command.upper()
+    command = _command_token(command)
     if len(args) == 0:
         return '%s\r\n' % command
     else:
-        args = [_utf8ize(x) for x in args]
-        for arg in args[:-1]:
-            if ' ' in arg:
-                raise EncodeArgumentError
-        return '%s %s :%s\r\n' % (command.upper(),
+        args = _encode_args(args)
+        return '%s %s :%s\r\n' % (command,
                                   ' '.join(args[:-1]),
                                   args[-1])
 
+def encode_into(buf, command, *args):
+    """Append the encoding of a message to buf, a bytearray.
+
+    The output is the same as encode(command, *args). Nothing is
+    appended if the arguments cannot be encoded.
+    """
+    command = _command_token(command)
+    if len(args) == 0:
+        buf += command
+    else:
+        args = _encode_args(args)
+        buf += command
+        buf += ' '
+        for i in xrange(len(args) - 1):
+            if i:
+                buf += ' '
+            buf += args[i]
+        buf += ' :'
+        buf += args[-1]
+    buf += '\r\n'
+
+def encode_many(messages, buf=None):
+    """Encode many messages into a single buffer.
+
+    messages is an iterable of (command, arg1, arg2...) tuples. They
+    are appended to buf if given, or to a new bytearray. Returns the
+    buffer.
+
+    If a message cannot be encoded, EncodeArgumentError is raised
+    and buf holds the messages that preceded it.
+    """
+    if buf is None:
+        buf = bytearray()
+    for message in messages:
+        encode_into(buf, *message)
+    return buf
+
+# Maximum length of an IRC line, CR LF included.
+MAX_LINE_LENGTH = 512
+
+# Room taken by our hostmask when we know nothing about it. Most
+# networks allow nicks of 30 characters or more, users get a ~ in
+# front of their ident, and cloaked hosts go up to the 63 characters
+# of a host name.
+_UNKNOWN_HOSTMASK_LENGTH = 32 + 1 + 1 + 10 + 1 + 63
+
+def _is_continuation(byte):
+    return '\x80' <= byte <= '\xbf'
+
+def _split_text(text, budget, words):
+    """Cut text in chunks of at most budget bytes.
+
+    Chunks never end in the middle of a UTF-8 character, and with
+    words they end at a space where possible, the space being dropped.
+    """
+    chunks = []
+    start, end = 0, len(text)
+    while end - start > budget:
+        cut = start + budget
+        # A UTF-8 character is at most 4 bytes long.
+        for _ in xrange(3):
+            if not _is_continuation(text[cut]):
+                break
+            cut -= 1
+        if words:
+            space = text.rfind(' ', start, cut + 1)
+            if space > start:
+                chunks.append(text[start:space])
+                start = space + 1
+                continue
+        chunks.append(text[start:cut])
+        start = cut
+    chunks.append(text[start:])
+    return chunks
+
+def encode_split(command, target, text, hostmask=None):
+    """Encode a message, split into as many lines as it takes.
+
+    The server relays the message to others with our hostmask
+    (nick!user@host) in front of it, and truncates it to
+    MAX_LINE_LENGTH. text is split so that every relayed line fits.
+    hostmask is our hostmask, or a bound of its length (see
+    ServerCapabilities.max_hostmask_length), and a long one is
+    assumed if it isn't given. Lines are split between words where
+    that doesn't cost more lines, and never in the middle of a UTF-8
+    character.
+
+    Returns the list of encoded lines.
+    """
+    command = _command_token(command)
+    target = _utf8ize(target)
+    chunks = _split_relayed(command, len(target), _utf8ize(text), hostmask)
+    return [encode(command, target, chunk) for chunk in chunks]
+
+def _split_relayed(command, target_length, text, hostmask):
+    """Split text so that it fits in relayed lines, see encode_split."""
+    if hostmask is None:
+        prefix_length = _UNKNOWN_HOSTMASK_LENGTH
+    elif isinstance(hostmask, (int, long)):
+        prefix_length = hostmask
+    else:
+        prefix_length = len(hostmask)
+    # ':hostmask COMMAND target :text\r\n'
+    budget = (MAX_LINE_LENGTH - prefix_length - len(command) - target_length
+              - len(': ') - len(' ') - len(' :') - len('\r\n'))
+    if budget < 4:
+        raise EncodeArgumentError('No room left for the text')
+    chunks = _split_text(text, budget, words=True)
+    if len(chunks) > 1:
+        tight = _split_text(text, budget, words=False)
+        if len(tight) < len(chunks):
+            chunks = tight
+    return chunks
+
+def encode_fanout(command, targets, text, max_targets=1, hostmask=None):
+    """Encode a message sent to many targets in as few lines as possible.
+
+    Targets are sent to in groups of at most max_targets, as a comma
+    separated list, as long as the line fits in MAX_LINE_LENGTH.
+    Long texts are split as by encode_split(), and each group gets all
+    the parts in order.
+
+    Returns the list of encoded lines.
+    """
+    command = _command_token(command)
+    targets = [_utf8ize(t) for t in targets]
+    if not targets:
+        return []
+    chunks = _split_relayed(command, max(len(t) for t in targets),
+                            _utf8ize(text), hostmask)
+    # 'COMMAND targets :text\r\n', with the longest part of the text.
+    room = (MAX_LINE_LENGTH - len(command) - max(len(c) for c in chunks)
+            - len(' ') - len(' :') - len('\r\n'))
+
+    lines = []
+    group, length = [], -1
+    for target in targets:
+        if group and (len(group) >= max_targets or
+                      length + 1 + len(target) > room):
+            lines.extend(encode(command, ','.join(group), chunk)
+                         for chunk in chunks)
+            group, length = [], -1
+        group.append(target)
+        length += 1 + len(target)
+    lines.extend(encode(command, ','.join(group), chunk) for chunk in chunks)
+    return lines
+
+def _command_bounds(message, start, end):
+    """Locate the command token in message[start:end].
+
+    Returns (cmd_start, cmd_end), the offsets of the token.
+    """
+    # Skip over the message prefix
+    if message.startswith(':', start, end):
+        start = message.find(' ', start, end)
+        if start == -1:
+            return end, end
+    while message.startswith(' ', start, end):
+        start += 1
+    cmd_end = message.find(' ', start, end)
+    if cmd_end == -1:
+        cmd_end = end
+    return start, cmd_end
+
+# Message attributes, grouped by the parsing step that fills them in.
+_PREFIX_FIELDS = frozenset(('hostmask', 'nick', 'user', 'host'))
+_ARGS_FIELDS = frozenset(('args', 'colon_arg'))
+
 class Message(object):
-    hostmask = None
-    nick = None
-    user = None
-    host = None
-
-    command = None
-    args = None
-    colon_arg = False
-
-    def __init__(self, message):
-        # Process the message prefix
-        if message.startswith(':'):
-            hostmask, message = message.split(None, 1)
-            hostmask = hostmask[1:]
-            self.hostmask = hostmask
-            if '!' in hostmask:
-                self.nick, hostmask = hostmask.split('!', 1)
-            if '@' in hostmask:
-                self.user, hostmask = hostmask.split('@', 1)
-            self.host = hostmask
+    """A decoded IRC message.
+
+    Only the location of the command is worked out on construction.
+    The prefix, command and arguments are parsed on first access to
+    one of the corresponding attributes, and cached in slots.
 
+    code is the command's code from the codes registry, and
+    command its canonical token.
+    """
+    __slots__ = ('_message', '_start', '_cmd_start', '_cmd_end', '_end',
+                 'hostmask', 'nick', 'user', 'host',
+                 'code', 'command', 'args', 'colon_arg')
+
+    def __init__(self, message, start=0, end=None):
+        """Wrap message[start:end] as an IRC message.
+
+        The line terminator must already have been stripped. message
+        is referenced, not copied, so it must not be mutated.
+        """
+        if end is None:
+            end = len(message)
+        self._message = message
+        self._start = start
+        self._end = end
+        self._cmd_start, self._cmd_end = _command_bounds(message, start, end)
+
+    def __getattr__(self, name):
+        # Only called for slots that haven't been filled in yet.
+        if name in _PREFIX_FIELDS:
+            self._parse_prefix()
+        elif name == 'code':
+            self.code = codes.command_code(
+                self._message[self._cmd_start:self._cmd_end])
+        elif name == 'command':
+            self.command = codes.command_name(self.code)
+        elif name in _ARGS_FIELDS:
+            self._parse_args()
+        else:
+            raise AttributeError(name)
+        return object.__getattribute__(self, name)
+
+    # Messages are shared with handlers running on other threads, so
+    # the parsers only ever assign the final value of a slot. Two
+    # threads may both parse, but neither sees a half-parsed message.
+    def _parse_prefix(self):
+        hostmask = nick = user = host = None
+        message, start = self._message, self._start
+        if message.startswith(':', start, self._end):
+            hostmask = host = message[start+1:self._cmd_start].rstrip()
+            if '!' in host:
+                nick, host = host.split('!', 1)
+            if '@' in host:
+                user, host = host.split('@', 1)
+        self.hostmask = hostmask
+        self.nick = nick
+        self.user = user
+        self.host = host
+
+    def _parse_args(self):
         # Locate the start of the final argument, if any, and split it
         # off. It is multispace and is annoying to process otherwise.
-        message = message.split(' :', 1)
-        self.colon_arg = (len(message) > 1)
-        message[:1] = message[0].strip().split()
-        self.command, self.args = message[0].upper(), message[1:]
+        message, start, end = self._message, self._cmd_end, self._end
+        colon = message.find(' :', start, end)
+        if colon == -1:
+            args = message[start:end].split()
+            colon_arg = False
+        else:
+            args = message[start:colon].split()
+            args.append(message[colon+2:end])
+            colon_arg = True
+        self.args = args
+        self.colon_arg = colon_arg
+
+def sniff_command(message):
+    """Return the command code of message, without decoding it."""
+    start, end = _command_bounds(message, 0, len(message))
+    return codes.command_code(message[start:end])
 
 def decode(message):
     return Message(message)
+
+def decode_many(buffer, start=0):
+    """Decode all complete lines found in buffer.
+
+    buffer can be a string, bytearray or anything else that supports
+    the buffer interface. Lines are terminated by '\r\n' or a bare
+    '\n', and empty lines are skipped.
+
+    Returns a (messages, offset) tuple, where offset is the start of
+    the unconsumed tail of buffer, the last partial line.
+    """
+    if not isinstance(buffer, str):
+        buffer = memoryview(buffer).tobytes()
+    messages = []
+    append = messages.append
+    find = buffer.find
+    while True:
+        eol = find('\n', start)
+        if eol == -1:
+            break
+        end = eol
+        if end > start and buffer[end-1] == '\r':
+            end -= 1
+        if end > start:
+            append(Message(buffer, start, end))
+        start = eol + 1
+    return messages, start
@@ -2,6 +2,7 @@
 #
 # Unit tests for wireproto
 
+import threading
 import unittest
 import wireproto
 
@@ -27,6 +28,36 @@ class TestWireproto(unittest.TestCase):
             wireproto.encode('PRIVMSG', 'arg1', u'arg2', u'arg3 with €'),
             'PRIVMSG arg1 arg2 :arg3 with \xe2\x82\xac\r\n')
 
+    def testBatchEncoding(self):
+        """Message encoding into buffers"""
+        messages = [('notice',), ('join', '#bleh'),
+                    ('privmsg', 'arg1', 'arg2 with spaces'),
+                    ('PRIVMSG', 'arg1', u'arg2', u'arg3 with €')]
+        expected = ''.join(wireproto.encode(*m) for m in messages)
+
+        buf = wireproto.encode_many(messages)
+        self.assert_(isinstance(buf, bytearray))
+        self.assertEquals(str(buf), expected)
+
+        # Encoding appends to existing buffers.
+        buf = bytearray('PING\r\n')
+        self.assert_(wireproto.encode_many(messages, buf) is buf)
+        self.assertEquals(str(buf), 'PING\r\n' + expected)
+
+        buf = bytearray()
+        wireproto.encode_into(buf, 'privmsg', 'arg1', 'arg2')
+        self.assertEquals(str(buf), 'PRIVMSG arg1 :arg2\r\n')
+
+        # Broken messages are not partially encoded.
+        self.assertRaises(wireproto.EncodeArgumentError,
+                          wireproto.encode_into, buf,
+                          'privmsg', 'arg1 with spaces', 'arg2')
+        self.assertEquals(str(buf), 'PRIVMSG arg1 :arg2\r\n')
+        self.assertRaises(wireproto.EncodeArgumentError,
+                          wireproto.encode_many,
+                          [('ping', 'a'), ('privmsg', 'a b', 'c')], buf)
+        self.assertEquals(str(buf), 'PRIVMSG arg1 :arg2\r\nPING  :a\r\n')
+
     def checkMessage(self, message, hostmask=None, nick=None, user=None,
                      host=None, command=None, args=None, colon_arg=False):
         self.assert_(isinstance(message, wireproto.Message))
@@ -55,3 +86,158 @@ class TestWireproto(unittest.TestCase):
             hostmask='Dave`!dave@natulte.net', nick='Dave`', user='dave',
             host='natulte.net', command='PRIVMSG', args=['#foo', 'Hi !'],
             colon_arg=True)
+
+    def testDecodeMany(self):
+        """Batch message decoding"""
+        data = (':irc.server.com 005 foo NICKLEN=9 :are supported\r\n'
+                'PING :irc.server.com\n'
+                '\r\n'
+                ':Dave`!dave@natulte.net PRIVMSG #foo :Hi !\r\n'
+                ':irc.server.com 353 foo = #f')
+        for buf in (data, bytearray(data)):
+            messages, offset = wireproto.decode_many(buf)
+            self.assertEquals(len(messages), 3)
+            self.checkMessage(
+                messages[0], hostmask='irc.server.com',
+                host='irc.server.com', command='005',
+                args=['foo', 'NICKLEN=9', 'are supported'], colon_arg=True)
+            self.checkMessage(
+                messages[1], command='PING', args=['irc.server.com'],
+                colon_arg=True)
+            self.checkMessage(
+                messages[2], hostmask='Dave`!dave@natulte.net', nick='Dave`',
+                user='dave', host='natulte.net', command='PRIVMSG',
+                args=['#foo', 'Hi !'], colon_arg=True)
+            self.assertEquals(data[offset:], ':irc.server.com 353 foo = #f')
+
+        # Decoding can resume from an offset.
+        messages, offset = wireproto.decode_many(data, 50)
+        self.assertEquals([m.command for m in messages], ['PING', 'PRIVMSG'])
+
+        # Nothing to decode.
+        self.assertEquals(wireproto.decode_many(''), ([], 0))
+        self.assertEquals(wireproto.decode_many('PIN'), ([], 0))
+
+    def testLazyDecoding(self):
+        """Messages are parsed on demand"""
+        m = wireproto.decode(':Dave`!dave@natulte.net  privmsg #foo :Hi !')
+        self.assertFalse(hasattr(m, '__dict__'))
+        self.assertEquals(m.command, 'PRIVMSG')
+        # Nothing beyond the command has been parsed yet.
+        self.assertRaises(AttributeError, object.__getattribute__, m, 'args')
+        self.assertRaises(AttributeError, object.__getattribute__, m, 'nick')
+        self.checkMessage(
+            m, hostmask='Dave`!dave@natulte.net', nick='Dave`', user='dave',
+            host='natulte.net', command='PRIVMSG', args=['#foo', 'Hi !'],
+            colon_arg=True)
+        self.assertRaises(AttributeError, getattr, m, 'bleh')
+
+    def testSharedDecoding(self):
+        """Threads never see a half-parsed message"""
+        messages = [wireproto.decode(':nick!user@host PRIVMSG #a :hi')
+                    for i in xrange(5000)]
+        seen = []
+        def read():
+            for m in messages:
+                seen.append((m.nick, m.host, len(m.args)))
+        threads = [threading.Thread(target=read) for i in xrange(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEquals(set(seen), set([('nick', 'host', 2)]))
+
+    def testSniffCommand(self):
+        """Command sniffing"""
+        self.assertEquals(wireproto.sniff_command('PRIVMSG foo bar'),
+                          'PRIVMSG')
+        self.assertEquals(wireproto.sniff_command('ping'), 'PING')
+        self.assertEquals(
+            wireproto.sniff_command(':irc.server.com  353 foo :bar'), 353)
+        self.assertEquals(wireproto.sniff_command(':irc.server.com'), '')
+
+    def testCommandCodes(self):
+        """Messages carry interned command codes"""
+        m = wireproto.decode(
+            ':irc.server.com 005 foo NICKLEN=9 :are supported')
+        self.assertEquals(m.code, 5)
+        self.assert_(m.command is wireproto.decode('005').command)
+        m = wireproto.decode('privmsg #foo :bar')
+        self.assertEquals(m.code, 'PRIVMSG')
+        self.assertEquals(m.command, 'PRIVMSG')
+        self.assertEquals(wireproto.sniff_command('privmsg #foo :bar'),
+                          'PRIVMSG')
+        self.assertEquals(wireproto.sniff_command(':irc 376 foo :End'), 376)
+
+    def testEncodeSplit(self):
+        """Splitting long messages"""
+        def relayed(lines, hostmask):
+            return [':%s %s' % (hostmask, line) for line in lines]
+        hostmask = 'nick!user@host.example.com'
+
+        self.assertEquals(wireproto.encode_split('privmsg', '#foo', 'hi'),
+                          ['PRIVMSG #foo :hi\r\n'])
+
+        # Every line fits once relayed, split between words.
+        text = ' '.join(['word%d' % i for i in xrange(200)])
+        lines = wireproto.encode_split('PRIVMSG', '#foo', text, hostmask)
+        self.assertEquals(len(lines), 4)
+        for line in relayed(lines, hostmask):
+            self.assert_(len(line) <= 512)
+        self.assertEquals(' '.join(wireproto.decode(l[:-2]).args[-1]
+                                   for l in lines), text)
+
+        # Without a hostmask, room is kept for a long one, such as a
+        # 30 character nick with a cloaked host.
+        cloaked = 'n' * 30 + '!~user@' + 'c' * 50
+        self.assertEquals(len(cloaked), 87)
+        lines = wireproto.encode_split('PRIVMSG', '#foo', 'x' * 1000)
+        self.assertEquals(len(lines), 3)
+        for line in relayed(lines, cloaked):
+            self.assert_(len(line) <= 512)
+        # The length of the hostmask is enough.
+        self.assertEquals(
+            wireproto.encode_split('PRIVMSG', '#foo', 'x' * 1000, 87),
+            wireproto.encode_split('PRIVMSG', '#foo', 'x' * 1000, cloaked))
+
+        # Word boundaries aren't worth an extra line.
+        budget = 512 - len(':%s PRIVMSG #foo :\r\n' % hostmask)
+        text = 'a' * (budget - 2) + ' ' + 'b' * (budget + 1)
+        lines = wireproto.encode_split('PRIVMSG', '#foo', text, hostmask)
+        self.assertEquals(len(lines), 2)
+
+        # UTF-8 characters are never split.
+        text = u'\xe9t\xe9 ' * 200
+        lines = wireproto.encode_split('PRIVMSG', '#foo', text, hostmask)
+        for line in lines:
+            line.decode('utf-8')
+        lines = wireproto.encode_split('PRIVMSG', '#foo', u'€' * 300,
+                                       hostmask)
+        self.assertEquals(''.join(wireproto.decode(l[:-2]).args[-1]
+                                  for l in lines).decode('utf-8'),
+                          u'€' * 300)
+
+    def testEncodeFanout(self):
+        """Coalescing messages to many targets"""
+        targets = ['#chan%d' % i for i in xrange(10)]
+        self.assertEquals(
+            wireproto.encode_fanout('notice', targets[:5], 'hi', 2),
+            ['NOTICE #chan0,#chan1 :hi\r\n',
+             'NOTICE #chan2,#chan3 :hi\r\n',
+             'NOTICE #chan4 :hi\r\n'])
+        self.assertEquals(wireproto.encode_fanout('PRIVMSG', [], 'hi', 4), [])
+
+        # Lines stay within the length limit.
+        targets = ['#%s%d' % ('x' * 40, i) for i in xrange(100)]
+        lines = wireproto.encode_fanout('PRIVMSG', targets, 'y' * 200, 1000)
+        self.assertEquals(len(lines), 17)
+        for line in lines:
+            self.assert_(len(line) <= 512)
+        sent = [wireproto.decode(l[:-2]).args[0].split(',') for l in lines]
+        self.assertEquals(sum(sent, []), targets)
+
+        # Long texts are split, each group getting every part in order.
+        lines = wireproto.encode_fanout('PRIVMSG', ['#a', '#b', '#c'],
+                                        'z' * 700, 2)
+        self.assertEquals([wireproto.decode(l[:-2]).args[0] for l in lines],
+                          ['#a,#b', '#a,#b', '#c', '#c'])
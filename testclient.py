@@ -10,4 +10,4 @@ else:
     host, port = 'irc.rezosup.org', 6667
 
 s = Server(host, port, 'daive', 'bleh')
-asyncore.loop()
+asyncore.loop(timeout=1)